@@ -0,0 +1,207 @@
+"""会話メモリの要約をリクエスト経路の外で行うコンパクタ。
+
+`ConversationSummaryBufferMemory` は `save_context()` の中で同期的に prune
+（溢れた発話の要約＝LLM 呼び出し）を行い、`chat_memory` へ直接積んだ発話は
+次の応答まで prune されない。ここでは
+
+- 溢れた発話をバッファから外す処理だけはその場で行い（トークン数は
+  `app.agent.tokens` のローカル見積もりで、新しく積まれた発話だけ数える）、
+  バッファを常に `max_token_limit` 以下に保つ
+- 外した発話は「要約待ち」として持ち、バックグラウンドのスレッドが
+  `batch_delay` 秒ぶんまとめて `summary_llm` で要約に畳み込む
+
+ので、`respond()` が過去の発話の要約を待つことはない。要約待ちの発話は
+要約が終わるまでプロンプトに入らない。
+
+常駐上限で追い出された会話メモリの要約（`park()`）も同じスレッドで行う。
+通常の畳み込みと同じスレッドなので、要約待ちの発話を取り合うことはない。
+"""
+from __future__ import annotations
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain_core.messages import BaseMessage
+from pydantic import PrivateAttr
+
+from app.agent.tokens import default_estimator
+from app.metrics import call_site, record_fallback
+
+logger = logging.getLogger(__name__)
+
+
+class CompactingSummaryMemory(ConversationSummaryBufferMemory):
+    """prune() で要約せず、溢れた分をコンパクタへ回す ConversationSummaryBufferMemory。"""
+
+    compactor: Optional[Any] = None
+    # 1メッセージのトークン数（既定はローカル見積もり。None なら llm の countTokens）
+    token_counter: Optional[Callable[[BaseMessage], int]] = default_estimator.count_message
+
+    _lock: threading.RLock = PrivateAttr(default_factory=threading.RLock)
+    _token_counts: Dict[int, int] = PrivateAttr(default_factory=dict)
+    _counted: int = PrivateAttr(default=0)  # バッファ先頭から数え済みの件数
+    _buffer_tokens: int = PrivateAttr(default=0)
+    _pending: List[BaseMessage] = PrivateAttr(default_factory=list)
+
+    def _count(self, message: BaseMessage) -> int:
+        if self.token_counter is not None:
+            return self.token_counter(message)
+        return self.llm.get_num_tokens_from_messages([message])
+
+    def prune(self) -> None:
+        if self.compactor is None:
+            super().prune()
+            return
+        with self._lock:
+            buffer = self.chat_memory.messages
+            if self._counted > len(buffer):
+                # 外から消された（clear など）ので数え直す
+                self._token_counts.clear()
+                self._counted = self._buffer_tokens = 0
+            # 新しく積まれた発話だけ数える（数えた分だけ進める）
+            fresh = buffer[self._counted:]
+            for m in fresh:
+                n = self._count(m)
+                self._token_counts[id(m)] = n
+                self._buffer_tokens += n
+            self._counted += len(fresh)
+
+            cut = 0
+            while self._buffer_tokens > self.max_token_limit and cut < len(buffer):
+                n = self._token_counts.pop(id(buffer[cut]), None)
+                if n is None:
+                    # 数え漏れ（ロックの外で積まれた発話など）は合計に入っていない
+                    n = self._count(buffer[cut])
+                    self._buffer_tokens += n
+                self._buffer_tokens -= n
+                cut += 1
+            if not cut:
+                return
+            self._pending.extend(buffer[:cut])
+            del buffer[:cut]
+            self._counted -= cut
+        self.compactor.notify(self)
+
+    def add_text(self, text: str, as_user: bool = True) -> None:
+        """発話を積んで prune する（数えている途中に積まれないようロックの中で）。"""
+        with self._lock:
+            if as_user:
+                self.chat_memory.add_user_message(text)
+            else:
+                self.chat_memory.add_ai_message(text)
+            self.prune()
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        with self._lock:
+            super().save_context(inputs, outputs)
+
+    def take_pending(self) -> List[BaseMessage]:
+        """要約待ちの発話を取り出す（以後は呼び出し側が要約に畳み込む）。"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            return pending
+
+    def fold(self, messages: List[BaseMessage]) -> None:
+        """messages を要約に畳み込む（LLM 呼び出し。ロックの外で行う）。"""
+        if not messages:
+            return
+        with call_site("summary"):
+            self.moving_summary_buffer = self.predict_new_summary(messages, self.moving_summary_buffer)
+
+    def summarize_all(self) -> str:
+        """要約・要約待ち・バッファを1つの要約文にまとめて返す（メモリ自体は変えない）。"""
+        with self._lock:
+            messages = list(self._pending) + list(self.chat_memory.messages)
+            summary = self.moving_summary_buffer or ""
+        if not messages:
+            return summary
+        try:
+            with call_site("summary"):
+                return self.predict_new_summary(messages, summary)
+        except Exception:
+            record_fallback("summary")
+            # 要約に失敗したら直近の発話をそのまま残す
+            tail = "\n".join(f"{m.type}: {m.content}" for m in messages[-6:])
+            return f"{summary}\n{tail}".strip()
+
+    def clear(self) -> None:
+        super().clear()
+        with self._lock:
+            self._token_counts.clear()
+            self._counted = self._buffer_tokens = 0
+            self._pending = []
+
+
+class MemoryCompactor:
+    """要約待ちのあるメモリを受け取り、バックグラウンドで要約する。"""
+
+    def __init__(self, batch_delay: float = 1.0) -> None:
+        self.batch_delay = batch_delay
+        self._cond = threading.Condition()
+        self._dirty: "OrderedDict[int, CompactingSummaryMemory]" = OrderedDict()
+        self._parks: Deque[Tuple[CompactingSummaryMemory, Callable[[str], None]]] = deque()
+        self._stopped = False
+        self.folded_messages = 0
+        self.failures = 0
+        self._thread = threading.Thread(target=self._run, name="memory-compactor", daemon=True)
+        self._thread.start()
+
+    def notify(self, mem: CompactingSummaryMemory) -> None:
+        with self._cond:
+            self._dirty[id(mem)] = mem
+            self._cond.notify()
+
+    def park(self, mem: CompactingSummaryMemory, done: Callable[[str], None]) -> None:
+        """追い出したメモリを要約し、要約文を done に渡す（呼び出し元は待たない）。"""
+        with self._cond:
+            self._parks.append((mem, done))
+            self._cond.notify()
+
+    def _park(self, mem: CompactingSummaryMemory, done: Callable[[str], None]) -> None:
+        try:
+            done(mem.summarize_all())
+        except Exception:
+            logger.exception("parking a conversation memory failed")
+
+    def compact(self, mem: CompactingSummaryMemory) -> None:
+        """mem の要約待ちを要約に畳み込む。失敗したら戻して次回に回す。"""
+        pending = mem.take_pending()
+        if not pending:
+            return
+        try:
+            mem.fold(pending)
+            self.folded_messages += len(pending)
+        except Exception:
+            self.failures += 1
+            logger.exception("background summarization failed; will retry")
+            with mem._lock:
+                mem._pending[:0] = pending
+            self.notify(mem)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._dirty and not self._parks and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                parks, self._parks = list(self._parks), deque()
+            for mem, done in parks:
+                self._park(mem, done)
+            if not self._dirty:
+                continue
+            # 続けて届く発話を1回の要約にまとめるため少し待つ
+            with self._cond:
+                self._cond.wait_for(lambda: self._stopped, timeout=self.batch_delay)
+                batch = list(self._dirty.values())
+                self._dirty.clear()
+            for mem in batch:
+                self.compact(mem)
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join(timeout=5)
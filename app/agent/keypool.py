@@ -0,0 +1,222 @@
+"""複数の Gemini API キーを使い分けるスケジューラ。
+
+- キーごとにトークンバケット（`rpm` 回/分、`burst` 回まで溜められる）を持ち、
+  呼び出しのたびに残りの多いキーを選ぶ
+- 429 / ResourceExhausted を受けたキーは指数バックオフ（ジッター付き）の間
+  選ばない。例外から待つ秒数（`Retry-After` ヘッダ、Gemini の `retryDelay` /
+  「Please retry in 12.3s」）が読み取れればそれを優先する（`retry_after_seconds()`）
+- 対話（interactive）の呼び出しが待っている間は、バックグラウンド（要約など）
+  の呼び出しにはキーを渡さない
+
+キーは役割（応答用・要約用）ごとに別のリストを渡せる。同じキーが両方の
+リストにあれば、1つのバケットを共有する。
+"""
+from __future__ import annotations
+import os
+import random
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+
+class KeyPoolExhausted(RuntimeError):
+    """期限内に使えるキーが空かなかった。"""
+
+
+_RATE_LIMIT_TYPES = ("ResourceExhausted", "TooManyRequests", "RateLimitError")
+# google.api_core の例外は "429 <message>" の形で文字列になる
+_LEADING_429 = re.compile(r"^\s*429\b")
+_RETRY_DELAY = (
+    re.compile(r"retry in (\d+(?:\.\d+)?)\s*s", re.IGNORECASE),  # "Please retry in 12.3s."
+    re.compile(r"retryDelay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s"),  # "retryDelay": "12s"
+    re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)"),  # RetryInfo の proto 表記
+)
+
+
+def _chain(error: BaseException) -> List[BaseException]:
+    """error と、その原因（__cause__ / __context__）を5段まで。"""
+    out: List[BaseException] = []
+    e: Optional[BaseException] = error
+    while e is not None and len(out) < 5:
+        out.append(e)
+        e = e.__cause__ or e.__context__
+    return out
+
+
+def _status_code(e: BaseException) -> Optional[int]:
+    for obj in (e, getattr(e, "response", None)):
+        for attr in ("code", "status_code", "status"):
+            value = getattr(obj, attr, None)
+            if isinstance(value, int):  # HTTPStatus も int
+                return int(value)
+    return None
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    """429 / ResourceExhausted 系の例外か（ラップされていても原因をたどる）。
+
+    例外の型名・ステータスコード・先頭の "429"・RESOURCE_EXHAUSTED だけを見る
+    （本文のどこかに 429 が含まれるだけの 500 などは数えない）。
+    """
+    for e in _chain(error):
+        if type(e).__name__ in _RATE_LIMIT_TYPES or _status_code(e) == 429:
+            return True
+        text = str(e)
+        if _LEADING_429.match(text) or "RESOURCE_EXHAUSTED" in text:
+            return True
+    return False
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """429 の例外から「何秒後に再試行してよいか」を読む。読めなければ None。"""
+    for e in _chain(error):
+        value = getattr(e, "retry_after", None)
+        if isinstance(value, (int, float)):
+            return max(0.0, float(value))
+        headers = getattr(getattr(e, "response", None), "headers", None) or {}
+        try:
+            return max(0.0, float(headers.get("Retry-After")))
+        except (TypeError, ValueError, AttributeError):
+            pass
+        text = str(e)
+        for pattern in _RETRY_DELAY:
+            m = pattern.search(text)
+            if m:
+                return float(m.group(1))
+    return None
+
+
+def keys_from_env(role: str) -> List[str]:
+    """GEMINI_API_KEYS_<ROLE>（カンマ区切り）か GEMINI_API_KEY_<ROLE> を読む。"""
+    role = role.upper()
+    raw = os.environ.get(f"GEMINI_API_KEYS_{role}") or os.environ.get(f"GEMINI_API_KEY_{role}") or ""
+    keys: List[str] = []
+    for k in raw.split(","):
+        k = k.strip()
+        if k and k not in keys:
+            keys.append(k)
+    return keys
+
+
+class _KeyState:
+    __slots__ = ("tokens", "updated", "cooldown_until", "strikes", "calls", "rate_limited")
+
+    def __init__(self, burst: float) -> None:
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.cooldown_until = 0.0
+        self.strikes = 0
+        self.calls = 0
+        self.rate_limited = 0
+
+
+class KeyScheduler:
+    def __init__(
+        self,
+        rpm: float = 15.0,
+        burst: float = 5.0,
+        backoff_base: float = 2.0,
+        backoff_max: float = 60.0,
+    ) -> None:
+        self.rate = rpm / 60.0
+        self.burst = max(1.0, burst)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._cond = threading.Condition()
+        self._keys: Dict[str, _KeyState] = {}
+        self._interactive_waiting = 0
+
+    @classmethod
+    def from_env(cls) -> "KeyScheduler":
+        """GEMINI_KEY_RPM / GEMINI_KEY_BURST から組み立てる。"""
+        return cls(
+            rpm=float(os.environ.get("GEMINI_KEY_RPM", "15")),
+            burst=float(os.environ.get("GEMINI_KEY_BURST", "5")),
+        )
+
+    def _state(self, key: str) -> _KeyState:
+        st = self._keys.get(key)
+        if st is None:
+            st = self._keys[key] = _KeyState(self.burst)
+        return st
+
+    def _refill(self, st: _KeyState, now: float) -> None:
+        st.tokens = min(self.burst, st.tokens + (now - st.updated) * self.rate)
+        st.updated = now
+
+    def acquire(self, keys: Sequence[str], interactive: bool = True, timeout: float = 30.0) -> str:
+        """keys のうち今使えるものを1つ選んでトークンを消費する。空くまで待つ。"""
+        if not keys:
+            raise KeyPoolExhausted("no API keys configured")
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if interactive:
+                self._interactive_waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = deadline - now
+                    if interactive or not self._interactive_waiting:
+                        best: Optional[str] = None
+                        for k in keys:
+                            st = self._state(k)
+                            self._refill(st, now)
+                            if st.cooldown_until > now:
+                                wait = min(wait, st.cooldown_until - now)
+                                continue
+                            if st.tokens >= 1.0:
+                                if best is None or st.tokens > self._keys[best].tokens:
+                                    best = k
+                            else:
+                                wait = min(wait, (1.0 - st.tokens) / self.rate if self.rate else wait)
+                        if best is not None:
+                            st = self._keys[best]
+                            st.tokens -= 1.0
+                            st.calls += 1
+                            return best
+                    if deadline - now <= 0:
+                        raise KeyPoolExhausted(f"no API key available within {timeout:.1f}s")
+                    self._cond.wait(max(0.01, wait))
+            finally:
+                if interactive:
+                    self._interactive_waiting -= 1
+                    self._cond.notify_all()
+
+    def report_rate_limited(self, key: str, retry_after: Optional[float] = None) -> float:
+        """key が 429 を返した。しばらく使わない（その秒数を返す）。"""
+        with self._cond:
+            st = self._state(key)
+            st.strikes += 1
+            st.rate_limited += 1
+            if retry_after is None:
+                delay = min(self.backoff_max, self.backoff_base * (2 ** (st.strikes - 1)))
+                # ジッターで複数キー/プロセスが同時に復帰しないようにする
+                delay *= random.uniform(0.5, 1.0)
+            else:
+                delay = retry_after
+            st.cooldown_until = time.monotonic() + delay
+            st.tokens = 0.0
+            return delay
+
+    def report_success(self, key: str) -> None:
+        with self._cond:
+            st = self._state(key)
+            if st.strikes:
+                st.strikes = 0
+                self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """キー（末尾4文字）ごとの残トークン・クールダウン残り・呼び出し数。"""
+        now = time.monotonic()
+        with self._cond:
+            out = {}
+            for k, st in self._keys.items():
+                self._refill(st, now)
+                out[f"...{k[-4:]}"] = {
+                    "tokens": round(st.tokens, 2),
+                    "cooldown_sec": round(max(0.0, st.cooldown_until - now), 2),
+                    "calls": st.calls,
+                    "rate_limited": st.rate_limited,
+                }
+            return out
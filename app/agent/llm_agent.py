@@ -4,17 +4,44 @@ Slack での会話ごとにメモリを保持するため、`ConversationBufferM
 ローリング要約を組み合わせた `ConversationSummaryBufferMemory` を用いて
 コンテキストを管理する。応答生成と要約には別々の Gemini API キーを
 使用する。
+
+メモリは会話キー（チャンネル、設定によりスレッド単位）ごとに分け、
+常駐数の上限を超えたものは LRU で追い出す。追い出したメモリは
+`MemoryCompactor` がバックグラウンドで要約文にし、以後は要約文だけを残す。
+次にそのキーが使われたときは要約から復元する（要約がまだ終わっていなければ
+追い出したメモリをそのまま戻す）。追い出しを起こした呼び出し（`remember()`
+や別チャンネルへの `respond()`）が要約を待つことはない。
+
+溢れた発話の要約は `MemoryCompactor` がバックグラウンドで行う
+（`app/agent/compactor.py`）。同じプロンプトが同じメモリ状態で来たときは
+応答キャッシュから返す（`app/agent/response_cache.py`）。
+
+langchain / Gemini クライアントは起動を速くするため最初に使うときに
+読み込む（`warm_up()` で前倒しもできる）。
 """
 
 from __future__ import annotations
 
+import importlib
 import os
-from typing import Optional
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+
+from app.agent.keypool import KeyScheduler, keys_from_env
+from app.agent.response_cache import CachedChatModel, respond_key
+from app.cache import TTLCache
+from app.metrics import callback_handler, record_fallback
+from app.singleflight import canonical_key, flights
 
-from langchain.chains import ConversationChain
-from langchain.memory import ConversationSummaryBufferMemory
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_google_genai import ChatGoogleGenerativeAI
+if TYPE_CHECKING:
+    from langchain.chains import ConversationChain
+    from langchain.prompts import ChatPromptTemplate
+
+    from app.agent.compactor import CompactingSummaryMemory, MemoryCompactor
+    from app.agent.pooled_model import PooledChatModel
+
+DEFAULT_KEY = "default"
 
 
 class LLMAgent:
@@ -26,93 +53,307 @@ class LLMAgent:
         system_prompt: Optional[str] = None,
         model: Optional[str] = None,
         max_token_limit: int = 1000,
+        max_resident: Optional[int] = None,
+        max_dormant: int = 1024,
+        per_thread: Optional[bool] = None,
     ) -> None:
         self.name = name
         self.system_prompt = (
             system_prompt or "あなたは飲み会の幹事AIです。参加者の希望を整理し、日時/場所/店を丁寧に提案します。"
         )
 
-        main_key = os.environ.get("GEMINI_API_KEY_MAIN")
-        summary_key = os.environ.get("GEMINI_API_KEY_SUMMARY")
-        if not main_key or not summary_key:
+        # 役割ごとにキーを複数持てる（GEMINI_API_KEYS_MAIN / GEMINI_API_KEYS_SUMMARY はカンマ区切り）
+        main_keys = keys_from_env("main")
+        summary_keys = keys_from_env("summary")
+        if not main_keys or not summary_keys:
             raise RuntimeError(
                 "GEMINI_API_KEY_MAIN and GEMINI_API_KEY_SUMMARY must be set"
             )
 
-        model_name = model or os.environ.get("GEMINI_MODEL", "gemini-2.5-flash-lite")
-        self.main_llm = ChatGoogleGenerativeAI(
-            model=model_name, google_api_key=main_key
-        )
-        self.summary_llm = ChatGoogleGenerativeAI(
-            model=model_name, google_api_key=summary_key
+        self.model_name = model or os.environ.get("GEMINI_MODEL", "gemini-2.5-flash-lite")
+        self._main_keys = main_keys
+        self._summary_keys = summary_keys
+        # キーごとのレート制御（両方の役割で共有。応答を要約より優先する）
+        self.key_scheduler = KeyScheduler.from_env()
+        # クライアント等は初回アクセス時に作る（_lazy）
+        self._init_lock = threading.Lock()
+        self._main_llm: Optional["PooledChatModel"] = None
+        self._summary_llm: Optional["PooledChatModel"] = None
+        self._cached_llm: Optional[CachedChatModel] = None
+        self._compactor: Optional["MemoryCompactor"] = None
+        self._prompt: Optional["ChatPromptTemplate"] = None
+
+        # 応答キャッシュ（LLM_CACHE_TTL=0 で無効、LLM_CACHE_PATH で再起動をまたいで保持）
+        self.response_cache = TTLCache(
+            ttl=float(os.environ.get("LLM_CACHE_TTL", "600")),
+            max_bytes=int(os.environ.get("LLM_CACHE_MAX_BYTES", str(4 * 1024 * 1024))),
+            path=os.environ.get("LLM_CACHE_PATH") or None,
         )
 
         self.max_token_limit = max_token_limit
-        self.chain: Optional[ConversationChain] = None
-        self._memory: Optional[ConversationSummaryBufferMemory] = None
-
-        # 会話時に使用する共通プロンプト
-        self.prompt = ChatPromptTemplate.from_messages(
-            [
-                ("system", self.system_prompt),
-                MessagesPlaceholder("history"),
-                ("human", "{input}"),
-            ]
+        # 常駐させる会話メモリの上限（超えたら最も使われていないものを要約して退避）
+        self.max_resident = max_resident or int(os.environ.get("LLM_MAX_RESIDENT_MEMORIES", "64"))
+        # 退避済み要約の保持上限（超えたら古いものから捨てる）
+        self.max_dormant = max_dormant
+        # True ならスレッドごとに会話を分ける
+        if per_thread is None:
+            per_thread = os.environ.get("LLM_MEMORY_PER_THREAD") == "1"
+        self.per_thread = per_thread
+
+        self._chains: "OrderedDict[str, ConversationChain]" = OrderedDict()
+        self._dormant: "OrderedDict[str, str]" = OrderedDict()
+        # 追い出し済みで要約待ちのメモリ（要約が終わると _dormant へ移る）
+        self._parked: "Dict[str, CompactingSummaryMemory]" = {}
+        self._pool_lock = threading.Lock()
+
+    # ---------- 遅延初期化 ----------
+    def _lazy(self, attr: str, factory: Callable[[], Any]) -> Any:
+        value = getattr(self, attr)
+        if value is None:
+            with self._init_lock:
+                value = getattr(self, attr)
+                if value is None:
+                    value = factory()
+                    setattr(self, attr, value)
+        return value
+
+    def _client(self, keys: List[str], name: str, interactive: bool) -> "PooledChatModel":
+        from app.agent.pooled_model import PooledChatModel
+
+        chat_class = os.environ.get("LLM_CHAT_CLASS")
+        if chat_class:
+            # "module:Class" 形式でチャットモデルを差し替える（tests.fakes.fake_gemini など）
+            module_name, _, class_name = chat_class.partition(":")
+            Chat = getattr(importlib.import_module(module_name), class_name)
+        else:
+            from langchain_google_genai import ChatGoogleGenerativeAI as Chat
+
+        # 429 のリトライはプール側で別キーに振り替えて行う
+        clients = {k: Chat(model=self.model_name, google_api_key=k, max_retries=1) for k in keys}
+        # 呼び出しごとのレイテンシ・トークン数を app.metrics に記録する
+        return PooledChatModel(
+            clients=clients,
+            scheduler=self.key_scheduler,
+            model=self.model_name,
+            interactive=interactive,
+            deadline_sec=30.0 if interactive else 120.0,
+            callbacks=[callback_handler(name)],
         )
 
-    def _get_chain(self) -> ConversationChain:
-        """単一チャンネル用のチェーンを返す。"""
+    @property
+    def main_llm(self) -> "PooledChatModel":
+        return self._lazy("_main_llm", lambda: self._client(self._main_keys, "main", interactive=True))
+
+    @property
+    def summary_llm(self) -> "PooledChatModel":
+        return self._lazy("_summary_llm", lambda: self._client(self._summary_keys, "summary", interactive=False))
+
+    @property
+    def cached_llm(self) -> CachedChatModel:
+        """会話メモリを使わない直接呼び出し（意図理解など）用。"""
+        return self._lazy("_cached_llm", lambda: CachedChatModel(self.main_llm, self.response_cache))
+
+    @property
+    def compactor(self) -> "MemoryCompactor":
+        """溢れた発話の要約はリクエスト経路の外で行う。"""
+
+        def factory() -> "MemoryCompactor":
+            from app.agent.compactor import MemoryCompactor
+
+            return MemoryCompactor(batch_delay=float(os.environ.get("LLM_COMPACT_DELAY", "1.0")))
+
+        return self._lazy("_compactor", factory)
+
+    @property
+    def prompt(self) -> "ChatPromptTemplate":
+        """会話時に使用する共通プロンプト。"""
+
+        def factory() -> "ChatPromptTemplate":
+            from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+            return ChatPromptTemplate.from_messages(
+                [
+                    ("system", self.system_prompt),
+                    MessagesPlaceholder("history"),
+                    ("human", "{input}"),
+                ]
+            )
+
+        return self._lazy("_prompt", factory)
+
+    def warm_up(self) -> None:
+        """langchain の読み込みとクライアント生成を前倒しで済ませる。"""
+        from langchain.chains import ConversationChain  # noqa: F401
 
-        if self.chain is None:
-            self._memory = ConversationSummaryBufferMemory(
+        from app.agent.compactor import CompactingSummaryMemory  # noqa: F401
+
+        for attr in ("main_llm", "summary_llm", "prompt", "compactor", "cached_llm"):
+            getattr(self, attr)
+
+    def key_for(self, channel_id: Optional[str], thread_ts: Optional[str] = None) -> str:
+        """Slack のチャンネル（とスレッド）から会話キーを作る。"""
+        if not channel_id:
+            return DEFAULT_KEY
+        if self.per_thread and thread_ts:
+            return f"{channel_id}:{thread_ts}"
+        return channel_id
+
+    def _new_chain(
+        self, summary: str = "", memory: Optional["CompactingSummaryMemory"] = None
+    ) -> "ConversationChain":
+        from langchain.chains import ConversationChain
+
+        from app.agent.compactor import CompactingSummaryMemory
+
+        if memory is None:
+            memory = CompactingSummaryMemory(
                 llm=self.summary_llm,
+                compactor=self.compactor,
                 max_token_limit=self.max_token_limit,
                 return_messages=True,
                 memory_key="history",
             )
-            self.chain = ConversationChain(
-                llm=self.main_llm,
-                memory=self._memory,
-                prompt=self.prompt,
-                verbose=False,
-            )
-        return self.chain
+            if summary:
+                memory.moving_summary_buffer = summary
+        return ConversationChain(
+            llm=self.main_llm,
+            memory=memory,
+            prompt=self.prompt,
+            verbose=False,
+        )
 
-    def _get_memory(self) -> ConversationSummaryBufferMemory:
-        """内部メモリへのアクセス（未初期化なら初期化）。"""
-        if self._memory is None:
-            _ = self._get_chain()
-        return self._memory  # type: ignore[return-value]
+    def _get_chain(self, key: str = DEFAULT_KEY) -> "ConversationChain":
+        """会話キーごとのチェーンを返す（無ければ退避済みの要約かメモリから復元して作る）。"""
+        evicted = []
+        with self._pool_lock:
+            chain = self._chains.get(key)
+            if chain is not None:
+                self._chains.move_to_end(key)
+                return chain
+            parked = self._parked.pop(key, None)
+            if parked is not None:
+                # 要約がまだ終わっていない → 追い出したメモリ（生の発話）をそのまま戻す
+                chain = self._new_chain(memory=parked)
+            else:
+                chain = self._new_chain(self._dormant.pop(key, ""))
+            self._chains[key] = chain
+            while len(self._chains) > self.max_resident:
+                old_key, old_chain = self._chains.popitem(last=False)
+                self._parked[old_key] = old_chain.memory
+                evicted.append((old_key, old_chain.memory))
+        # 要約（LLM 呼び出し）はコンパクタのスレッドで行い、ここでは待たない
+        for old_key, mem in evicted:
+            self.compactor.park(mem, lambda summary, k=old_key, m=mem: self._parked_done(k, m, summary))
+        return chain
 
-    def remember(self, text: str, as_user: bool = True) -> None:
+    def _parked_done(self, key: str, mem: "CompactingSummaryMemory", summary: str) -> None:
+        """追い出したメモリの要約ができた。まだ戻されていなければ要約文だけ残す。"""
+        with self._pool_lock:
+            if self._parked.get(key) is not mem:
+                # 要約中に同じキーが再び使われた（メモリはそちらで生きている）
+                return
+            del self._parked[key]
+            if not summary:
+                return
+            self._dormant[key] = summary
+            self._dormant.move_to_end(key)
+            while len(self._dormant) > self.max_dormant:
+                self._dormant.popitem(last=False)
+
+    def _get_memory(self, key: str = DEFAULT_KEY) -> "CompactingSummaryMemory":
+        """会話キーのメモリ（未初期化なら初期化）。"""
+        return self._get_chain(key).memory  # type: ignore[return-value]
+
+    def remember(self, text: str, as_user: bool = True, key: str = DEFAULT_KEY) -> None:
         """
         返信せずに“記憶だけ”を積む。@なしの発話や雑談を受動インジェストする用途。
         """
         if not text or not text.strip():
             return
-        mem = self._get_memory()
-        if as_user:
-            mem.chat_memory.add_user_message(text.strip())
-        else:
-            mem.chat_memory.add_ai_message(text.strip())
+        # 上限を超えた分はその場でバッファから外し、要約はコンパクタに任せる
+        self._get_memory(key).add_text(text.strip(), as_user=as_user)
 
-    def respond(self, message: str) -> str:
+    @staticmethod
+    def _error_reply(e: Exception) -> str:
+        return (
+            "エラーが発生しました。少し時間をおいて再試行してください。"
+            f"（詳細: {type(e).__name__})"
+        )
+
+    def respond(self, message: str, key: str = DEFAULT_KEY) -> str:
         """入力メッセージに応答を生成する。"""
 
         if not message or not message.strip():
             return "ご用件を一言で教えてください。"
 
+        text = message.strip()
         try:
-            return self._get_chain().predict(input=message.strip())
+            chain = self._get_chain(key)
+            cached = self.response_cache.get(respond_key(text, chain.memory))
+            if cached is not None:
+                # 今回のやり取りは既にメモリの末尾にあるので積み直さない
+                return cached
+            reply = chain.predict(input=text)
+            self.response_cache.set(respond_key(text, chain.memory), reply)
+            return reply
         except Exception as e:
-            return (
-                "エラーが発生しました。少し時間をおいて再試行してください。"
-                f"（詳細: {type(e).__name__})"
-            )
+            record_fallback()
+            return self._error_reply(e)
 
-    def get_summary(self, max_chars: int = 600) -> str:
+    def respond_stream(
+        self,
+        message: str,
+        key: str = DEFAULT_KEY,
+        on_text: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        """respond() のストリーミング版。
+
+        トークンが届くたびに、それまでの全文を `on_text` に渡す。戻り値と
+        メモリへの保存内容は respond() と同じ（ConversationChain.predict と
+        同じ手順でプロンプトを組み、生成後に save_context する）。
+        """
+
+        if not message or not message.strip():
+            return "ご用件を一言で教えてください。"
+
+        text = message.strip()
+        try:
+            memory = self._get_memory(key)
+            cached = self.response_cache.get(respond_key(text, memory))
+            if cached is not None:
+                return cached
+            history = memory.load_memory_variables({})["history"]
+            messages = self.prompt.format_messages(history=history, input=text)
+            reply = ""
+            for chunk in self.main_llm.stream(messages):
+                piece = chunk.content if isinstance(chunk.content, str) else ""
+                if not piece:
+                    continue
+                reply += piece
+                if on_text is not None:
+                    on_text(reply)
+            memory.save_context({"input": text}, {"response": reply})
+            self.response_cache.set(respond_key(text, memory), reply)
+            return reply
+        except Exception as e:
+            record_fallback()
+            return self._error_reply(e)
+
+    def get_summary(self, key: str = DEFAULT_KEY, max_chars: int = 600) -> str:
         """会話の要約（あれば）を返す。無ければ直近履歴をざっくり連結。"""
-        mem = self._get_memory()
+        # 同じ会話への同時呼び出しは1回にまとめる
+        return flights.do(canonical_key("get_summary", id(self), key, max_chars), self._get_summary, key, max_chars)
+
+    def _get_summary(self, key: str, max_chars: int) -> str:
+        with self._pool_lock:
+            resident = key in self._chains
+            dormant = self._dormant.get(key) if not resident else None
+            parked = self._parked.get(key) if not resident else None
+        if dormant:
+            # 退避中の会話は要約だけで足りるので復元しない
+            return dormant[:max_chars]
+        # 要約待ちの会話は追い出したメモリから読む（常駐には戻さない）
+        mem = parked if parked is not None else self._get_memory(key)
         # LangChainの実装差異吸収
         summary = getattr(mem, "buffer", "") or getattr(mem, "moving_summary_buffer", "")
         if isinstance(summary, str) and summary.strip():
@@ -131,3 +372,11 @@ class LLMAgent:
         except Exception:
             pass
         return ""
+
+    def close(self) -> None:
+        """応答キャッシュを保存し、コンパクタを止める。"""
+        try:
+            self.response_cache.save()
+        finally:
+            if self._compactor is not None:
+                self._compactor.stop()
@@ -0,0 +1,105 @@
+"""複数キーのチャットモデルを `KeyScheduler` で使い分ける LangChain チャットモデル。
+
+ConversationChain / 要約メモリからは普通のチャットモデルに見える。呼び出し
+ごとにスケジューラからキーを借り、429 ならそのキーを（例外に再試行までの
+秒数があればその間、無ければバックオフの間）休ませて別のキー
+（全部休んでいれば一番早く明けるキーを待つ）でやり直す。やり直しは回数では
+なく呼び出し全体の期限（`deadline_sec`）で打ち切り、期限までに成功しなければ
+最後の 429 を投げる。ストリーミングは最初のチャンクが届く前の 429 だけやり直す。
+"""
+from __future__ import annotations
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+from app.agent.keypool import KeyPoolExhausted, KeyScheduler, is_rate_limited, retry_after_seconds
+from app.agent.tokens import default_estimator
+
+
+class PooledChatModel(BaseChatModel):
+    clients: Dict[str, Any]
+    scheduler: Any  # KeyScheduler
+    model: str = ""
+    # True なら対話用（要約などバックグラウンドの呼び出しより先にキーを取る）
+    interactive: bool = True
+    # キー待ち・429 のやり直しを含めた1回の呼び出しの期限（秒）
+    deadline_sec: float = 30.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "pooled-gemini"
+
+    def _pick(self, deadline: float, last: Optional[BaseException]) -> Tuple[str, Any]:
+        """期限までにキーを借りる。429 の後で期限切れなら、その 429 を投げる。"""
+        scheduler: KeyScheduler = self.scheduler
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 and last is not None:
+            raise last
+        try:
+            key = scheduler.acquire(list(self.clients), interactive=self.interactive, timeout=max(0.0, remaining))
+        except KeyPoolExhausted:
+            if last is not None:
+                raise last
+            raise
+        return key, self.clients[key]
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        deadline = time.monotonic() + self.deadline_sec
+        last: Optional[BaseException] = None
+        while True:
+            key, client = self._pick(deadline, last)
+            try:
+                result = client._generate(messages, stop=stop, **kwargs)
+            except Exception as e:
+                if not is_rate_limited(e):
+                    raise
+                self.scheduler.report_rate_limited(key, retry_after_seconds(e))
+                last = e
+                continue
+            self.scheduler.report_success(key)
+            return result
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        deadline = time.monotonic() + self.deadline_sec
+        last: Optional[BaseException] = None
+        while True:
+            key, client = self._pick(deadline, last)
+            started = False
+            try:
+                for chunk in client._stream(messages, stop=stop, **kwargs):
+                    started = True
+                    if run_manager is not None:
+                        run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                    yield chunk
+            except Exception as e:
+                # 途中まで返してしまったものはやり直せない
+                if started or not is_rate_limited(e):
+                    raise
+                self.scheduler.report_rate_limited(key, retry_after_seconds(e))
+                last = e
+                continue
+            self.scheduler.report_success(key)
+            return
+
+    # トークン数はローカルで見積もる（クライアントに聞くと countTokens の往復になる）
+    def get_num_tokens(self, text: str) -> int:
+        return default_estimator.count_text(text)
+
+    def get_num_tokens_from_messages(self, messages: List[BaseMessage], tools: Any = None) -> int:
+        return default_estimator.count_messages(messages)
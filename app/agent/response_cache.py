@@ -0,0 +1,95 @@
+"""LLM 応答キャッシュのキー計算と、`invoke` をキャッシュするラッパー。
+
+会話（`LLMAgent.respond`）のキーは「正規化したプロンプト + メモリ状態の指紋」。
+応答後のメモリ（今回のやり取りを含む状態）の指紋で保存するので、
+ヒットするのは「同じプロンプトが、前回の応答以降メモリが変わらないまま
+再び来た」ときだけになる。そのとき今回のやり取りは既にメモリの末尾にあるため、
+ヒット時はメモリへ積み直さない。
+"""
+from __future__ import annotations
+import hashlib
+import json
+import re
+import unicodedata
+from typing import Any
+
+from app.cache import TTLCache
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_prompt(text: str) -> str:
+    """全角/半角・空白の揺れを吸収する。"""
+    return _SPACES.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def memory_fingerprint(memory: Any) -> str:
+    """プロンプトに入るメモリ内容（要約 + バッファ）の指紋。"""
+    h = hashlib.sha1()
+    h.update((getattr(memory, "moving_summary_buffer", "") or "").encode("utf-8"))
+    for m in memory.chat_memory.messages:
+        h.update(b"\x1e")
+        h.update(m.type.encode("utf-8"))
+        h.update(b"\x1f")
+        h.update(str(m.content).encode("utf-8"))
+    return h.hexdigest()
+
+
+def respond_key(prompt: str, memory: Any) -> str:
+    digest = hashlib.sha1(normalize_prompt(prompt).encode("utf-8")).hexdigest()
+    return f"respond:{digest}:{memory_fingerprint(memory)}"
+
+
+def model_namespace(model: Any) -> str:
+    """キャッシュキーに入れるモデル名。
+
+    モデルを str() するとクライアントの設定（API キーを含む）まで入るので、
+    名前の文字列だけを使う。
+    """
+    for attr in ("cache_namespace", "model_name", "model"):
+        name = getattr(model, attr, None)
+        if isinstance(name, str) and name:
+            return name
+    return type(model).__name__
+
+
+def _serialize_input(value: Any) -> str:
+    if isinstance(value, str):
+        return normalize_prompt(value)
+    if isinstance(value, (list, tuple)):
+        return json.dumps([_serialize_input(v) for v in value], ensure_ascii=False)
+    if hasattr(value, "type") and hasattr(value, "content"):
+        return json.dumps([value.type, _serialize_input(str(value.content))], ensure_ascii=False)
+    return repr(value)
+
+
+class CachedChatModel:
+    """チャットモデルの `invoke` だけをキャッシュし、他は元のモデルへ委ねる。
+
+    追加の引数（config / stop など）付きの呼び出しはキャッシュしない。
+    """
+
+    def __init__(self, model: Any, cache: TTLCache, cache_namespace: str = "") -> None:
+        self.model = model
+        self.cache = cache
+        self.cache_namespace = cache_namespace or model_namespace(model)
+
+    def invoke(self, input: Any, *args: Any, **kwargs: Any) -> Any:
+        if args or kwargs or not self.cache.enabled:
+            return self.model.invoke(input, *args, **kwargs)
+        key = "invoke:" + hashlib.sha1(
+            f"{self.cache_namespace}\x1e{_serialize_input(input)}".encode("utf-8")
+        ).hexdigest()
+        content = self.cache.get(key)
+        if content is not None:
+            from langchain_core.messages import AIMessage
+
+            return AIMessage(content=content)
+        resp = self.model.invoke(input)
+        content = getattr(resp, "content", None)
+        if isinstance(content, str):
+            self.cache.set(key, content)
+        return resp
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.model, name)
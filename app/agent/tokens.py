@@ -0,0 +1,207 @@
+"""Gemini のトークン数をローカルで見積もる。
+
+`ChatGoogleGenerativeAI.get_num_tokens` は API の countTokens を呼ぶため、
+メモリの prune 判定のたびに往復が発生する。ここでは文字種ごとの
+「1文字あたりのトークン数」の線形和で見積もる。
+
+- 既定の係数は SentencePiece 系トークナイザの日本語での目安値で、まだ
+  countTokens の実測では引き直していない（誤差も未計測）
+- `calibrate()` に (テキスト, countTokens の値) の組を渡すと係数を最小二乗で
+  引き直せる。モデルを変えたら引き直して `DEFAULT_RATES` を差し替える
+- `python -m app.agent.tokens` で countTokens との誤差・速度を比べられる
+  （GEMINI_API_KEY_MAIN が無ければローカルの速度だけ）。キーがあれば
+  引き直した係数と、その係数の誤差（1件抜き交差検証）も出すので、
+  `DEFAULT_RATES = ...` の行をそのまま貼り替え、誤差をここに書き残す
+
+用途は prune 判定（バッファを上限以下に保つ）で、厳密な課金計算には使わない。
+"""
+from __future__ import annotations
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# 文字種（係数の並びと対応）
+KANJI, HIRAGANA, KATAKANA, ALNUM, SPACE, PUNCT, OTHER = range(7)
+CLASSES = ("kanji", "hiragana", "katakana", "alnum", "space", "punct", "other")
+
+DEFAULT_RATES = (0.85, 0.45, 0.55, 0.27, 0.08, 0.9, 1.6)
+# 1メッセージあたりの固定分（"Human: " などの役割名）
+DEFAULT_MESSAGE_OVERHEAD = 3.0
+
+
+def _char_class(ch: str) -> int:
+    o = ord(ch)
+    if o < 0x80:
+        if ch.isalnum():
+            return ALNUM
+        if ch.isspace():
+            return SPACE
+        return PUNCT
+    if 0x3040 <= o <= 0x309F:
+        return HIRAGANA
+    if 0x30A0 <= o <= 0x30FF or 0xFF66 <= o <= 0xFF9F:
+        return KATAKANA
+    if 0x4E00 <= o <= 0x9FFF or 0x3400 <= o <= 0x4DBF or 0xF900 <= o <= 0xFAFF:
+        return KANJI
+    if 0x3000 <= o <= 0x303F or 0xFF01 <= o <= 0xFF65:
+        return PUNCT
+    if ch.isspace():
+        return SPACE
+    return OTHER
+
+
+def char_class_counts(text: str) -> List[int]:
+    counts = [0] * len(CLASSES)
+    for ch in text:
+        counts[_char_class(ch)] += 1
+    return counts
+
+
+class TokenEstimator:
+    def __init__(
+        self,
+        rates: Sequence[float] = DEFAULT_RATES,
+        message_overhead: float = DEFAULT_MESSAGE_OVERHEAD,
+    ) -> None:
+        self.rates = tuple(rates)
+        self.message_overhead = message_overhead
+
+    def count_text(self, text: str) -> int:
+        if not text:
+            return 0
+        counts = char_class_counts(text)
+        return max(1, round(sum(c * r for c, r in zip(counts, self.rates))))
+
+    def count_message(self, message: Any) -> int:
+        content = getattr(message, "content", message)
+        if not isinstance(content, str):
+            content = str(content)
+        return round(self.message_overhead) + self.count_text(content)
+
+    def count_messages(self, messages: Sequence[Any]) -> int:
+        return sum(self.count_message(m) for m in messages)
+
+    __call__ = count_message
+
+
+def calibrate(samples: Sequence[Tuple[str, int]], ridge: float = 1e-3) -> TokenEstimator:
+    """(テキスト, 実トークン数) の組から係数を引き直す（リッジ付き最小二乗）。"""
+    n = len(CLASSES)
+    xtx = [[0.0] * n for _ in range(n)]
+    xty = [0.0] * n
+    for text, tokens in samples:
+        x = char_class_counts(text)
+        for i in range(n):
+            if not x[i]:
+                continue
+            xty[i] += x[i] * tokens
+            for j in range(n):
+                xtx[i][j] += x[i] * x[j]
+    for i in range(n):
+        if xtx[i][i]:
+            xtx[i][i] += ridge
+        else:
+            # サンプルに出てこない文字種は既定値のまま残す
+            xtx[i][i], xty[i] = 1.0, DEFAULT_RATES[i]
+    rates = _solve(xtx, xty)
+    return TokenEstimator(rates=[max(0.0, r) for r in rates])
+
+
+def _solve(a: List[List[float]], b: List[float]) -> List[float]:
+    """ガウスの消去法（部分ピボット）。"""
+    n = len(b)
+    m = [row[:] + [b[i]] for i, row in enumerate(a)]
+    for col in range(n):
+        piv = max(range(col, n), key=lambda r: abs(m[r][col]))
+        m[col], m[piv] = m[piv], m[col]
+        p = m[col][col]
+        if abs(p) < 1e-12:
+            continue
+        for r in range(n):
+            if r != col and m[r][col]:
+                f = m[r][col] / p
+                for c in range(col, n + 1):
+                    m[r][c] -= f * m[col][c]
+    return [m[i][n] / m[i][i] if abs(m[i][i]) >= 1e-12 else 0.0 for i in range(n)]
+
+
+default_estimator = TokenEstimator()
+
+
+# ===== ベンチマーク: python -m app.agent.tokens =====
+
+_SAMPLES = [
+    "来週の金曜、渋谷あたりで飲み会しませんか？",
+    "自分は 12/5 か 12/12 なら参加できます！予算は4000円くらいが嬉しいです",
+    "焼き鳥かイタリアンがいいな〜。個室だと助かる🙏",
+    "新宿三丁目の「とりいちず」どうでしょう？ https://www.hotpepper.jp/strJ000000000/",
+    "了解です。では第2候補日も出しておきますね。",
+    "Can we do 7pm instead? 19時開始だと間に合わないメンバーがいます",
+    "カラオケ付きの店なら二次会も兼ねられるかも。ワインが飲めるところも候補に入れたい。",
+    "【幹事メモ】参加: 8名 / 未定: 2名 / 不参加: 1名。エリアは渋谷・恵比寿が多め。",
+    "お店の候補です！\n1. 炭火焼鳥 とり家 渋谷店（3001～4000円）\n2. イタリアンバル VINO（4001～5000円）",
+    "投票の締め切りは明日の18:00です。まだの方は👍でお願いします",
+    "すみません、仕事が押していて30分ほど遅れます…先に始めていてください",
+    "アレルギーのある方いますか？甲殻類NGの人が1人いるので、コースの内容を確認しておきます。",
+    "要約: 12月の忘年会。候補日は12/5・12/12、渋谷で予算4000円前後、焼き鳥かイタリアン、個室希望。",
+    "OK! Let's go with Friday. 場所は決まり次第 #kanji-channel に流します",
+    "ｶﾗｵｹ行きたい人ｰ？　２次会は２２時ごろからの予定です（ＪＲ渋谷駅集合）",
+    "予約完了しました。19:00〜21:00（2時間飲み放題付き）、1人4,500円です。",
+]
+
+
+def _bench(samples: List[str], rounds: int = 200) -> Dict[str, Any]:
+    est = default_estimator
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for s in samples:
+            est.count_text(s)
+    local_us = (time.perf_counter() - t0) / (rounds * len(samples)) * 1e6
+    result: Dict[str, Any] = {"samples": len(samples), "local_us_per_text": round(local_us, 2)}
+
+    remote: Optional[Any] = None
+    try:
+        import os
+
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        key = os.environ.get("GEMINI_API_KEY_MAIN")
+        if key:
+            remote = ChatGoogleGenerativeAI(
+                model=os.environ.get("GEMINI_MODEL", "gemini-2.5-flash-lite"), google_api_key=key
+            )
+    except ImportError:
+        remote = None
+    if remote is None:
+        return result
+
+    t0 = time.perf_counter()
+    actual = [remote.get_num_tokens(s) for s in samples]
+    remote_ms = (time.perf_counter() - t0) / len(samples) * 1e3
+    pairs = list(zip(samples, actual))
+    errors = _pct_errors(est, pairs)
+    # 引き直した係数の誤差は、その1件を除いて引き直した係数で測る（1件抜き交差検証）
+    cv_errors = [
+        _pct_errors(calibrate(pairs[:i] + pairs[i + 1:]), [pairs[i]])[0] for i in range(len(pairs))
+    ]
+    refit = calibrate(pairs)
+    result.update({
+        "remote_ms_per_text": round(remote_ms, 2),
+        "mean_abs_pct_error": round(100 * sum(errors) / len(errors), 1),
+        "max_abs_pct_error": round(100 * max(errors), 1),
+        "refit_cv_mean_abs_pct_error": round(100 * sum(cv_errors) / len(cv_errors), 1),
+        "refit_cv_max_abs_pct_error": round(100 * max(cv_errors), 1),
+        "refit_rates": dict(zip(CLASSES, (round(r, 3) for r in refit.rates))),
+    })
+    return result
+
+
+def _pct_errors(est: TokenEstimator, pairs: Sequence[Tuple[str, int]]) -> List[float]:
+    return [abs(est.count_text(s) - a) / max(1, a) for s, a in pairs]
+
+
+if __name__ == "__main__":
+    res = _bench(_SAMPLES)
+    for k, v in res.items():
+        print(f"{k}: {v}")
+    if "refit_rates" in res:
+        print(f"DEFAULT_RATES = {tuple(res['refit_rates'].values())}")
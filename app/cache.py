@@ -0,0 +1,136 @@
+"""TTL + LRU + バイト数上限のインメモリキャッシュ（任意でディスクへ保存）。
+
+- 値は JSON にできるもの（文字列・数値・list・dict）に限る。サイズは
+  JSON にしたときのバイト数で数える
+- `ttl` 秒を過ぎたエントリは読み出し時に捨てる。`ttl <= 0` なら何も覚えない
+- エントリ数 `max_entries` / 合計 `max_bytes` を超えたら古い（最後に使われた
+  のが古い）ものから捨てる
+- `path` を渡すと起動時に読み込み、`save()` で書き出す（期限は壁時計で持つ）
+"""
+from __future__ import annotations
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(
+        self,
+        ttl: float = 600.0,
+        max_entries: int = 1024,
+        max_bytes: int = 4 * 1024 * 1024,
+        path: Optional[str] = None,
+    ) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.path = path
+
+        self._lock = threading.Lock()
+        # key -> (value, expires_at, size)
+        self._data: "OrderedDict[str, Tuple[Any, float, int]]" = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        if path:
+            self.load()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at, _ = item
+            if expires_at <= time.time():
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        size = len(key.encode("utf-8")) + len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (value, time.time() + ttl, size)
+            self._bytes += size
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+
+    def _drop(self, key: str) -> None:
+        _, _, size = self._data.pop(key)
+        self._bytes -= size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    # ---------- 永続化 ----------
+    def save(self) -> None:
+        """期限内のエントリを path へ書き出す（古い順。読み込み時に LRU 順が戻る）。"""
+        if not self.path:
+            return
+        now = time.time()
+        with self._lock:
+            rows = [[k, v, exp] for k, (v, exp, _) in self._data.items() if exp > now]
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, self.path)
+
+    def load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                rows = json.load(f)
+        except (OSError, ValueError):
+            logger.warning("ignoring unreadable cache file %s", self.path)
+            return
+        now = time.time()
+        for key, value, expires_at in rows:
+            if expires_at > now:
+                self.set(key, value, ttl=expires_at - now)
@@ -0,0 +1,193 @@
+"""LLM 呼び出し・店検索など遅い処理を Slack リスナーの外で実行するプール。
+
+Bolt のリスナーは `ack()` 直後に `submit()` して戻り、結果は処理が終わった
+時点でタスク側が投稿する。Gemini の応答が遅くても Bolt のワーカーを
+占有しないので、他チャンネルのボタン ack が詰まらない。
+
+- 同時実行数は `max_workers` で上限を設ける
+- タスクはチャンネルごとのキューに入り、同じチャンネルのタスクは直列に、
+  チャンネル間はラウンドロビンで実行する（1チャンネルが全ワーカーを使い切らない）
+- 全体 `max_queue`・チャンネルごと `max_per_channel` を超える投入は
+  `TaskRejected` で即座に断る（アドミッション制御）
+- `stats()` でキュー深さと待ち時間を参照できる。`from_env()` で作ったものは
+  /metrics（`app.metrics`）にも載る
+"""
+from __future__ import annotations
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, Optional, Set, Tuple
+
+from app.metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+_Task = Tuple[Future, Callable[..., Any], tuple, dict, float]
+
+
+class TaskRejected(RuntimeError):
+    """キューが満杯でタスクを受け付けられなかった。"""
+
+
+class ChannelExecutor:
+    def __init__(
+        self,
+        max_workers: int = 4,
+        max_queue: int = 100,
+        max_per_channel: int = 5,
+    ) -> None:
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max_queue
+        self.max_per_channel = max_per_channel
+
+        self._cond = threading.Condition()
+        self._queues: Dict[str, Deque[_Task]] = {}
+        self._ready: Deque[str] = deque()  # キューがあり、実行中でないチャンネル
+        self._active: Set[str] = set()
+        self._queued = 0
+        self._shutdown = False
+
+        # 統計
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._started = 0
+
+        self._workers = [
+            threading.Thread(target=self._work, name=f"llm-worker-{i}", daemon=True)
+            for i in range(self.max_workers)
+        ]
+        for t in self._workers:
+            t.start()
+
+    @classmethod
+    def from_env(cls) -> "ChannelExecutor":
+        """LLM_MAX_CONCURRENCY / LLM_MAX_QUEUE / LLM_MAX_QUEUE_PER_CHANNEL から組み立てる。"""
+        executor = cls(
+            max_workers=int(os.environ.get("LLM_MAX_CONCURRENCY", "4")),
+            max_queue=int(os.environ.get("LLM_MAX_QUEUE", "100")),
+            max_per_channel=int(os.environ.get("LLM_MAX_QUEUE_PER_CHANNEL", "5")),
+        )
+        register_collector(executor.render)
+        return executor
+
+    def submit(self, channel: Optional[str], fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """チャンネルのキューへタスクを積む。満杯なら TaskRejected。"""
+        channel = channel or "-"
+        fut: Future = Future()
+        with self._cond:
+            if self._shutdown:
+                raise TaskRejected("executor is shut down")
+            q = self._queues.get(channel)
+            depth = len(q) if q else 0
+            if self._queued >= self.max_queue or depth >= self.max_per_channel:
+                self.rejected += 1
+                raise TaskRejected(f"queue full (channel={channel}, depth={depth}, total={self._queued})")
+            if q is None:
+                q = self._queues[channel] = deque()
+            q.append((fut, fn, args, kwargs, time.monotonic()))
+            self._queued += 1
+            self.submitted += 1
+            if channel not in self._active and len(q) == 1:
+                self._ready.append(channel)
+            self._cond.notify()
+        return fut
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                while not self._ready and not self._shutdown:
+                    self._cond.wait()
+                if not self._ready:
+                    return
+                channel = self._ready.popleft()
+                fut, fn, args, kwargs, enqueued = self._queues[channel].popleft()
+                self._queued -= 1
+                self._active.add(channel)
+                waited = time.monotonic() - enqueued
+                self._started += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+
+            if fut.set_running_or_notify_cancel():
+                try:
+                    fut.set_result(fn(*args, **kwargs))
+                    ok = True
+                except BaseException as e:  # noqa: BLE001 - Future に載せて呼び出し側へ
+                    logger.exception("task failed on channel %s", channel)
+                    fut.set_exception(e)
+                    ok = False
+            else:
+                ok = True
+
+            with self._cond:
+                self._active.discard(channel)
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                if self._queues[channel]:
+                    self._ready.append(channel)
+                    self._cond.notify()
+                else:
+                    del self._queues[channel]
+
+    def stats(self) -> Dict[str, Any]:
+        """キュー深さ・待ち時間などの現在値。"""
+        with self._cond:
+            return {
+                "queued": self._queued,
+                "running": len(self._active),
+                "max_workers": self.max_workers,
+                "queue_depth_by_channel": {ch: len(q) for ch, q in self._queues.items() if q},
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "completed": self.completed,
+                "failed": self.failed,
+                "wait_avg_sec": (self._wait_total / self._started) if self._started else 0.0,
+                "wait_max_sec": self._wait_max,
+            }
+
+    def render(self) -> str:
+        """Prometheus のテキスト形式。"""
+        with self._cond:
+            wait_total, started = self._wait_total, self._started
+        s = self.stats()
+        return (
+            "# HELP kanjiro_executor_queued Tasks waiting in channel queues.\n"
+            "# TYPE kanjiro_executor_queued gauge\n"
+            f"kanjiro_executor_queued {s['queued']}\n"
+            "# HELP kanjiro_executor_running Tasks currently running.\n"
+            "# TYPE kanjiro_executor_running gauge\n"
+            f"kanjiro_executor_running {s['running']}\n"
+            "# HELP kanjiro_executor_max_workers Worker threads.\n"
+            "# TYPE kanjiro_executor_max_workers gauge\n"
+            f"kanjiro_executor_max_workers {s['max_workers']}\n"
+            "# HELP kanjiro_executor_tasks_total Tasks by outcome.\n"
+            "# TYPE kanjiro_executor_tasks_total counter\n"
+            f'kanjiro_executor_tasks_total{{outcome="submitted"}} {s["submitted"]}\n'
+            f'kanjiro_executor_tasks_total{{outcome="rejected"}} {s["rejected"]}\n'
+            f'kanjiro_executor_tasks_total{{outcome="completed"}} {s["completed"]}\n'
+            f'kanjiro_executor_tasks_total{{outcome="failed"}} {s["failed"]}\n'
+            "# HELP kanjiro_executor_wait_seconds Time tasks waited in the queue before starting.\n"
+            "# TYPE kanjiro_executor_wait_seconds summary\n"
+            f"kanjiro_executor_wait_seconds_sum {wait_total}\n"
+            f"kanjiro_executor_wait_seconds_count {started}\n"
+            "# HELP kanjiro_executor_wait_max_seconds Longest queue wait so far.\n"
+            "# TYPE kanjiro_executor_wait_max_seconds gauge\n"
+            f"kanjiro_executor_wait_max_seconds {s['wait_max_sec']}\n"
+        )
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        if wait:
+            for t in self._workers:
+                t.join()
@@ -4,51 +4,24 @@ import json
 from typing import Dict, List, Optional
 from slack_bolt import App
 from app.agent.llm_agent import LLMAgent
+from app.executor import ChannelExecutor, TaskRejected
+from app.metrics import call_site, record_fallback
 
 from app.store import (
-    create_plan, upsert_participant, list_participants, record_vote,
-    get_latest_plan_thread, eligible_voter_ids, tally_votes, voters_who_voted,
-    get_channel_id,
+    create_plan, update_plan_status, upsert_participant, record_vote, get_latest_plan_thread,
+    tally_votes, vote_snapshot, participants_summary, get_channel_id,
 )
-# Hot Pepper公式API + 意図理解（LLM）を使う版
-from app.services.shops import find_shops
 
 
 # ===== 集計系ユーティリティ =====
 
-def _participants_summary(rows) -> Dict:
-    import statistics
-    from collections import Counter
-
-    yes_users = [r for r in rows if (r.get("attendance") in ("yes", "maybe"))]
-
-    # dates: 出現回数
-    cnt_dates = Counter()
-    for r in yes_users:
-        for d in r.get("dates") or []:
-            cnt_dates[d] += 1
-
-    # area: 最頻
-    areas = [r.get("area") for r in yes_users if r.get("area")]
-    area = Counter(areas).most_common(1)[0][0] if areas else None
-
-    # budget: 中央
-    mins = [int(r.get("budget_min")) for r in yes_users if r.get("budget_min") is not None]
-    maxs = [int(r.get("budget_max")) for r in yes_users if r.get("budget_max") is not None]
-    budget = (
-        (int(statistics.median(mins)), int(statistics.median(maxs)))
-        if mins and maxs else (3000, 5000)
-    )
-
-    # cuisine: 上位3（カンマ区切り集計）
-    from collections import Counter as C
-    cuisines_raw = [r.get("cuisine") for r in yes_users if r.get("cuisine")]
-    cuisine_list: List[str] = []
-    for c in cuisines_raw:
-        cuisine_list.extend([x.strip() for x in c.split(",") if x.strip()])
-    top_cuisine = [c for c, _ in C(cuisine_list).most_common(3)] if cuisine_list else []
-
-    return {"date_counts": cnt_dates, "area": area, "budget": budget, "cuisine": top_cuisine}
+def _participants_summary(thread_ts: str) -> Dict:
+    """
+    参加者集計。upsert のたびにストア側で差分更新済みなので読むだけ。
+    返却: {"date_counts": Counter, "area", "budget": (min,max), "cuisine": [..],
+           "total", "yes", "maybe", "no", "participants_count", "filled"}
+    """
+    return participants_summary(thread_ts)
 
 
 def _pick_top_dates(date_counts, k=3) -> List[str]:
@@ -59,7 +32,7 @@ def _pick_top_dates(date_counts, k=3) -> List[str]:
 def _proposal_blocks(proposals: List[Dict]) -> List[Dict]:
     """
     proposals: [{"date": "YYYY-MM-DD", "area": str|None, "budget": (min,max), "cuisine": [..], "shop": {...}}]
-    shop: {name, url, budget_label, address, access, photo_url}
+    shop: {name, url, budget_label, address, access, photo_url, relaxed}
     """
     blocks: List[Dict] = []
     for i, p in enumerate(proposals, start=1):
@@ -78,6 +51,8 @@ def _proposal_blocks(proposals: List[Dict]) -> List[Dict]:
             f"*予算（希望）*: {budget_txt}",
             f"*ジャンル（希望）*: {cuisine_txt}",
         ]
+        if shop.get("relaxed"):
+            meta_lines.append(f"*緩めた条件*: {', '.join(shop['relaxed'])}（希望どおりでは見つからなかったため）")
         shop_lines = [
             f"*店名*: <{url}|{name}>" if url else f"*店名*: {name}",
             f"*店予算目安*: {budget_label}",
@@ -125,15 +100,14 @@ def _tally_blocks(counter: Dict[int, int], eligible_total: int, voted_count: int
     return [{"type": "section", "text": {"type": "mrkdwn", "text": "\n".join(lines)}}]
 
 
-def _alignment_prompt(agg: Dict, rows: List[Dict], summary: str) -> str:
+def _alignment_prompt(agg: Dict, summary: str) -> str:
     """“すり合わせ”誘導文を LLM に作らせるためのプロンプト。"""
-    needers = [r for r in rows if r.get("attendance") in ("yes","maybe")]
     sample = {
         "top_dates_hint": list(agg["date_counts"].keys()),
         "area_mode": agg["area"],
         "budget": agg["budget"],
         "cuisine_top": agg["cuisine"],
-        "participants_count": len(needers),
+        "participants_count": agg["participants_count"],
     }
     return (
         "次の情報を踏まえて、Slackチャンネル向けの“すり合わせ”誘導メッセージを日本語で作成してください。\n"
@@ -147,7 +121,16 @@ def _alignment_prompt(agg: Dict, rows: List[Dict], summary: str) -> str:
 
 # ===== メイン登録 =====
 
-def register_kanji_flow(app: App, llm: LLMAgent) -> None:
+def register_kanji_flow(app: App, llm: LLMAgent, executor: Optional[ChannelExecutor] = None) -> None:
+    # LLM/検索を伴う処理はプールで実行し、リスナーは ack 後すぐ返す
+    executor = executor or ChannelExecutor.from_env()
+
+    def _submit(channel_id: Optional[str], fn, say, thread_ts: Optional[str] = None) -> None:
+        try:
+            executor.submit(channel_id, fn)
+        except TaskRejected:
+            say(text="ただいま混み合っています。少し時間をおいて再実行してください。", thread_ts=thread_ts)
+
     # /幹事説明：定型の利用ガイド
     @app.command("/幹事説明")
     def cmd_help(ack, body, say):
@@ -175,60 +158,68 @@ def register_kanji_flow(app: App, llm: LLMAgent) -> None:
             return
 
         try:
-            rows = list_participants(thread_ts)
-            if not rows:
+            # 集計
+            agg = _participants_summary(thread_ts)
+            if not agg["total"]:
                 say(text="まだ回答がありません。/幹事開始 で募集を始めてください。")
                 return
 
-            # 集計
-            agg = _participants_summary(rows)
             date_lines = [f"- {d}: {c}名" for d, c in agg["date_counts"].most_common(5)]
             area = agg["area"] or "-"
             budget = f"¥{agg['budget'][0]}〜¥{agg['budget'][1]}"
             cuisine = ", ".join(agg["cuisine"]) if agg["cuisine"] else "-"
 
-            total = len(rows)
-            yes_cnt  = sum(1 for r in rows if r.get("attendance") == "yes")
-            maybe_cnt = sum(1 for r in rows if r.get("attendance") == "maybe")
-            no_cnt   = sum(1 for r in rows if r.get("attendance") == "no")
-            filled_cnt = sum(
-                1 for r in rows
-                if (r.get("attendance") in ("yes","maybe") and (r.get("dates") or []))
-                   or (r.get("attendance") == "no")
-            )
-
-            # すり合わせ案内（LLM）
-            try:
-                convo_summary = llm.get_summary()
-                prompt = _alignment_prompt(agg, rows, convo_summary)
-                align_msg = llm.respond(prompt)
-            except Exception:
-                align_msg = "入力が出そろってきました。第2候補日や近隣エリア、近いジャンルを出し合ってすり合わせましょう！"
-
-            # 投稿（チャンネルに直接）
-            blocks = [
-                {"type": "header", "text": {"type": "plain_text", "text": "回答状況まとめ"}},
-                {"type": "section", "text": {"type": "mrkdwn",
-                    "text": (
-                        f"*回答数*: {filled_cnt}/{total}\n"
-                        f"*参加*: {yes_cnt}  *未定*: {maybe_cnt}  *不参加*: {no_cnt}\n"
-                        f"*エリア傾向*: {area}\n"
-                        f"*予算中央値*: {budget}\n"
-                        f"*ジャンルトップ*: {cuisine}\n"
-                    )
-                }},
-                {"type": "section", "text": {"type": "mrkdwn",
-                    "text": "*候補日（上位）:*\n" + ("\n".join(date_lines) if date_lines else "-")}
-                },
-                {"type": "divider"},
-                {"type": "section", "text": {"type": "mrkdwn",
-                    "text": f":speech_balloon: *すり合わせの案内*\n{align_msg}"}}
-            ]
-            client.chat_postMessage(channel=ch, text="回答状況まとめ", blocks=blocks)
+            total = agg["total"]
+            yes_cnt = agg["yes"]
+            maybe_cnt = agg["maybe"]
+            no_cnt = agg["no"]
+            filled_cnt = agg["filled"]
 
         except Exception as e:
             logger.exception(e)
             say(text="回答状況の集計でエラーが発生しました。もう一度お試しください。")
+            return
+
+        # すり合わせ案内（LLM）と投稿はプール側で行う
+        def _post_status() -> None:
+            try:
+                # 会話はチャンネル単位のメモリを使う
+                convo_key = llm.key_for(ch)
+                try:
+                    convo_summary = llm.get_summary(convo_key)
+                    prompt = _alignment_prompt(agg, convo_summary)
+                    with call_site("alignment"):
+                        align_msg = llm.respond(prompt, key=convo_key)
+                except Exception:
+                    record_fallback("alignment")
+                    align_msg = "入力が出そろってきました。第2候補日や近隣エリア、近いジャンルを出し合ってすり合わせましょう！"
+
+                # 投稿（チャンネルに直接）
+                blocks = [
+                    {"type": "header", "text": {"type": "plain_text", "text": "回答状況まとめ"}},
+                    {"type": "section", "text": {"type": "mrkdwn",
+                        "text": (
+                            f"*回答数*: {filled_cnt}/{total}\n"
+                            f"*参加*: {yes_cnt}  *未定*: {maybe_cnt}  *不参加*: {no_cnt}\n"
+                            f"*エリア傾向*: {area}\n"
+                            f"*予算中央値*: {budget}\n"
+                            f"*ジャンルトップ*: {cuisine}\n"
+                        )
+                    }},
+                    {"type": "section", "text": {"type": "mrkdwn",
+                        "text": "*候補日（上位）:*\n" + ("\n".join(date_lines) if date_lines else "-")}
+                    },
+                    {"type": "divider"},
+                    {"type": "section", "text": {"type": "mrkdwn",
+                        "text": f":speech_balloon: *すり合わせの案内*\n{align_msg}"}}
+                ]
+                client.chat_postMessage(channel=ch, text="回答状況まとめ", blocks=blocks)
+
+            except Exception as e:
+                logger.exception(e)
+                say(text="回答状況の集計でエラーが発生しました。もう一度お試しください。")
+
+        _submit(ch, _post_status, say)
 
     # 開始：参加可否
     @app.command("/幹事開始")
@@ -397,59 +388,66 @@ def register_kanji_flow(app: App, llm: LLMAgent) -> None:
             return
         say(text="公式APIで候補検索中…", thread_ts=thread_ts)
 
-        rows = list_participants(thread_ts)
-        if not rows:
+        agg = _participants_summary(thread_ts)
+        if not agg["total"]:
             say(text="まだ回答がありません。/幹事開始 で募集を始めてください。", thread_ts=thread_ts)
             return
 
-        agg = _participants_summary(rows)
         top_dates = _pick_top_dates(agg["date_counts"], k=3)
         if not top_dates:
             from datetime import date, timedelta
             today = date.today()
             top_dates = [str(today + timedelta(days=i * 7)) for i in range(3)]
 
-        # 会話要約を意図理解に使い、Hot Pepper API検索
-        convo_summary = llm.get_summary()
-        form_inputs = {
-            "area": agg["area"],
-            "budget_min": agg["budget"][0],
-            "budget_max": agg["budget"][1],
-            "cuisine": ", ".join(agg["cuisine"]) if agg["cuisine"] else "",
-        }
+        # 会話要約の取得・意図理解・Hot Pepper API検索はプール側で行う
+        def _search_and_post() -> None:
+            # Hot Pepper公式API + 意図理解（LLM）を使う版（requests 等は初回に読み込む）
+            from app.services.shops import find_shops
 
-        try:
-            # 応答用 LLMインスタンス（main_llm）でOK
-            shops = find_shops(
-                llm=llm.main_llm,
-                convo_text=convo_summary,
-                form_inputs=form_inputs,
-                take=3,  # 提案=3
-            )
-        except Exception as e:
-            logger.exception(e)
-            shops = []
+            # 会話要約を意図理解に使い、Hot Pepper API検索
+            convo_summary = llm.get_summary(llm.key_for(channel_id or get_channel_id(thread_ts)))
+            form_inputs = {
+                "area": agg["area"],
+                "budget_min": agg["budget"][0],
+                "budget_max": agg["budget"][1],
+                "cuisine": ", ".join(agg["cuisine"]) if agg["cuisine"] else "",
+            }
 
-        if not shops:
-            say(text="候補が見つかりませんでした。条件を緩めるか、エリア/予算/ジャンルの入力を見直してください。", thread_ts=thread_ts)
-            return
+            try:
+                # 応答用 LLMインスタンス（main_llm、応答キャッシュ付き）でOK
+                shops = find_shops(
+                    llm=llm.cached_llm,
+                    convo_text=convo_summary,
+                    form_inputs=form_inputs,
+                    take=3,  # 提案=3
+                )
+            except Exception as e:
+                logger.exception(e)
+                shops = []
 
-        # 1提案=1店舗。日付は top_dates と対応（足りなければ '-'）
-        proposals_data = []
-        for i in range(3):
-            shop = shops[i] if i < len(shops) else None
-            if not shop:
-                break
-            proposals_data.append({
-                "date": top_dates[i] if i < len(top_dates) else "-",
-                "area": agg["area"],
-                "budget": agg["budget"],
-                "cuisine": agg["cuisine"],
-                "shop": shop,
-            })
+            if not shops:
+                say(text="候補が見つかりませんでした。条件を緩めるか、エリア/予算/ジャンルの入力を見直してください。", thread_ts=thread_ts)
+                return
 
-        blocks = _proposal_blocks(proposals_data)
-        say(text="3つの候補を提示します。投票してください！", blocks=blocks, thread_ts=thread_ts)
+            # 1提案=1店舗。日付は top_dates と対応（足りなければ '-'）
+            proposals_data = []
+            for i in range(3):
+                shop = shops[i] if i < len(shops) else None
+                if not shop:
+                    break
+                proposals_data.append({
+                    "date": top_dates[i] if i < len(top_dates) else "-",
+                    "area": agg["area"],
+                    "budget": agg["budget"],
+                    "cuisine": agg["cuisine"],
+                    "shop": shop,
+                })
+
+            blocks = _proposal_blocks(proposals_data)
+            say(text="3つの候補を提示します。投票してください！", blocks=blocks, thread_ts=thread_ts)
+            update_plan_status(thread_ts, "confirm")
+
+        _submit(channel_id, _search_and_post, say, thread_ts=thread_ts)
 
     # 投票
     @app.action("vote_proposal")
@@ -469,17 +467,16 @@ def register_kanji_flow(app: App, llm: LLMAgent) -> None:
                 text=f"提案{idx}に投票しました！",
             )
 
-        # --- 自動集計＆自動確定 ---
-        eligible = eligible_voter_ids(thread_ts)
-        counter = tally_votes(thread_ts)
-        voted = voters_who_voted(thread_ts)
+        # --- 自動集計＆自動確定（ストア側で差分集計済みのスナップショットを読むだけ） ---
+        snap = vote_snapshot(thread_ts)
 
         # 1) 集計の進捗をスレッドに共有
-        say(text=f"投票を更新: {len(voted)}/{len(eligible)}名が投票済みです。", thread_ts=thread_ts)
+        say(text=f"投票を更新: {snap['voted_count']}/{snap['eligible_total']}名が投票済みです。", thread_ts=thread_ts)
 
         # 2) 全員が投票済みなら自動確定 → チャンネルに直接告知
-        if len(eligible) > 0 and set(voted) >= set(eligible):
-            winner, _ = max(counter.items(), key=lambda kv: (kv[1], -kv[0]))
+        if snap["complete"]:
+            winner, _ = max(snap["counter"].items(), key=lambda kv: (kv[1], -kv[0]))
+            update_plan_status(thread_ts, "done")
             if ch:
                 client.chat_postMessage(
                     channel=ch,
@@ -494,10 +491,8 @@ def register_kanji_flow(app: App, llm: LLMAgent) -> None:
         if not thread_ts:
             say(text="集計対象の企画が見つかりません。/幹事開始 のスレッド内で実行してください。")
             return
-        eligible = eligible_voter_ids(thread_ts)
-        counter = tally_votes(thread_ts)
-        voted = voters_who_voted(thread_ts)
-        blocks = _tally_blocks(counter, eligible_total=len(eligible), voted_count=len(voted))
+        snap = vote_snapshot(thread_ts)
+        blocks = _tally_blocks(snap["counter"], eligible_total=snap["eligible_total"], voted_count=snap["voted_count"])
         say(text="現在の投票状況です。", blocks=blocks, thread_ts=thread_ts)
 
     # ---- 手動で確定する ----
@@ -513,6 +508,7 @@ def register_kanji_flow(app: App, llm: LLMAgent) -> None:
             say(text="投票がありません。/幹事提案 で候補提示＆投票を開始してください。", thread_ts=thread_ts)
             return
         winner, _ = max(counter.items(), key=lambda kv: (kv[1], -kv[0]))
+        update_plan_status(thread_ts, "done")
         ch = get_channel_id(thread_ts)
         if ch:
             # 手動確定もチャンネルに直接
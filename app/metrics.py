@@ -0,0 +1,251 @@
+"""LLM 呼び出しの計測（呼び出し箇所ごとのレイテンシ・トークン数・エラー・費用）。
+
+- 呼び出し箇所は `call_site("mention")` のように contextvar で示す
+  （スレッドをまたがないので、タスク/バックグラウンド処理の中で設定する）
+- 計測は Gemini クライアントに付けた LangChain のコールバック
+  （`callback_handler()`）で行う
+- 応答を諦めて定型文などに切り替えたときは `record_fallback()` で数える
+- `registry.snapshot()` でプロセス内から参照でき、`serve(port)` で
+  Prometheus のテキスト形式を `/metrics` で公開する（METRICS_PORT）
+
+費用は 100 万トークンあたりの単価（LLM_PRICE_INPUT_PER_M / LLM_PRICE_OUTPUT_PER_M、
+USD）から見積もる。
+"""
+from __future__ import annotations
+import contextlib
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SITE = "other"
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0)
+
+_site: contextvars.ContextVar[str] = contextvars.ContextVar("llm_call_site", default=DEFAULT_SITE)
+
+
+@contextlib.contextmanager
+def call_site(name: str) -> Iterator[None]:
+    """この中で行う LLM 呼び出しを name として数える。"""
+    token = _site.set(name)
+    try:
+        yield
+    finally:
+        _site.reset(token)
+
+
+def current_site() -> str:
+    return _site.get()
+
+
+class _Series:
+    __slots__ = ("ok", "errors", "buckets", "latency_sum", "prompt_tokens", "completion_tokens", "cost")
+
+    def __init__(self) -> None:
+        self.ok = 0
+        self.errors = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)  # 最後は +Inf
+        self.latency_sum = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+
+
+class LLMMetrics:
+    def __init__(
+        self,
+        price_input_per_m: Optional[float] = None,
+        price_output_per_m: Optional[float] = None,
+    ) -> None:
+        if price_input_per_m is None:
+            price_input_per_m = float(os.environ.get("LLM_PRICE_INPUT_PER_M", "0.10"))
+        if price_output_per_m is None:
+            price_output_per_m = float(os.environ.get("LLM_PRICE_OUTPUT_PER_M", "0.40"))
+        self.price_input_per_m = price_input_per_m
+        self.price_output_per_m = price_output_per_m
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, str], _Series] = defaultdict(_Series)
+        self._fallbacks: Dict[str, int] = defaultdict(int)
+
+    def record(
+        self,
+        site: str,
+        client: str,
+        latency: float,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        error: bool = False,
+    ) -> None:
+        cost = (prompt_tokens * self.price_input_per_m + completion_tokens * self.price_output_per_m) / 1e6
+        with self._lock:
+            s = self._series[(site, client)]
+            if error:
+                s.errors += 1
+            else:
+                s.ok += 1
+            i = 0
+            while i < len(LATENCY_BUCKETS) and latency > LATENCY_BUCKETS[i]:
+                i += 1
+            s.buckets[i] += 1
+            s.latency_sum += latency
+            s.prompt_tokens += prompt_tokens
+            s.completion_tokens += completion_tokens
+            s.cost += cost
+
+    def record_fallback(self, site: Optional[str] = None) -> None:
+        with self._lock:
+            self._fallbacks[site or current_site()] += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._series.clear()
+            self._fallbacks.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """{"calls": {(site, client): {...}}, "fallbacks": {site: n}}"""
+        with self._lock:
+            calls = {
+                key: {
+                    "ok": s.ok,
+                    "errors": s.errors,
+                    "latency_buckets": dict(zip(LATENCY_BUCKETS + (float("inf"),), s.buckets)),
+                    "latency_sum": s.latency_sum,
+                    "prompt_tokens": s.prompt_tokens,
+                    "completion_tokens": s.completion_tokens,
+                    "cost_usd": s.cost,
+                }
+                for key, s in self._series.items()
+            }
+            return {"calls": calls, "fallbacks": dict(self._fallbacks)}
+
+    def render(self) -> str:
+        """Prometheus のテキスト形式。"""
+        snap = self.snapshot()
+        lines: List[str] = []
+
+        def family(name: str, kind: str, help_text: str) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        family("kanjiro_llm_requests_total", "counter", "LLM calls by call site, client and outcome.")
+        for (site, client), s in snap["calls"].items():
+            for outcome, n in (("ok", s["ok"]), ("error", s["errors"])):
+                lines.append(f'kanjiro_llm_requests_total{{site="{site}",client="{client}",outcome="{outcome}"}} {n}')
+
+        family("kanjiro_llm_latency_seconds", "histogram", "LLM call latency.")
+        for (site, client), s in snap["calls"].items():
+            labels = f'site="{site}",client="{client}"'
+            cumulative = 0
+            for le, n in s["latency_buckets"].items():
+                cumulative += n
+                le_text = "+Inf" if le == float("inf") else repr(le)
+                lines.append(f'kanjiro_llm_latency_seconds_bucket{{{labels},le="{le_text}"}} {cumulative}')
+            lines.append(f"kanjiro_llm_latency_seconds_sum{{{labels}}} {s['latency_sum']}")
+            lines.append(f"kanjiro_llm_latency_seconds_count{{{labels}}} {cumulative}")
+
+        for metric, key, help_text in (
+            ("kanjiro_llm_prompt_tokens_total", "prompt_tokens", "Prompt tokens sent."),
+            ("kanjiro_llm_completion_tokens_total", "completion_tokens", "Completion tokens received."),
+            ("kanjiro_llm_cost_usd_total", "cost_usd", "Estimated cost in USD."),
+        ):
+            family(metric, "counter", help_text)
+            for (site, client), s in snap["calls"].items():
+                lines.append(f'{metric}{{site="{site}",client="{client}"}} {s[key]}')
+
+        family("kanjiro_llm_fallbacks_total", "counter", "Replies that fell back to a canned answer.")
+        for site, n in snap["fallbacks"].items():
+            lines.append(f'kanjiro_llm_fallbacks_total{{site="{site}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+
+registry = LLMMetrics()
+
+# /metrics に追記する他モジュールの計測（Prometheus テキストを返す関数）
+_collectors: List[Callable[[], str]] = []
+
+
+def register_collector(render: Callable[[], str]) -> None:
+    _collectors.append(render)
+
+
+def record_fallback(site: Optional[str] = None) -> None:
+    registry.record_fallback(site)
+
+
+def _usage(response: Any) -> Tuple[int, int]:
+    """LLMResult から (prompt, completion) トークン数を取り出す。"""
+    prompt = completion = 0
+    for gens in getattr(response, "generations", None) or []:
+        for g in gens:
+            usage = getattr(getattr(g, "message", None), "usage_metadata", None) or {}
+            prompt += int(usage.get("input_tokens") or 0)
+            completion += int(usage.get("output_tokens") or 0)
+    return prompt, completion
+
+
+def callback_handler(client: str, metrics: Optional[LLMMetrics] = None) -> Any:
+    """client（"main" / "summary" など）の呼び出しを数える LangChain コールバック。"""
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    metrics = metrics or registry
+
+    class _Handler(BaseCallbackHandler):
+        def __init__(self) -> None:
+            self._lock = threading.Lock()
+            self._started: Dict[Any, Tuple[float, str]] = {}
+
+        def _start(self, run_id: Any) -> None:
+            with self._lock:
+                self._started[run_id] = (time.perf_counter(), current_site())
+
+        def _finish(self, run_id: Any) -> Tuple[float, str]:
+            with self._lock:
+                t0, site = self._started.pop(run_id, (time.perf_counter(), current_site()))
+            return time.perf_counter() - t0, site
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+            self._start(run_id)
+
+        def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+            self._start(run_id)
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            latency, site = self._finish(run_id)
+            prompt, completion = _usage(response)
+            metrics.record(site, client, latency, prompt, completion)
+
+        def on_llm_error(self, error, *, run_id, **kwargs):
+            latency, site = self._finish(run_id)
+            metrics.record(site, client, latency, error=True)
+
+    return _Handler()
+
+
+def serve(port: int, host: str = "127.0.0.1", metrics: Optional[LLMMetrics] = None) -> ThreadingHTTPServer:
+    """/metrics を返す HTTP サーバーをデーモンスレッドで起動する。"""
+    metrics = metrics or registry
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = "".join([metrics.render()] + [c() for c in _collectors]).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
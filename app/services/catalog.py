@@ -0,0 +1,299 @@
+# app/services/catalog.py
+"""よく使うエリアの店舗をローカルの SQLite に持っておく（店舗カタログ）。
+
+- `CatalogSync` がエリア（HOTPEPPER_CATALOG_AREAS）ごとに Hot Pepper の検索結果を
+  `start` でページ送りしながら全件（最大 HOTPEPPER_CATALOG_MAX_PAGES ページ）取り込み、
+  HOTPEPPER_CATALOG_SYNC_INTERVAL 秒ごとに取り直す
+- `ShopCatalog.search(params)` は Hot Pepper API と同じパラメタ（keyword / genre /
+  budget / 制約フラグ / count）をローカルで絞り込む。店の JSON は `data` 列に持ち、
+  絞り込みに使う値だけ列として複製する（app.store.sqlite と同じ作り）
+- 取り込みから HOTPEPPER_CATALOG_TTL 秒以内のエリアだけをローカルで答える。
+  位置検索（lat/lng）や未取り込みのエリアは None を返し、呼び出し側は API を叩く
+
+HOTPEPPER_CATALOG_PATH を指定したときだけ有効。
+"""
+from __future__ import annotations
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from app.metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shops (
+    area           TEXT NOT NULL,
+    id             TEXT NOT NULL,
+    rank           INTEGER NOT NULL,
+    genre_code     TEXT,
+    sub_genre_code TEXT,
+    budget_code    TEXT,
+    private_room   INTEGER NOT NULL DEFAULT 0,
+    non_smoking    INTEGER NOT NULL DEFAULT 0,
+    card           INTEGER NOT NULL DEFAULT 0,
+    child          INTEGER NOT NULL DEFAULT 0,
+    free_drink     INTEGER NOT NULL DEFAULT 0,
+    data           TEXT NOT NULL,
+    PRIMARY KEY (area, id)
+);
+CREATE INDEX IF NOT EXISTS idx_shops_area_rank ON shops (area, rank);
+CREATE INDEX IF NOT EXISTS idx_shops_area_genre ON shops (area, genre_code);
+CREATE INDEX IF NOT EXISTS idx_shops_area_budget ON shops (area, budget_code);
+
+CREATE TABLE IF NOT EXISTS syncs (
+    area      TEXT PRIMARY KEY,
+    synced_at REAL NOT NULL,
+    shops     INTEGER NOT NULL,
+    complete  INTEGER NOT NULL
+);
+"""
+
+FLAGS = ("private_room", "non_smoking", "card", "child", "free_drink")
+# ローカルで解釈できる API パラメタ（これ以外が付いていたら API に任せる）
+_SUPPORTED = {"keyword", "genre", "budget", "count", *FLAGS}
+
+_SQL_INSERT = (
+    "INSERT OR REPLACE INTO shops (area, id, rank, genre_code, sub_genre_code, budget_code, "
+    "private_room, non_smoking, card, child, free_drink, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+# 「なし」側の値（それ以外の値が入っていれば条件を満たすとみなす）
+_NEGATIVE = ("なし", "不可", "利用不可", "禁煙席なし", "全席喫煙", "お子様連れお断り", "未確認")
+
+
+def _flag(value: Any) -> int:
+    v = str(value or "").strip()
+    return int(bool(v) and not v.startswith(_NEGATIVE))
+
+
+def area_key(text: Optional[str]) -> str:
+    # 全角/半角の違い（「ＪＲ渋谷」など）と空白のゆれを吸収する
+    return " ".join(unicodedata.normalize("NFKC", str(text or "")).split())
+
+
+class ShopCatalog:
+    def __init__(self, path: str = "hotpepper_catalog.db", ttl: float = 24 * 3600) -> None:
+        self.path = path
+        self.ttl = ttl
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, cached_statements=32)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["ShopCatalog"]:
+        path = os.environ.get("HOTPEPPER_CATALOG_PATH", "")
+        if not path:
+            return None
+        return cls(path, ttl=float(os.environ.get("HOTPEPPER_CATALOG_TTL", str(24 * 3600))))
+
+    # ---------- 取り込み ----------
+    def replace_area(self, area: str, raw_shops: Sequence[Dict[str, Any]], shop_dicts: Sequence[Dict[str, Any]], complete: bool) -> None:
+        """area の店舗を丸ごと入れ替える（raw_shops は API の shop、shop_dicts は整形済み）。"""
+        area = area_key(area)
+        rows = []
+        for rank, (s, d) in enumerate(zip(raw_shops, shop_dicts)):
+            if not s.get("id"):
+                continue
+            rows.append((
+                area, s["id"], rank,
+                (s.get("genre") or {}).get("code"),
+                (s.get("sub_genre") or {}).get("code"),
+                (s.get("budget") or {}).get("code"),
+                *(_flag(s.get(f)) for f in FLAGS),
+                json.dumps(d, ensure_ascii=False),
+            ))
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("DELETE FROM shops WHERE area = ?", (area,))
+                self._conn.executemany(_SQL_INSERT, rows)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO syncs (area, synced_at, shops, complete) VALUES (?, ?, ?, ?)",
+                    (area, time.time(), len(rows), int(complete)),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    # ---------- 検索 ----------
+    def _sync_state(self, area: str) -> Optional[tuple]:
+        return self._conn.execute(
+            "SELECT synced_at, complete FROM syncs WHERE area = ?", (area,)
+        ).fetchone()
+
+    def search(self, params: Dict[str, Any], now: Optional[float] = None) -> Optional[List[Dict[str, Any]]]:
+        """ローカルで答えられれば店舗リスト、答えられなければ None。"""
+        area = area_key(params.get("keyword"))
+        if not area or set(params) - _SUPPORTED:
+            return None
+        now = time.time() if now is None else now
+        where = ["area = ?"]
+        args: List[Any] = [area]
+        if params.get("genre"):
+            where.append("(genre_code = ? OR sub_genre_code = ?)")
+            args += [params["genre"], params["genre"]]
+        if params.get("budget"):
+            where.append("budget_code = ?")
+            args.append(params["budget"])
+        for f in FLAGS:
+            if params.get(f):
+                where.append(f"{f} = 1")
+        args.append(int(params.get("count") or 10))
+        sql = f"SELECT data FROM shops WHERE {' AND '.join(where)} ORDER BY rank LIMIT ?"
+
+        with self._lock:
+            state = self._sync_state(area)
+            if state is None or state[0] + self.ttl < now:
+                self.misses += 1
+                return None
+            rows = self._conn.execute(sql, args).fetchall()
+            # 途中までしか取り込めていないエリアで0件なら API に聞き直す
+            if not rows and not state[1]:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return [json.loads(r[0]) for r in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            areas = {
+                a: {"synced_at": t, "shops": n, "complete": bool(c)}
+                for a, t, n, c in self._conn.execute("SELECT area, synced_at, shops, complete FROM syncs")
+            }
+            return {"hits": self.hits, "misses": self.misses, "areas": areas}
+
+    def render(self) -> str:
+        """Prometheus のテキスト形式。"""
+        s = self.stats()
+        lines = [
+            "# HELP kanjiro_catalog_lookups_total Searches answered from the local shop catalog.",
+            "# TYPE kanjiro_catalog_lookups_total counter",
+            f'kanjiro_catalog_lookups_total{{result="hit"}} {s["hits"]}',
+            f'kanjiro_catalog_lookups_total{{result="miss"}} {s["misses"]}',
+            "# HELP kanjiro_catalog_shops Shops held per synced area.",
+            "# TYPE kanjiro_catalog_shops gauge",
+        ]
+        for area, a in s["areas"].items():
+            lines.append(f'kanjiro_catalog_shops{{area="{area}"}} {a["shops"]}')
+        return "\n".join(lines) + "\n"
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_catalog: Optional[ShopCatalog] = None
+_catalog_lock = threading.Lock()
+_catalog_loaded = False
+
+
+def get_catalog() -> Optional[ShopCatalog]:
+    """HOTPEPPER_CATALOG_PATH があれば共有カタログ（初回に開く）、無ければ None。"""
+    global _catalog, _catalog_loaded
+    if not _catalog_loaded:
+        with _catalog_lock:
+            if not _catalog_loaded:
+                _catalog = ShopCatalog.from_env()
+                if _catalog is not None:
+                    register_collector(_catalog.render)
+                _catalog_loaded = True
+    return _catalog
+
+
+class CatalogSync:
+    """エリアごとの取り込みを定期的に行うバックグラウンドスレッド。"""
+
+    def __init__(
+        self,
+        catalog: ShopCatalog,
+        areas: Sequence[str],
+        interval: float = 6 * 3600,
+        page_size: int = 100,
+        max_pages: int = 10,
+        page_pause: float = 0.5,
+        fetch: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+    ) -> None:
+        self.catalog = catalog
+        self.areas = [area_key(a) for a in areas if area_key(a)]
+        self.interval = interval
+        self.page_size = max(1, min(100, page_size))  # API の上限は 100
+        self.max_pages = max(1, max_pages)
+        self.page_pause = page_pause
+        self.fetch = fetch
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls, catalog: Optional[ShopCatalog] = None) -> Optional["CatalogSync"]:
+        """HOTPEPPER_CATALOG_AREAS（カンマ区切り）/ _SYNC_INTERVAL / _MAX_PAGES から組み立てる。"""
+        catalog = catalog or get_catalog()
+        areas = [a for a in os.environ.get("HOTPEPPER_CATALOG_AREAS", "").split(",") if a.strip()]
+        if catalog is None or not areas:
+            return None
+        return cls(
+            catalog,
+            areas,
+            interval=float(os.environ.get("HOTPEPPER_CATALOG_SYNC_INTERVAL", str(6 * 3600))),
+            max_pages=int(os.environ.get("HOTPEPPER_CATALOG_MAX_PAGES", "10")),
+        )
+
+    def sync_area(self, area: str) -> int:
+        """area を1ページ目から取り込み直し、取り込んだ件数を返す。"""
+        # requests 等は取り込み時に読み込む
+        from app.services.shops import _call, _shop_from_api
+
+        fetch = self.fetch or _call
+        raw: List[Dict[str, Any]] = []
+        complete = False
+        for page in range(self.max_pages):
+            data = fetch({"keyword": area, "count": self.page_size, "start": 1 + page * self.page_size})
+            results = data.get("results") or {}
+            shops = results.get("shop") or []
+            raw += shops
+            available = int(results.get("results_available") or 0)
+            if not shops or len(raw) >= available:
+                complete = True
+                break
+            if self._stop.wait(self.page_pause):
+                return 0
+        self.catalog.replace_area(area, raw, [_shop_from_api(s) for s in raw], complete)
+        return len(raw)
+
+    def run_once(self) -> int:
+        total = 0
+        for area in self.areas:
+            if self._stop.is_set():
+                break
+            try:
+                total += self.sync_area(area)
+            except Exception:
+                logger.exception("catalog sync failed for %s", area)
+        return total
+
+    def _loop(self) -> None:
+        delay = 0.0  # 起動直後に1回取り込む
+        while not self._stop.wait(delay):
+            self.run_once()
+            delay = self.interval
+
+    def start(self) -> "CatalogSync":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="catalog-sync", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
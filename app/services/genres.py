@@ -0,0 +1,198 @@
+# app/services/genres.py
+"""ジャンル名 → Hot Pepper のジャンルコード（表記ゆれ・同義語に強い版）。
+
+- 入力もキーも `normalize()`（NFKC・小文字化・カタカナ → ひらがな・空白と「・」除去）
+  してから照合する。全角/半角やひらがな/カタカナの違いは吸収される
+- キーは `GENRE_MAP` の名前と `SYNONYMS` の別名。import 時に一度だけ
+  Aho-Corasick のオートマトンを組み、入力を1回なめるだけで全部の一致を拾う
+- 重なった一致は左から最長のものを採る（「ダイニングバー」の中の「バー」は数えない）
+- 一致ごとに確からしさ（confidence）を付ける。入力全体がキーそのものなら 1.0、
+  別名なら 0.9、部分一致ならキーが入力に占める割合に応じて下がる
+- 部分一致のうち、カタカナ語・英数字の語の途中に埋もれたもの（「メンバー」の
+  「バー」、「グローバル」の「バル」）は `MIN_CONFIDENCE` 未満に落とす。
+  語の切れ目（漢字・ひらがな・記号との境、入力の端、別のキーとの境）に
+  接していれば部分一致でも `MIN_CONFIDENCE` 以上になる
+"""
+from __future__ import annotations
+import re
+import unicodedata
+from collections import deque
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+# Hot Pepper のジャンルコード（代表名 → コード）
+GENRE_MAP: Dict[str, str] = {
+    "居酒屋": "G001", "ダイニングバー": "G002", "ダイニング": "G002", "創作料理": "G003",
+    "和食": "G004", "洋食": "G005", "イタリアン": "G006", "フレンチ": "G006",
+    "中華": "G007", "焼肉": "G008", "韓国料理": "G017", "アジア": "G009",
+    "各国料理": "G010", "カラオケ": "G011", "バー": "G012", "バル": "G012",
+    "カフェ": "G013", "スイーツ": "G014", "ラーメン": "G015",
+    "お好み焼き": "G016", "もんじゃ": "G016", "郷土料理": "G004", "海鮮": "G004",
+    "寿司": "G004", "焼鳥": "G001",
+}
+
+# 別名 → 代表名（GENRE_MAP のキー）
+SYNONYMS: Dict[str, str] = {
+    "焼き鳥": "焼鳥", "やきとり": "焼鳥", "串焼き": "焼鳥", "焼きとん": "居酒屋",
+    "飲み屋": "居酒屋", "酒場": "居酒屋", "大衆酒場": "居酒屋", "立ち飲み": "居酒屋",
+    "焼き肉": "焼肉", "やきにく": "焼肉", "ホルモン": "焼肉", "ジンギスカン": "焼肉",
+    "すし": "寿司", "鮨": "寿司", "鮓": "寿司", "刺身": "海鮮", "魚介": "海鮮",
+    "日本料理": "和食", "割烹": "和食", "懐石": "和食", "天ぷら": "和食", "そば": "和食",
+    "うどん": "和食", "しゃぶしゃぶ": "和食", "すき焼き": "和食", "鍋": "和食",
+    "イタリア料理": "イタリアン", "パスタ": "イタリアン", "ピザ": "イタリアン", "ピッツァ": "イタリアン",
+    "フランス料理": "フレンチ", "ビストロ": "フレンチ",
+    "中華料理": "中華", "中国料理": "中華", "餃子": "中華", "点心": "中華", "四川": "中華",
+    "韓国": "韓国料理", "サムギョプサル": "韓国料理", "チーズタッカルビ": "韓国料理",
+    "エスニック": "アジア", "タイ料理": "アジア", "ベトナム料理": "アジア", "インド料理": "アジア",
+    "カレー": "アジア", "スペイン料理": "バル", "ワインバー": "バー", "ビアバー": "バー",
+    "洋食屋": "洋食", "ハンバーグ": "洋食", "ステーキ": "洋食", "喫茶": "カフェ",
+    "デザート": "スイーツ", "ケーキ": "スイーツ", "らぁ麺": "ラーメン", "つけ麺": "ラーメン",
+    "お好み焼": "お好み焼き", "もんじゃ焼き": "もんじゃ", "鉄板焼き": "お好み焼き",
+}
+
+_EXACT = 1.0
+_SYNONYM = 0.9
+# これ以上なら「全体一致か、語の切れ目に接した部分一致」
+MIN_CONFIDENCE = 0.4
+_DROP = str.maketrans("", "", " \t\n　・･")
+_SEPARATORS = re.compile(r"[,、，/／;；\n]")
+
+
+def _fold_kana(s: str) -> str:
+    # カタカナ（ァ〜ヶ）→ ひらがな。長音「ー」はそのまま
+    return "".join(chr(ord(c) - 0x60) if "ァ" <= c <= "ヶ" else c for c in s)
+
+
+def _unfolded(text: str) -> str:
+    # normalize() のカナ寄せ前。カナ寄せは1文字ずつなので位置はそのまま対応する
+    return unicodedata.normalize("NFKC", str(text)).lower().translate(_DROP)
+
+
+def normalize(text: str) -> str:
+    return _fold_kana(_unfolded(text))
+
+
+def _is_katakana(c: str) -> bool:
+    return "ァ" <= c <= "ヶ" or c == "ー"
+
+
+def _joined(a: str, b: str) -> bool:
+    """a と b が同じ語の続きか（カタカナ同士・英数字同士）。"""
+    if _is_katakana(a) and _is_katakana(b):
+        return True
+    return a.isascii() and a.isalnum() and b.isascii() and b.isalnum()
+
+
+class GenreMatch(NamedTuple):
+    code: str
+    name: str  # 代表名（GENRE_MAP のキー）
+    confidence: float
+    matched: str  # 一致した（正規化後の）キー
+
+
+class _Automaton:
+    """Aho-Corasick（dict のトライ + 失敗リンク）。"""
+
+    def __init__(self, patterns: Dict[str, Tuple[str, str, float]]) -> None:
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[List[Tuple[int, str]]] = [[]]  # (パターン長, パターン)
+        self.patterns = patterns
+        for p in patterns:
+            node = 0
+            for ch in p:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                node = nxt
+            self.out[node].append((len(p), p))
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def find(self, text: str) -> List[Tuple[int, int, str]]:
+        """[(開始, 終了, パターン)]（重なりも含めて全部）。"""
+        hits = []
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            for length, p in self.out[node]:
+                hits.append((i + 1 - length, i + 1, p))
+        return hits
+
+
+def _compile() -> _Automaton:
+    patterns: Dict[str, Tuple[str, str, float]] = {}
+    for alias, name in SYNONYMS.items():
+        patterns[normalize(alias)] = (GENRE_MAP[name], name, _SYNONYM)
+    for name, code in GENRE_MAP.items():
+        patterns[normalize(name)] = (code, name, _EXACT)
+    return _Automaton(patterns)
+
+
+_automaton = _compile()
+
+
+def match_genres(text: str) -> List[GenreMatch]:
+    """text に含まれるジャンルを出現順に（同じコードは一番確からしいものだけ）。
+
+    「、」「,」「/」などで区切られた入力は、区切りごとに確からしさを測る。
+    """
+    best: Dict[str, GenreMatch] = {}
+    order: List[str] = []
+    for segment in _SEPARATORS.split(str(text)):
+        raw = _unfolded(segment)
+        norm = _fold_kana(raw)
+        if not norm:
+            continue
+        hits = sorted(_automaton.find(norm), key=lambda h: (h[0], -(h[1] - h[0])))
+        picked: List[Tuple[int, int, str]] = []
+        end = 0
+        for start, stop, p in hits:
+            if start < end:
+                continue  # 左の最長一致と重なる
+            end = stop
+            picked.append((start, stop, p))
+        starts = {h[0] for h in picked}
+        stops = {h[1] for h in picked}
+        for start, stop, p in picked:
+            code, name, base = _automaton.patterns[p]
+            ratio = (stop - start) / len(norm)
+            anchored = (
+                (start == 0 or start in stops or not _joined(raw[start - 1], raw[start]))
+                and (stop == len(raw) or stop in starts or not _joined(raw[stop - 1], raw[stop]))
+            )
+            if ratio == 1:
+                conf = base
+            elif anchored:
+                conf = round(base * (0.5 + 0.5 * ratio), 3)
+            else:
+                conf = round(base * MIN_CONFIDENCE * ratio, 3)  # 必ず MIN_CONFIDENCE 未満
+            if code not in best:
+                order.append(code)
+            if code not in best or conf > best[code].confidence:
+                best[code] = GenreMatch(code, name, conf, p)
+    return [best[c] for c in order]
+
+
+def genre_codes(names: Sequence[str], min_confidence: float = 0.0) -> List[str]:
+    """名前（カンマ区切りなど複数ジャンル混じりでもよい）の列 → 重複なしのコード列。"""
+    codes: List[str] = []
+    for n in names:
+        for m in match_genres(n):
+            if m.confidence >= min_confidence and m.code not in codes:
+                codes.append(m.code)
+    return codes
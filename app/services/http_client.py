@@ -0,0 +1,171 @@
+# app/services/http_client.py
+"""Hot Pepper API 用の共有 HTTP クライアント。
+
+- `requests.Session` を1つ共有し、keep-alive で接続を使い回す
+  （プールの大きさは HOTPEPPER_POOL_SIZE）
+- 接続タイムアウトと読み取りタイムアウトを分けて指定できる
+  （HOTPEPPER_CONNECT_TIMEOUT / HOTPEPPER_READ_TIMEOUT）
+- エンドポイント（http / https）ごとに成否を覚え、直近で成功した方から試す
+- 続けて `failure_threshold` 回失敗したエンドポイントは `open_seconds` 秒
+  使わない（サーキットブレーカー）。期限が来たら1つの呼び出しだけが試し
+  （half-open。試している間に来た呼び出しは他のエンドポイントへ回るか、
+  他が無ければ失敗する）、成功すれば戻す。全部開いているときは復帰が
+  一番近いものを、やはり1つの呼び出しだけが試す
+"""
+from __future__ import annotations
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class EndpointHealth:
+    __slots__ = (
+        "url", "failures", "open_until", "probing", "last_ok", "last_error", "successes", "errors", "latency_ewma",
+    )
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.failures = 0  # 連続失敗数
+        self.open_until = 0.0  # 0 なら閉じている（健全）
+        self.probing = False  # 開いたエンドポイントを試している呼び出しがある
+        self.last_ok = 0.0
+        self.last_error: Optional[str] = None
+        self.successes = 0
+        self.errors = 0
+        self.latency_ewma: Optional[float] = None
+
+
+class PooledClient:
+    def __init__(
+        self,
+        endpoints: Sequence[str],
+        connect_timeout: float = 3.05,
+        read_timeout: float = 8.0,
+        pool_size: int = 10,
+        failure_threshold: int = 3,
+        open_seconds: float = 30.0,
+    ) -> None:
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+
+        self.session = requests.Session()
+        # リトライはエンドポイントの切り替えで行うので adapter 側ではしない
+        adapter = HTTPAdapter(pool_connections=len(endpoints) or 1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._health: List[EndpointHealth] = [EndpointHealth(u) for u in endpoints]
+
+    @classmethod
+    def from_env(cls, endpoints: Sequence[str], read_timeout: float = 8.0) -> "PooledClient":
+        return cls(
+            endpoints,
+            connect_timeout=float(os.environ.get("HOTPEPPER_CONNECT_TIMEOUT", "3.05")),
+            read_timeout=float(os.environ.get("HOTPEPPER_READ_TIMEOUT", str(read_timeout))),
+            pool_size=int(os.environ.get("HOTPEPPER_POOL_SIZE", "10")),
+        )
+
+    def _order(self) -> List[EndpointHealth]:
+        """試す順：閉じている（健全な）ものを直近成功順に、続けて half-open のもの。
+
+        half-open のものはこの呼び出しが試し役（probing）を取れたときだけ入れる。
+        取った試し役は、実際に試したら _ok / _fail が、試さなかったら _release が返す。
+        """
+        now = time.monotonic()
+        with self._lock:
+            closed = sorted(
+                (h for h in self._health if not h.open_until), key=lambda h: (h.failures, -h.last_ok)
+            )
+            probes = [h for h in self._health if 0 < h.open_until <= now and not h.probing]
+            if not closed and not probes:
+                # 全部開いている → 復帰が一番近いものを1つだけ試す（誰も試していなければ）
+                soonest = min(self._health, key=lambda h: h.open_until)
+                probes = [] if soonest.probing else [soonest]
+            for h in probes:
+                h.probing = True
+            return closed + probes
+
+    def _release(self, tried: List[EndpointHealth], order: List[EndpointHealth]) -> None:
+        """試さずに終わった試し役を返す。"""
+        with self._lock:
+            for h in order:
+                if h not in tried:
+                    h.probing = False
+
+    def _ok(self, h: EndpointHealth, elapsed: float) -> None:
+        with self._lock:
+            h.failures = 0
+            h.open_until = 0.0
+            h.probing = False
+            h.last_ok = time.monotonic()
+            h.successes += 1
+            h.latency_ewma = elapsed if h.latency_ewma is None else 0.8 * h.latency_ewma + 0.2 * elapsed
+
+    def _fail(self, h: EndpointHealth, error: Exception) -> None:
+        with self._lock:
+            h.failures += 1
+            h.errors += 1
+            h.probing = False
+            h.last_error = f"{type(error).__name__}: {error}"
+            if h.failures >= self.failure_threshold:
+                h.open_until = time.monotonic() + self.open_seconds
+
+    def get(self, params: Dict[str, Any], read_timeout: Optional[float] = None) -> requests.Response:
+        """健全なエンドポイントから順に GET し、最初に成功した応答を返す。"""
+        timeout = (self.connect_timeout, self.read_timeout if read_timeout is None else read_timeout)
+        last_exc: Optional[Exception] = None
+        order = self._order()
+        tried: List[EndpointHealth] = []
+        try:
+            for h in order:
+                tried.append(h)
+                t0 = time.monotonic()
+                try:
+                    r = self.session.get(h.url, params=params, timeout=timeout)
+                    r.raise_for_status()
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    self._fail(h, e)
+                    last_exc = e
+                    continue
+                except requests.HTTPError as e:
+                    # 4xx はリクエスト側の問題なのでエンドポイントの故障とはみなさない
+                    if e.response is not None and e.response.status_code < 500:
+                        self._ok(h, time.monotonic() - t0)
+                        raise
+                    self._fail(h, e)
+                    last_exc = e
+                    continue
+                except BaseException:
+                    tried.pop()  # 結果の分からない中断は試さなかったことにする
+                    raise
+                self._ok(h, time.monotonic() - t0)
+                return r
+        finally:
+            self._release(tried, order)
+        raise last_exc or RuntimeError("no endpoint available (circuit open)")
+
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "url": h.url,
+                    "state": "closed" if not h.open_until else "open" if h.open_until > now else "half-open",
+                    "consecutive_failures": h.failures,
+                    "successes": h.successes,
+                    "errors": h.errors,
+                    "latency_ewma_sec": h.latency_ewma,
+                    "last_error": h.last_error,
+                }
+                for h in self._health
+            ]
+
+    def close(self) -> None:
+        self.session.close()
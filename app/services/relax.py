@@ -0,0 +1,164 @@
+# app/services/relax.py
+"""0件だった検索の条件を段階的に緩める（緩和ラダー）。
+
+緩める順（前の段の緩和は引き継ぐ。当てはまらない段は飛ばす）:
+  1) 飲み放題の指定を外す
+  2) 子連れの指定を外す
+  3) 位置検索の範囲を広げる
+  4) 予算を1段上の予算コードに移す
+  5) ジャンルの指定を外す
+
+元の条件と次の数段（HOTPEPPER_RELAX_SPECULATION）を先回りして並列に検索し、
+期限（HOTPEPPER_RELAX_DEADLINE）内で「一番緩めていない、0件でない」結果を返す。
+検索は結果キャッシュと single-flight を通るので、先回りで無駄になった段の
+コストは小さい。
+
+先回りの検索はプロセス全体で HOTPEPPER_RELAX_SPECULATION_MAX 本までにする。
+空きが無ければ先回りはせず、今見ている段だけを順に検索する（今見ている段は
+枠に関係なく必ず投げる）。プールは LLM の同時実行数（LLM_MAX_CONCURRENCY、
+緩和検索はその中から呼ばれる）+ 先回りの枠の大きさにして、どの呼び出しの
+「今見ている段」も他の呼び出しの先回りの後ろで待たないようにする。
+"""
+from __future__ import annotations
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.services.shops import BUDGET_BINS, _pick_budget_code
+
+RELAX_SPECULATION = int(os.environ.get("HOTPEPPER_RELAX_SPECULATION", "2"))
+RELAX_DEADLINE = float(os.environ.get("HOTPEPPER_RELAX_DEADLINE", "8"))
+RELAX_SPECULATION_MAX = int(os.environ.get("HOTPEPPER_RELAX_SPECULATION_MAX", "4"))
+
+Params = Dict[str, Any]
+
+
+def _drop_constraint(name: str) -> Callable[[Params], Optional[Params]]:
+    def step(kw: Params) -> Optional[Params]:
+        c = dict(kw.get("constraints") or {})
+        if not c.get(name):
+            return None
+        c.pop(name)
+        return {**kw, "constraints": c}
+    return step
+
+
+def _widen_range(kw: Params) -> Optional[Params]:
+    if not (isinstance(kw.get("lat"), (int, float)) and isinstance(kw.get("lng"), (int, float))):
+        return None
+    rm = int(kw.get("range_m") or 1000)
+    if rm > 2000:
+        return None  # もう最大（3km）
+    return {**kw, "range_m": 3000 if rm > 1000 else 2000}
+
+
+def _next_budget(kw: Params) -> Optional[Params]:
+    code = _pick_budget_code(kw.get("budget_min"), kw.get("budget_max"))
+    codes = [c for c, _ in BUDGET_BINS]
+    if code is None or code == codes[-1]:
+        return None
+    _, (lo, hi) = BUDGET_BINS[codes.index(code) + 1]
+    return {**kw, "budget_min": lo, "budget_max": hi}
+
+
+def _drop_genre(kw: Params) -> Optional[Params]:
+    if not kw.get("genre_names"):
+        return None
+    return {**kw, "genre_names": None}
+
+
+LADDER: List[Tuple[str, Callable[[Params], Optional[Params]]]] = [
+    ("飲み放題", _drop_constraint("free_drink")),
+    ("子連れ", _drop_constraint("child")),
+    ("範囲を広げた", _widen_range),
+    ("予算を1段上げた", _next_budget),
+    ("ジャンル指定なし", _drop_genre),
+]
+
+
+def rungs(kwargs: Params) -> List[Tuple[List[str], Params]]:
+    """元の条件から順に [(緩めた条件のラベル, 検索パラメタ)]。"""
+    out = [([], dict(kwargs))]
+    for label, step in LADDER:
+        relaxed, kw = out[-1]
+        nxt = step(kw)
+        if nxt is not None:
+            out.append((relaxed + [label], nxt))
+    return out
+
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+# 先回りの検索の枠（全呼び出しで共有）
+_speculation_slots = threading.BoundedSemaphore(max(1, RELAX_SPECULATION_MAX))
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    # shops のファンアウト用プールとは分ける（段の中でファンアウトしても詰まらないように）
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                workers = int(os.environ.get("LLM_MAX_CONCURRENCY", "4")) + max(1, RELAX_SPECULATION_MAX)
+                _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hotpepper-relax")
+    return _pool
+
+
+def search_with_relaxation(
+    search: Callable[..., List[Dict]],
+    kwargs: Params,
+    speculation: Optional[int] = None,
+    deadline_sec: Optional[float] = None,
+) -> Tuple[List[Dict], List[str]]:
+    """
+    search(**kwargs) が0件なら緩和ラダーを下りていく。
+    返却: (店舗リスト, 緩めた条件のラベル)。期限内にどの段も見つからなければ ([], [])
+    元の条件の検索が例外で、どの段も見つからなかったときはその例外を投げる
+    """
+    speculation = RELAX_SPECULATION if speculation is None else speculation
+    deadline = time.monotonic() + (RELAX_DEADLINE if deadline_sec is None else deadline_sec)
+    ladder = rungs(kwargs)
+    pool = _get_pool()
+
+    futures: Dict[int, Future] = {}
+    first_error: Optional[Exception] = None
+    best = 0  # これより前の段はすべて0件（か失敗）
+    while best < len(ladder):
+        if best not in futures:
+            futures[best] = pool.submit(search, **ladder[best][1])
+        # 枠が空いている分だけ speculation 段先までを投げておく
+        for i in range(best + 1, min(len(ladder), best + speculation + 1)):
+            if i in futures:
+                continue
+            if not _speculation_slots.acquire(blocking=False):
+                break
+            futures[i] = pool.submit(search, **ladder[i][1])
+            futures[i].add_done_callback(lambda _: _speculation_slots.release())
+
+        f = futures[best]
+        if not f.done():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            wait([f], timeout=remaining)
+            if not f.done():
+                break
+        try:
+            shops = f.result()
+        except Exception as e:
+            if best == 0:
+                first_error = e
+            shops = []
+        if shops:
+            for g in futures.values():
+                g.cancel()
+            return shops, ladder[best][0]
+        best += 1
+
+    for g in futures.values():
+        g.cancel()
+    if first_error is not None:
+        raise first_error
+    return [], []
@@ -0,0 +1,115 @@
+# app/services/search_cache.py
+"""Hot Pepper 検索結果のキャッシュ（`app.cache.TTLCache` を使う）。
+
+- キーは API キーを除いた検索パラメータを正規化したもの。チャンネルが
+  違っても条件が同じなら共有する
+- 0件の結果は短めの TTL（HOTPEPPER_NEGATIVE_TTL）で覚える（ネガティブキャッシュ）
+- HOTPEPPER_CACHE_PATH を指定すると終了時にディスクへ書き出し、次回起動時に読む
+- ヒット率と「ヒットで省けた待ち時間」（ミス時の平均取得時間 × ヒット数）を
+  `stats()` と /metrics で見られる
+"""
+from __future__ import annotations
+import atexit
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict
+
+from app.cache import TTLCache
+from app.metrics import register_collector
+
+
+def params_key(params: Dict[str, Any]) -> str:
+    body = {k: v for k, v in params.items() if k != "key"}
+    return "search:" + json.dumps(body, sort_keys=True, ensure_ascii=False, default=str, separators=(",", ":"))
+
+
+def _is_empty(data: Dict[str, Any]) -> bool:
+    return not ((data.get("results") or {}).get("shop") or [])
+
+
+class SearchCache:
+    def __init__(
+        self,
+        ttl: float = 900.0,
+        negative_ttl: float = 120.0,
+        max_entries: int = 512,
+        max_bytes: int = 16 * 1024 * 1024,
+        path: str = "",
+    ) -> None:
+        self.negative_ttl = negative_ttl
+        self.cache = TTLCache(ttl=ttl, max_entries=max_entries, max_bytes=max_bytes, path=path or None)
+        self._lock = threading.Lock()
+        self.fetches = 0
+        self.fetch_seconds = 0.0
+        self.negative_stores = 0
+        self.saved_seconds = 0.0
+
+    @classmethod
+    def from_env(cls) -> "SearchCache":
+        return cls(
+            ttl=float(os.environ.get("HOTPEPPER_CACHE_TTL", "900")),
+            negative_ttl=float(os.environ.get("HOTPEPPER_NEGATIVE_TTL", "120")),
+            max_entries=int(os.environ.get("HOTPEPPER_CACHE_MAX_ENTRIES", "512")),
+            max_bytes=int(os.environ.get("HOTPEPPER_CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+            path=os.environ.get("HOTPEPPER_CACHE_PATH", ""),
+        )
+
+    def _avg_fetch(self) -> float:
+        return self.fetch_seconds / self.fetches if self.fetches else 0.0
+
+    def fetch(self, params: Dict[str, Any], loader: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """キャッシュにあればそれを、無ければ loader() の結果を覚えて返す（例外は覚えない）。"""
+        key = params_key(params)
+        data = self.cache.get(key)
+        if data is not None:
+            with self._lock:
+                self.saved_seconds += self._avg_fetch()
+            return data
+
+        t0 = time.monotonic()
+        data = loader()
+        elapsed = time.monotonic() - t0
+        with self._lock:
+            self.fetches += 1
+            self.fetch_seconds += elapsed
+        if _is_empty(data):
+            with self._lock:
+                self.negative_stores += 1
+            self.cache.set(key, data, ttl=self.negative_ttl)
+        else:
+            self.cache.set(key, data)
+        return data
+
+    def stats(self) -> Dict[str, Any]:
+        out = self.cache.stats()
+        with self._lock:
+            out.update({
+                "avg_fetch_sec": self._avg_fetch(),
+                "saved_latency_sec": self.saved_seconds,
+                "negative_stores": self.negative_stores,
+            })
+        return out
+
+    def render(self) -> str:
+        """Prometheus のテキスト形式。"""
+        s = self.stats()
+        return (
+            "# HELP kanjiro_search_cache_lookups_total Hot Pepper result cache lookups.\n"
+            "# TYPE kanjiro_search_cache_lookups_total counter\n"
+            f'kanjiro_search_cache_lookups_total{{result="hit"}} {s["hits"]}\n'
+            f'kanjiro_search_cache_lookups_total{{result="miss"}} {s["misses"]}\n'
+            "# HELP kanjiro_search_cache_saved_seconds_total Estimated API wait avoided by cache hits.\n"
+            "# TYPE kanjiro_search_cache_saved_seconds_total counter\n"
+            f"kanjiro_search_cache_saved_seconds_total {s['saved_latency_sec']}\n"
+        )
+
+    def save(self) -> None:
+        self.cache.save()
+
+
+search_cache = SearchCache.from_env()
+register_collector(search_cache.render)
+if search_cache.cache.path:
+    atexit.register(search_cache.save)
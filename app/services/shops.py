@@ -3,11 +3,21 @@ from __future__ import annotations
 import os
 import json
 import re
+import threading
 import time
-from typing import Dict, List, Optional, Tuple, Any
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Tuple, Any
 
-import requests
-from langchain_google_genai import ChatGoogleGenerativeAI
+from app.services.catalog import get_catalog
+from app.services.genres import GENRE_MAP, MIN_CONFIDENCE, genre_codes, match_genres
+from app.services.http_client import PooledClient
+from app.services.search_cache import search_cache
+from app.metrics import call_site, record_fallback
+from app.agent.response_cache import model_namespace
+from app.singleflight import canonical_key, flights
+
+if TYPE_CHECKING:
+    from langchain_google_genai import ChatGoogleGenerativeAI
 
 # ===================== 基本設定 =====================
 HOTPEPPER_API_KEY_ENV = "HOTPEPPER_API_KEY"  # 必須: 環境変数から与える
@@ -18,15 +28,7 @@ DEFAULT_TIMEOUT = 8.0
 DEBUG = os.environ.get("HOTPEPPER_DEBUG") == "1"
 
 # ===================== マッピング（debug版に準拠/拡張可） =====================
-GENRE_MAP: Dict[str, str] = {
-    "居酒屋": "G001", "ダイニングバー": "G002", "ダイニング": "G002", "創作料理": "G003",
-    "和食": "G004", "洋食": "G005", "イタリアン": "G006", "フレンチ": "G006",
-    "中華": "G007", "焼肉": "G008", "韓国料理": "G017", "アジア": "G009",
-    "各国料理": "G010", "カラオケ": "G011", "バー": "G012", "バル": "G012",
-    "カフェ": "G013", "スイーツ": "G014", "ラーメン": "G015",
-    "お好み焼き": "G016", "もんじゃ": "G016", "郷土料理": "G004", "海鮮": "G004",
-    "寿司": "G004", "焼鳥": "G001",
-}
+# ジャンル名の対応表と表記ゆれ吸収は app.services.genres（GENRE_MAP はここからも参照できる）
 
 BUDGET_BINS: List[Tuple[str, Tuple[int, int]]] = [
     ("B005", (2001, 3000)), ("B006", (3001, 4000)), ("B007", (4001, 5000)),
@@ -59,6 +61,16 @@ def interpret_preferences_with_llm(
     llm: ChatGoogleGenerativeAI,
     convo_text: str,
     current: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    # 同じ会話・同じ現在値での同時呼び出し（/幹事提案 の連打など）は1回にまとめる
+    key = canonical_key("interpret", model_namespace(llm), convo_text, current or {})
+    return flights.do(key, _interpret_preferences_with_llm, llm, convo_text, current)
+
+
+def _interpret_preferences_with_llm(
+    llm: ChatGoogleGenerativeAI,
+    convo_text: str,
+    current: Optional[Dict[str, Any]] = None,
 ) -> Dict[str, Any]:
     current = current or {}
     sys_prompt = (
@@ -85,7 +97,8 @@ def interpret_preferences_with_llm(
         f"{json.dumps(current, ensure_ascii=False)}"
     )
     try:
-        resp = llm.invoke([("system", sys_prompt), ("human", user_prompt)])
+        with call_site("interpret"):
+            resp = llm.invoke([("system", sys_prompt), ("human", user_prompt)])
         text = getattr(resp, "content", str(resp))
         data = json.loads(text)
         return {
@@ -107,6 +120,7 @@ def interpret_preferences_with_llm(
             },
         }
     except Exception:
+        record_fallback("interpret")
         return {
             "area": current.get("area"),
             "lat": None, "lng": None, "range_m": None,
@@ -126,55 +140,133 @@ def _api_key() -> str:
         raise RuntimeError(f"{HOTPEPPER_API_KEY_ENV} is not set")
     return key
 
-def _call(params: Dict[str, Any], timeout_sec: float = DEFAULT_TIMEOUT) -> Dict[str, Any]:
-    """debug版の最小形：http を既定、必要なら https にフォールバック。results.error を検出。"""
+_client: Optional[PooledClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> PooledClient:
+    """共有クライアント（接続プール + エンドポイントの健全性）。初回に作る。"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                # HOTPEPPER_ENDPOINTS（カンマ区切り）で差し替え可（tests.fakes.fake_hotpepper など）
+                endpoints = [e.strip() for e in os.environ.get("HOTPEPPER_ENDPOINTS", "").split(",") if e.strip()]
+                _client = PooledClient.from_env(endpoints or (ENDPOINT_HTTP, ENDPOINT_HTTPS), read_timeout=DEFAULT_TIMEOUT)
+    return _client
+
+
+def _call(params: Dict[str, Any], timeout_sec: Optional[float] = None) -> Dict[str, Any]:
+    """debug版の最小形：健全な方のエンドポイント（既定 http）から試す。results.error を検出。
+
+    timeout_sec を渡すと読み取りタイムアウトだけをそれで上書きする。
+    """
     api_key = _api_key()
     base = {"key": api_key, "format": "json", "count": min(20, MAX_API_COUNT), "order": 4}
     p = {**base, **params}
 
-    last_exc: Optional[Exception] = None
-    for endpoint in (ENDPOINT_HTTP, ENDPOINT_HTTPS):
+    r = get_client().get(p, read_timeout=timeout_sec)
+    # デバッグURL（キーは伏せる）
+    if DEBUG:
         try:
-            r = requests.get(endpoint, params=p, timeout=timeout_sec)
-            # デバッグURL（キーは伏せる）
-            if DEBUG:
-                try:
-                    dbg_url = r.request.url.replace(api_key, "****")
-                    print(f"[GET] {dbg_url}")
-                except Exception:
-                    pass
-            r.raise_for_status()
-            data = r.json()
-            if "error" in (data.get("results") or {}):
-                # 公式は results.error に詳細を載せる
-                raise RuntimeError(f"HotPepper API error: {data['results']['error']}")
-            return data
-        except Exception as e:
-            last_exc = e
-            # https で再試行 → それでもダメなら例外
-            continue
-    raise last_exc or RuntimeError("HotPepper API call failed")
+            dbg_url = r.request.url.replace(api_key, "****")
+            print(f"[GET] {dbg_url}")
+        except Exception:
+            pass
+    data = r.json()
+    if "error" in (data.get("results") or {}):
+        # 公式は results.error に詳細を載せる（エンドポイントを変えても同じなので再試行しない）
+        raise RuntimeError(f"HotPepper API error: {data['results']['error']}")
+    return data
 
 # ===================== パラメタ整形 & 検索 =====================
 def _genre_codes_from_names(names: List[str]) -> List[str]:
-    codes: List[str] = []
-    for n in names:
-        key = str(n).strip()
-        if not key:
-            continue
-        if key in GENRE_MAP:
-            codes.append(GENRE_MAP[key])
-            continue
-        for k, v in GENRE_MAP.items():
-            if key.startswith(k) or k in key:
-                codes.append(v)
-                break
-    # 重複排除
-    uniq: List[str] = []
-    for c in codes:
-        if c not in uniq:
-            uniq.append(c)
-    return uniq
+    """ジャンル名（参加者の入力・LLM の抽出結果）→ 重複なしのコード列（表記ゆれ・同義語も拾う）。
+
+    語の途中に埋もれた部分一致（「メンバー」の「バー」など）は拾わない。
+    """
+    return genre_codes([str(n) for n in names], min_confidence=MIN_CONFIDENCE)
+
+def _budget_codes(bmin: Optional[int], bmax: Optional[int], limit: int = 2) -> List[str]:
+    """予算帯 [bmin, bmax] に重なる予算コードを、中央値に近い順に最大 limit 個。"""
+    first = _pick_budget_code(bmin, bmax)
+    if not (isinstance(bmin, int) and isinstance(bmax, int)):
+        return [first] if first else []
+    target = (bmin + bmax) // 2
+    overlapping = [
+        (code, lo, hi) for code, (lo, hi) in BUDGET_BINS if lo <= bmax and bmin <= hi
+    ]
+    overlapping.sort(key=lambda x: 0 if x[1] <= target <= x[2] else min(abs(target - x[1]), abs(target - x[2])))
+    return [code for code, _, _ in overlapping[:limit]]
+
+
+def _base_params(
+    area_text: Optional[str],
+    constraints: Optional[Dict[str, bool]],
+    lat: Optional[float],
+    lng: Optional[float],
+    range_m: Optional[int],
+    count: int,
+) -> Dict[str, Any]:
+    """ジャンル・予算以外の検索パラメタ。"""
+    # debug版思想：まず最小条件で素直に叩く
+    params: Dict[str, Any] = {"count": min(max(1, count), MAX_API_COUNT)}
+
+    # 位置検索（lat/lng + range）優先。なければ keyword
+    if isinstance(lat, (int, float)) and isinstance(lng, (int, float)):
+        params.update({"lat": float(lat), "lng": float(lng)})
+        rm = int(range_m or 1000)  # 既定1km
+        params["range"] = 1 if rm <= 300 else 2 if rm <= 500 else 3 if rm <= 1000 else 4 if rm <= 2000 else 5
+    elif area_text:
+        params["keyword"] = str(area_text)
+
+    # 制約（付け過ぎると0件化しやすい）
+    c = constraints or {}
+    if c.get("private_room"): params["private_room"] = 1
+    if c.get("non_smoking"): params["non_smoking"] = 1
+    if c.get("card"): params["card"] = 1
+    if c.get("child"): params["child"] = 1
+    if c.get("free_drink"): params["free_drink"] = 1
+    return params
+
+
+def _shop_from_api(s: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": s.get("id"),
+        "name": s.get("name"),
+        "url": (s.get("urls") or {}).get("pc"),
+        "budget_label": (s.get("budget") or {}).get("name"),
+        "address": s.get("address"),
+        "access": s.get("access"),
+        "photo_url": ((s.get("photo") or {}).get("pc") or {}).get("m"),
+    }
+
+
+def _fetch_shops(params: Dict[str, Any], timeout_sec: Optional[float] = None) -> List[Dict]:
+    return _fetch_page(params, timeout_sec)[0]
+
+
+def _fetch_page(params: Dict[str, Any], timeout_sec: Optional[float] = None) -> Tuple[List[Dict], Optional[int]]:
+    """(店舗リスト, 条件に合う全件数)。全件数はローカルのカタログで答えたときは None。"""
+    # 取り込み済みで新しいエリアならローカルのカタログで答える
+    catalog = get_catalog()
+    if catalog is not None:
+        local = catalog.search(params)
+        if local is not None:
+            return local, None
+
+    # 実行（同じ条件の検索は結果キャッシュから。同時に来たものは1回にまとめる）
+    data = search_cache.fetch(
+        params, lambda: flights.do(canonical_key("search", params), _call, params, timeout_sec)
+    )
+    results = data.get("results") or {}
+    shops = results.get("shop") or []
+    try:
+        available: Optional[int] = int(results["results_available"])
+    except (KeyError, TypeError, ValueError):
+        available = None
+    return [_shop_from_api(s) for s in shops], available
+
 
 def search_hotpepper_api(
     area_text: Optional[str],
@@ -189,18 +281,30 @@ def search_hotpepper_api(
 ) -> List[Dict]:
     """
     Hot Pepper 公式APIで検索し、最大MAX_API_COUNT件以内を返す。
-    返却: [{ name, url, budget_label, address, access, photo_url }]
+    取り込み済みで新しいエリアはローカルのカタログ（app.services.catalog）から返す。
+    count が MAX_API_COUNT を超えるときは iter_hotpepper_shops でページ送りして集める。
+    返却: [{ id, name, url, budget_label, address, access, photo_url }]
     """
-    # debug版思想：まず最小条件で素直に叩く
-    params: Dict[str, Any] = {"count": min(max(1, count), MAX_API_COUNT)}
+    if count > MAX_API_COUNT:
+        return list(iter_hotpepper_shops(
+            area_text, budget_min, budget_max, genre_names, constraints, lat, lng, range_m, top_k=count,
+        ))
+    params = _search_params(area_text, budget_min, budget_max, genre_names, constraints, lat, lng, range_m, count)
+    return _fetch_shops(params)
 
-    # 位置検索（lat/lng + range）優先。なければ keyword
-    if isinstance(lat, (int, float)) and isinstance(lng, (int, float)):
-        params.update({"lat": float(lat), "lng": float(lng)})
-        rm = int(range_m or 1000)  # 既定1km
-        params["range"] = 1 if rm <= 300 else 2 if rm <= 500 else 3 if rm <= 1000 else 4 if rm <= 2000 else 5
-    elif area_text:
-        params["keyword"] = str(area_text)
+
+def _search_params(
+    area_text: Optional[str],
+    budget_min: Optional[int],
+    budget_max: Optional[int],
+    genre_names: Optional[List[str]],
+    constraints: Optional[Dict[str, bool]],
+    lat: Optional[float],
+    lng: Optional[float],
+    range_m: Optional[int],
+    count: int,
+) -> Dict[str, Any]:
+    params = _base_params(area_text, constraints, lat, lng, range_m, count)
 
     # 予算（中央値近似→コード）
     b = _pick_budget_code(budget_min, budget_max)
@@ -212,30 +316,181 @@ def search_hotpepper_api(
         codes = _genre_codes_from_names(genre_names)
         if codes:
             params["genre"] = codes[0]
+    return params
 
-    # 制約（付け過ぎると0件化しやすい）
-    c = constraints or {}
-    if c.get("private_room"): params["private_room"] = 1
-    if c.get("non_smoking"): params["non_smoking"] = 1
-    if c.get("card"): params["card"] = 1
-    if c.get("child"): params["child"] = 1
-    if c.get("free_drink"): params["free_drink"] = 1
 
-    # 実行
-    data = _call(params, timeout_sec=DEFAULT_TIMEOUT)
+# ===================== ファンアウト検索（ジャンル × 予算 × エリア） =====================
+FANOUT_WORKERS = int(os.environ.get("HOTPEPPER_FANOUT_WORKERS", "4"))
+FANOUT_DEADLINE = float(os.environ.get("HOTPEPPER_FANOUT_DEADLINE", "6"))
+
+_fanout_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _get_fanout_pool() -> ThreadPoolExecutor:
+    global _fanout_pool
+    if _fanout_pool is None:
+        with _client_lock:
+            if _fanout_pool is None:
+                _fanout_pool = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="hotpepper")
+    return _fanout_pool
+
+
+def search_hotpepper_fanout(
+    area_texts: Optional[List[str]],
+    budget_min: Optional[int],
+    budget_max: Optional[int],
+    genre_names: Optional[List[str]] = None,
+    constraints: Optional[Dict[str, bool]] = None,
+    lat: Optional[float] = None,
+    lng: Optional[float] = None,
+    range_m: Optional[int] = None,
+    count: int = 10,
+    max_budgets: int = 2,
+    deadline_sec: Optional[float] = None,
+) -> List[Dict]:
+    """
+    ジャンルコード × 予算コード（× エリア）の組み合わせを並列に検索してまとめる。
+    - 同じ店（id）は1件にまとめ、`matched_by` にヒットした組み合わせを並べる
+    - 並びは各組み合わせの上位から順に交互に取る（1ジャンルに偏らない）
+    - 全体で deadline_sec 秒を過ぎたら、そこまでに返ってきた結果だけで返す
+    返却: search_hotpepper_api と同じ形 + matched_by: [{ genre, budget, area }]
+    """
+    deadline_sec = FANOUT_DEADLINE if deadline_sec is None else deadline_sec
+    deadline = time.monotonic() + deadline_sec
+
+    names_by_code: Dict[str, str] = {}
+    for n in genre_names or []:
+        for m in match_genres(str(n)):
+            if m.confidence >= MIN_CONFIDENCE:
+                names_by_code.setdefault(m.code, m.name)
+    genres: List[Optional[str]] = list(names_by_code) or [None]
+    budgets: List[Optional[str]] = _budget_codes(budget_min, budget_max, max_budgets) or [None]
+    # 位置検索のときはエリア文字列を使わない
+    use_latlng = isinstance(lat, (int, float)) and isinstance(lng, (int, float))
+    areas: List[Optional[str]] = [None] if use_latlng else ([a for a in (area_texts or []) if a] or [None])
+
+    subqueries = []
+    for area in areas:
+        base = _base_params(area, constraints, lat, lng, range_m, count)
+        for g in genres:
+            for b in budgets:
+                params = dict(base)
+                if g:
+                    params["genre"] = g
+                if b:
+                    params["budget"] = b
+                label = {"genre": names_by_code.get(g) if g else None, "budget": b, "area": area}
+                subqueries.append((label, params))
+
+    pool = _get_fanout_pool()
+    futures = {
+        pool.submit(_fetch_shops, params, max(0.5, deadline - time.monotonic())): i
+        for i, (_, params) in enumerate(subqueries)
+    }
+    done, not_done = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+    for f in not_done:
+        f.cancel()
+
+    results: List[List[Dict]] = [[] for _ in subqueries]
+    for f in done:
+        try:
+            results[futures[f]] = f.result()
+        except Exception:
+            # 1つの組み合わせの失敗で全体を落とさない
+            continue
+    if not any(results) and not_done and not done:
+        raise TimeoutError(f"HotPepper fan-out search exceeded {deadline_sec}s")
+
+    merged: Dict[str, Dict] = {}
+    order: List[str] = []
+    depth = max((len(r) for r in results), default=0)
+    for rank in range(depth):
+        for i, shops in enumerate(results):
+            if rank >= len(shops):
+                continue
+            shop = shops[rank]
+            sid = shop.get("id") or shop.get("url") or shop.get("name")
+            if sid not in merged:
+                merged[sid] = {**shop, "matched_by": []}
+                order.append(sid)
+            merged[sid]["matched_by"].append(subqueries[i][0])
+    return [merged[sid] for sid in order][:max(1, count)]
+
+
+# ===================== ページ送り（start）で順に取る =====================
+PAGE_BUDGET = int(os.environ.get("HOTPEPPER_PAGE_BUDGET", "5"))
+
+
+def iter_hotpepper_shops(
+    area_text: Optional[str],
+    budget_min: Optional[int],
+    budget_max: Optional[int],
+    genre_names: Optional[List[str]] = None,
+    constraints: Optional[Dict[str, bool]] = None,
+    lat: Optional[float] = None,
+    lng: Optional[float] = None,
+    range_m: Optional[int] = None,
+    page_size: int = MAX_API_COUNT,
+    top_k: Optional[int] = None,
+    until: Optional[Callable[[List[Dict]], bool]] = None,
+    max_requests: Optional[int] = None,
+    prefetch: bool = True,
+) -> Iterator[Dict]:
+    """
+    search_hotpepper_api と同じ条件で、1ページ目から順に店舗を1件ずつ返すジェネレータ。
+    - 次のページは必要になってから取る。prefetch=True なら今のページを返している間に
+      次のページを裏で取っておく
+    - top_k 件返したか、until(これまでに返した店舗) が真になったら止める
+      （その先のページは先読みもしない）
+    - API を叩くのは最大 max_requests 回（HOTPEPPER_PAGE_BUDGET）。件数の足りない
+      ページか、results_available 件まで取り終えたページで打ち切る
+    - ページがずれて同じ店が2度出てきても1回しか返さない
+    """
+    max_requests = PAGE_BUDGET if max_requests is None else max_requests
+    page_size = max(1, min(100, page_size))  # API の上限は 100
+    base = _search_params(area_text, budget_min, budget_max, genre_names, constraints, lat, lng, range_m, page_size)
+    base["count"] = page_size
+
+    def page_params(n: int) -> Dict[str, Any]:
+        # 1ページ目は start なし（結果キャッシュ・ローカルのカタログにも載る）
+        return base if n == 0 else {**base, "start": 1 + n * page_size}
+
+    def done(out: List[Dict]) -> bool:
+        return (top_k is not None and len(out) >= top_k) or (until is not None and bool(until(out)))
 
-    shops = (data.get("results") or {}).get("shop") or []
     out: List[Dict] = []
-    for s in shops:
-        out.append({
-            "name": s.get("name"),
-            "url": (s.get("urls") or {}).get("pc"),
-            "budget_label": (s.get("budget") or {}).get("name"),
-            "address": s.get("address"),
-            "access": s.get("access"),
-            "photo_url": ((s.get("photo") or {}).get("pc") or {}).get("m"),
-        })
-    return out
+    seen = set()
+    requests_made = 0
+    pending: Optional[Future] = None
+    try:
+        for n in range(max_requests):
+            if pending is not None:
+                (shops, available), pending = pending.result(), None
+            else:
+                shops, available = _fetch_page(page_params(n))
+            requests_made += 1
+            last_page = len(shops) < page_size or (available is not None and (n + 1) * page_size >= available)
+
+            # 今のページで足りそうになければ次のページを先読み
+            if prefetch and not last_page and requests_made < max_requests:
+                if top_k is None or len(out) + len(shops) < top_k:
+                    pending = _get_fanout_pool().submit(_fetch_page, page_params(n + 1))
+
+            for shop in shops:
+                sid = shop.get("id") or shop.get("url") or shop.get("name")
+                if sid in seen:
+                    continue
+                seen.add(sid)
+                out.append(shop)
+                yield shop
+                if done(out):
+                    return
+            if last_page:
+                return
+    finally:
+        if pending is not None:
+            pending.cancel()
+
 
 # ===================== 上位：会話 → 正規化 → 検索 =====================
 def find_shops(
@@ -247,6 +502,8 @@ def find_shops(
     """
     1) LLMで意図理解し正規化
     2) Hot Pepper APIでフィルタ検索（最大MAX_API_COUNT件→上位take件）
+       ジャンルが複数あればジャンル × 予算のファンアウト検索
+    3) 0件なら条件を緩めて再検索（緩めた条件は各店舗の relaxed に入れる）
     """
     normalized = interpret_preferences_with_llm(
         llm=llm,
@@ -259,15 +516,30 @@ def find_shops(
         },
     )
 
-    shops = search_hotpepper_api(
-        area_text=normalized.get("area"),
+    # LLM がジャンルを拾えなかったらフォームの入力を使う
+    genre_names = normalized.get("genres") or [
+        g.strip() for g in (form_inputs.get("cuisine") or "").split(",") if g.strip()
+    ]
+    kwargs = dict(
         budget_min=normalized.get("budget_min"),
         budget_max=normalized.get("budget_max"),
-        genre_names=normalized.get("genres"),
+        genre_names=genre_names,
         constraints=normalized.get("constraints"),
         lat=normalized.get("lat"),
         lng=normalized.get("lng"),
         range_m=normalized.get("range_m"),
         count=min(MAX_API_COUNT, max(take, 10)),
     )
-    return shops[:take]
+    kwargs["area_text"] = normalized.get("area")
+
+    def _search(area_text: Optional[str], genre_names: Optional[List[str]], **kw: Any) -> List[Dict]:
+        if len(_genre_codes_from_names(genre_names or [])) > 1:
+            # 複数ジャンル → ジャンル × 予算で並列に検索してまとめる
+            return search_hotpepper_fanout(area_texts=[area_text], genre_names=genre_names, **kw)
+        return search_hotpepper_api(area_text=area_text, genre_names=genre_names, **kw)
+
+    # 0件なら条件を段階的に緩める（先の段も並列に先回りして検索）
+    from app.services.relax import search_with_relaxation
+
+    shops, relaxed = search_with_relaxation(_search, kwargs)
+    return [{**s, "relaxed": relaxed} for s in shops[:take]]
@@ -0,0 +1,75 @@
+"""同じ入力の呼び出しが同時に走ったら1回にまとめる（single-flight）。
+
+`flights.do(("search", params), fn, ...)` の形で使う。同じキーの呼び出しが
+実行中なら、後から来た呼び出しは実行せずにその結果（例外ならその例外）を
+待って受け取る。結果はまとめた呼び出し全員で同じオブジェクトを共有するので、
+呼び出し側で書き換えないこと。完了後は覚えない（キャッシュではない）。
+"""
+from __future__ import annotations
+import json
+import threading
+from collections import defaultdict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from app.metrics import register_collector
+
+
+def canonical_key(kind: str, *args: Any, **kwargs: Any) -> Tuple[str, str]:
+    """呼び出し種別と入力から、順序や表記に依存しないキーを作る。"""
+    body = json.dumps([args, kwargs], sort_keys=True, ensure_ascii=False, default=str, separators=(",", ":"))
+    return (kind, body)
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._inflight: Dict[Hashable, Future] = {}
+        # 種別ごとの統計
+        self.executed: Dict[str, int] = defaultdict(int)
+        self.shared: Dict[str, int] = defaultdict(int)  # 実行せずに済んだ回数
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        kind = key[0] if isinstance(key, tuple) and key else str(key)
+        with self._lock:
+            fut = self._inflight.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._inflight[key] = Future()
+                self.executed[kind] += 1
+            else:
+                self.shared[kind] += 1
+        if not leader:
+            return fut.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            kinds = set(self.executed) | set(self.shared)
+            return {k: {"executed": self.executed[k], "saved": self.shared[k]} for k in sorted(kinds)}
+
+    def render(self) -> str:
+        """Prometheus のテキスト形式。"""
+        lines = [
+            "# HELP kanjiro_singleflight_calls_total Coalesced calls by kind and outcome.",
+            "# TYPE kanjiro_singleflight_calls_total counter",
+        ]
+        for kind, s in self.stats().items():
+            lines.append(f'kanjiro_singleflight_calls_total{{kind="{kind}",outcome="executed"}} {s["executed"]}')
+            lines.append(f'kanjiro_singleflight_calls_total{{kind="{kind}",outcome="saved"}} {s["saved"]}')
+        return "\n".join(lines) + "\n"
+
+
+flights = SingleFlight()
+register_collector(flights.render)
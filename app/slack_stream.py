@@ -0,0 +1,89 @@
+"""生成途中の応答を Slack のメッセージへ段階的に反映する。
+
+先にプレースホルダを投稿し、以後は `chat.update` で同じメッセージを
+書き換える。更新は `min_interval` 秒に1回までにまとめ（途中の版は捨てて
+最新だけを送る）、Slack のレート制限（chat.update は Tier 3）に収める。
+`finish()` で渡した本文がそのまま最終版になる。
+"""
+from __future__ import annotations
+import logging
+import os
+import threading
+import time
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# 生成途中であることを示す末尾の印（最終版には付けない）
+CURSOR = " …"
+
+
+class ThrottledMessage:
+    def __init__(
+        self,
+        client: Any,
+        channel: str,
+        thread_ts: Optional[str] = None,
+        prefix: str = "",
+        placeholder: str = "考え中…",
+        min_interval: Optional[float] = None,
+    ) -> None:
+        self.client = client
+        self.channel = channel
+        self.thread_ts = thread_ts
+        self.prefix = prefix
+        self.placeholder = placeholder
+        if min_interval is None:
+            min_interval = float(os.environ.get("SLACK_STREAM_INTERVAL", "1.0"))
+        self.min_interval = min_interval
+
+        self.ts: Optional[str] = None
+        self._lock = threading.Lock()
+        self._last_sent = ""
+        self._last_at = 0.0
+        self.updates = 0
+
+    def start(self) -> None:
+        """プレースホルダを投稿する（失敗しても finish() で通常投稿に切り替える）。"""
+        try:
+            resp = self.client.chat_postMessage(
+                channel=self.channel, thread_ts=self.thread_ts, text=self.prefix + self.placeholder
+            )
+            self.ts = resp["ts"]
+            self._last_sent = self.prefix + self.placeholder
+            self._last_at = time.monotonic()
+        except Exception:
+            logger.exception("failed to post placeholder message")
+
+    def update(self, text: str) -> None:
+        """途中経過。前回の送信から min_interval 経っていなければ送らない。"""
+        if self.ts is None:
+            return
+        with self._lock:
+            if time.monotonic() - self._last_at < self.min_interval:
+                return
+            self._send(self.prefix + text + CURSOR)
+
+    def finish(self, text: str) -> None:
+        """最終版を送る。"""
+        final = self.prefix + text
+        with self._lock:
+            if self.ts is None:
+                self.client.chat_postMessage(channel=self.channel, thread_ts=self.thread_ts, text=final)
+                return
+            self._send(final, force=True)
+
+    def _send(self, text: str, force: bool = False) -> None:
+        if text == self._last_sent:
+            return
+        try:
+            self.client.chat_update(channel=self.channel, ts=self.ts, text=text)
+            self._last_sent = text
+            self.updates += 1
+        except Exception:
+            if force:
+                raise
+            # 途中版の失敗（レート制限など）は次の更新に任せる
+            logger.warning("chat.update failed; will retry with the next chunk", exc_info=True)
+        finally:
+            self._last_at = time.monotonic()
@@ -0,0 +1,76 @@
+"""起動時間の計測。
+
+`main.py` の先頭で `StartupTimer` を作り、import 完了・初期化完了・Socket Mode
+接続・最初のイベント受信の各時点を記録してログへ出す。
+
+`python -m app.startup` は別プロセスでアプリのモジュールを import し、
+その所要時間と、遅延読み込みにしたはずの重いモジュール（langchain など）が
+import 時点で読み込まれていないかを確認する。予算（STARTUP_IMPORT_BUDGET 秒）
+超過か重いモジュールの読み込みがあれば終了コード 1 を返す。
+"""
+from __future__ import annotations
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+# 起動時には読み込まない（初回利用か warm-up で読み込む）モジュール
+LAZY_MODULES = ("langchain", "langchain_core", "langchain_google_genai", "requests")
+# 起動時に import するアプリのモジュール
+APP_MODULES = ("app.agent", "app.flows.kanji_flow", "app.store", "app.executor", "app.slack_stream")
+
+
+class StartupTimer:
+    def __init__(self, t0: Optional[float] = None) -> None:
+        self.t0 = time.perf_counter() if t0 is None else t0
+        self.marks: Dict[str, float] = {}
+        self._first_event = threading.Event()
+
+    def mark(self, name: str) -> float:
+        elapsed = time.perf_counter() - self.t0
+        self.marks[name] = elapsed
+        sys.stderr.write(f"[INFO] startup: {name} at {elapsed:.3f}s\n")
+        return elapsed
+
+    def install(self, app: Any) -> None:
+        """最初に届いたイベントの時刻を記録するミドルウェアを登録する。"""
+
+        @app.middleware
+        def _first_event_probe(next):
+            if not self._first_event.is_set():
+                self._first_event.set()
+                self.mark("first_event")
+            return next()
+
+    def summary(self) -> str:
+        return " ".join(f"{k}={v:.3f}s" for k, v in self.marks.items())
+
+
+def measure_imports(modules: List[str] = list(APP_MODULES)) -> Dict[str, Any]:
+    """別プロセスで modules を import し、所要時間と読み込まれた重いモジュールを返す。"""
+    code = (
+        "import json, sys, time\n"
+        "t = time.perf_counter()\n"
+        f"for m in {modules!r}:\n"
+        "    __import__(m)\n"
+        "elapsed = time.perf_counter() - t\n"
+        f"lazy = [m for m in {LAZY_MODULES!r} if m in sys.modules]\n"
+        "print(json.dumps({'seconds': elapsed, 'eager': lazy}))\n"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    budget = float(os.environ.get("STARTUP_IMPORT_BUDGET", "1.0"))
+    result = measure_imports()
+    print(f"import: {result['seconds']:.3f}s (budget {budget:.3f}s)")
+    if result["eager"]:
+        print(f"eagerly imported: {', '.join(result['eager'])}")
+    sys.exit(1 if result["seconds"] > budget or result["eager"] else 0)
@@ -0,0 +1,102 @@
+"""企画（plan）/参加者/投票のストア。
+
+モジュール関数は現在のバックエンドへ委譲する。既定はインメモリ
+（`MemoryStore`・再起動で消えます）。永続化したい場合は起動時に
+`configure_store(SQLiteStore(path))`（DB）または
+`configure_store(JournaledStore(dir))`（追記ジャーナル + スナップショット）で差し替える。
+期限切れ企画の退避は `PlanSweeper` が担う。
+"""
+from __future__ import annotations
+from typing import Dict, List, Optional, Any
+
+from app.store.base import BaseStore
+from app.store.journal import JournaledStore
+from app.store.lifecycle import JsonlArchive, PlanSweeper
+from app.store.memory import MemoryStore
+from app.store.records import Participant, Plan
+from app.store.sqlite import SQLiteStore
+
+_store: BaseStore = MemoryStore()
+
+
+def configure_store(store: BaseStore) -> BaseStore:
+    """バックエンドを差し替える。以前のバックエンドは close して返す。"""
+    global _store
+    prev, _store = _store, store
+    prev.close()
+    return prev
+
+
+def get_store() -> BaseStore:
+    return _store
+
+
+def create_plan(thread_ts: str, channel_id: str, title: Optional[str] = None) -> None:
+    _store.create_plan(thread_ts, channel_id, title)
+
+
+def update_plan_status(thread_ts: str, status: str) -> None:
+    _store.update_plan_status(thread_ts, status)
+
+
+def upsert_participant(thread_ts: str, user_id: str, fields: Dict[str, Any]) -> None:
+    _store.upsert_participant(thread_ts, user_id, fields)
+
+
+def list_participants(thread_ts: str) -> List[Participant]:
+    """参加者レコード一覧（dict 互換の get()/[] で読める）。"""
+    return _store.list_participants(thread_ts)
+
+
+def record_vote(thread_ts: str, user_id: str, idx: int) -> None:
+    _store.record_vote(thread_ts, user_id, idx)
+
+
+def get_latest_plan_thread(channel_id: str) -> Optional[str]:
+    """同一チャンネルで最後に create_plan された thread_ts を返す。"""
+    return _store.get_latest_plan_thread(channel_id)
+
+
+def eligible_voter_ids(thread_ts: str) -> List[str]:
+    """投票対象（参加/未定）のユーザーID一覧。"""
+    return _store.eligible_voter_ids(thread_ts)
+
+
+def tally_votes(thread_ts: str) -> Dict[int, int]:
+    """proposal_index -> 票数 の辞書（1..3 をキーに集計）。"""
+    return _store.tally_votes(thread_ts)
+
+
+def voters_who_voted(thread_ts: str) -> List[str]:
+    """すでに投票済みのユーザーID一覧。"""
+    return _store.voters_who_voted(thread_ts)
+
+
+def vote_snapshot(thread_ts: str) -> Dict[str, Any]:
+    """票数・投票対象数・投票済み数・全員投票済みか、をまとめて返す。"""
+    return _store.vote_snapshot(thread_ts)
+
+
+def participants_summary(thread_ts: str) -> Dict[str, Any]:
+    """参加者集計（date_counts/area/budget/cuisine と回答状況の件数）を返す。"""
+    return _store.participants_summary(thread_ts)
+
+
+def get_channel_id(thread_ts: str) -> Optional[str]:
+    """企画スレッドのチャネルIDを返す。"""
+    return _store.get_channel_id(thread_ts)
+
+
+def evict_plan(thread_ts: str) -> Optional[Dict[str, Any]]:
+    """企画を削除し、圧縮した最終結果を返す（存在しなければ None）。"""
+    return _store.evict_plan(thread_ts)
+
+
+__all__ = [
+    "BaseStore", "MemoryStore", "SQLiteStore", "JournaledStore", "configure_store", "get_store",
+    "PlanSweeper", "JsonlArchive", "evict_plan", "Participant", "Plan",
+    "create_plan", "update_plan_status", "upsert_participant", "list_participants",
+    "record_vote", "get_latest_plan_thread", "eligible_voter_ids", "tally_votes",
+    "voters_who_voted", "vote_snapshot", "participants_summary",
+    "get_channel_id",
+]
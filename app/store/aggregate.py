@@ -0,0 +1,172 @@
+from __future__ import annotations
+import heapq
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.store.records import Participant, value_to_date
+from app.store.tally import ELIGIBLE_ATTENDANCE
+
+DEFAULT_BUDGET = (3000, 5000)
+
+
+class RunningMedian:
+    """追加・削除に対応した中央値（下側 max-heap + 上側 min-heap、削除は遅延）。
+
+    statistics.median と同じく、偶数個のときは中央2値の平均を返す。
+    """
+
+    __slots__ = ("_lo", "_hi", "_lo_size", "_hi_size", "_delayed", "_live")
+
+    def __init__(self) -> None:
+        self._lo: List[int] = []  # 符号反転して max-heap として使う
+        self._hi: List[int] = []
+        self._lo_size = 0  # 遅延削除分を除いた実サイズ
+        self._hi_size = 0
+        self._delayed: Counter = Counter()
+        self._live: Counter = Counter()  # 値ごとの（削除されていない）個数
+
+    def __len__(self) -> int:
+        return self._lo_size + self._hi_size
+
+    def add(self, v: int) -> None:
+        self._live[v] += 1
+        if not self._lo or v <= -self._lo[0]:
+            heapq.heappush(self._lo, -v)
+            self._lo_size += 1
+        else:
+            heapq.heappush(self._hi, v)
+            self._hi_size += 1
+        self._rebalance()
+
+    def remove(self, v: int) -> None:
+        """v を1つ取り除く（入っていない値なら何もしない）。"""
+        if not self._live[v]:
+            return
+        self._live[v] -= 1
+        if not self._live[v]:
+            del self._live[v]
+        self._delayed[v] += 1
+        if self._lo and v <= -self._lo[0]:
+            self._lo_size -= 1
+            if v == -self._lo[0]:
+                self._prune(self._lo, sign=-1)
+        else:
+            self._hi_size -= 1
+            if self._hi and v == self._hi[0]:
+                self._prune(self._hi, sign=1)
+        self._rebalance()
+
+    def median(self) -> Optional[float]:
+        if not len(self):
+            return None
+        if self._lo_size > self._hi_size:
+            return float(-self._lo[0])
+        return (-self._lo[0] + self._hi[0]) / 2
+
+    def _prune(self, heap: List[int], sign: int) -> None:
+        while heap:
+            v = heap[0] * sign
+            if not self._delayed[v]:
+                break
+            self._delayed[v] -= 1
+            if not self._delayed[v]:
+                del self._delayed[v]
+            heapq.heappop(heap)
+
+    def _rebalance(self) -> None:
+        # lo は hi と同数か1つ多い状態に保つ
+        if self._lo_size > self._hi_size + 1:
+            heapq.heappush(self._hi, -heapq.heappop(self._lo))
+            self._lo_size -= 1
+            self._hi_size += 1
+            self._prune(self._lo, sign=-1)
+        elif self._lo_size < self._hi_size:
+            heapq.heappush(self._lo, -heapq.heappop(self._hi))
+            self._hi_size -= 1
+            self._lo_size += 1
+            self._prune(self._hi, sign=1)
+
+
+class ParticipantAggregate:
+    """1企画ぶんの参加者集計を upsert ごとに差分更新する。
+
+    ユーザーごとに直前の寄与（日付・エリア・予算・ジャンル）を覚えておき、
+    参加可否の変更やモーダル再送信のたびに旧寄与を引いて新寄与を足す。
+    `summary()` は `_participants_summary` と同じ形の dict を返す。
+    """
+
+    __slots__ = (
+        "_contrib", "attendance_counts", "filled", "date_counts",
+        "area_counts", "cuisine_counts", "budget_min", "budget_max",
+    )
+
+    def __init__(self) -> None:
+        self._contrib: Dict[str, Tuple] = {}
+        self.attendance_counts: Counter = Counter()
+        self.filled = 0
+        self.date_counts: Counter = Counter()
+        self.area_counts: Counter = Counter()
+        self.cuisine_counts: Counter = Counter()
+        self.budget_min = RunningMedian()
+        self.budget_max = RunningMedian()
+
+    @staticmethod
+    def _contribution(row: Participant) -> Tuple:
+        # レコードは upsert 時に正規化済み（日付=序数、ジャンル=トークン列）なので再解析しない
+        attendance = row.attendance
+        eligible = attendance in ELIGIBLE_ATTENDANCE
+        filled = (eligible and bool(row.dates)) or attendance == "no"
+        if not eligible:
+            return (attendance, filled, (), None, None, None, ())
+        return (attendance, filled, row.dates, row.area or None, row.budget_min, row.budget_max, row.cuisine)
+
+    def _apply(self, contrib: Tuple, sign: int) -> None:
+        attendance, filled, dates, area, bmin, bmax, cuisines = contrib
+        self.attendance_counts[attendance] += sign
+        self.filled += sign if filled else 0
+        for d in dates:
+            self.date_counts[d] += sign
+            if self.date_counts[d] <= 0:
+                del self.date_counts[d]
+        if area:
+            self.area_counts[area] += sign
+            if self.area_counts[area] <= 0:
+                del self.area_counts[area]
+        for c in cuisines:
+            self.cuisine_counts[c] += sign
+            if self.cuisine_counts[c] <= 0:
+                del self.cuisine_counts[c]
+        if bmin is not None:
+            self.budget_min.add(bmin) if sign > 0 else self.budget_min.remove(bmin)
+        if bmax is not None:
+            self.budget_max.add(bmax) if sign > 0 else self.budget_max.remove(bmax)
+
+    def update(self, user_id: str, row: Participant) -> None:
+        """user_id の行が row になったことを反映する。"""
+        new = self._contribution(row)
+        old = self._contrib.get(user_id)
+        if old == new:
+            return
+        if old is not None:
+            self._apply(old, -1)
+        self._apply(new, +1)
+        self._contrib[user_id] = new
+
+    def summary(self) -> Dict[str, Any]:
+        area = self.area_counts.most_common(1)[0][0] if self.area_counts else None
+        mmin, mmax = self.budget_min.median(), self.budget_max.median()
+        budget = (int(mmin), int(mmax)) if mmin is not None and mmax is not None else DEFAULT_BUDGET
+        yes_cnt = self.attendance_counts["yes"]
+        maybe_cnt = self.attendance_counts["maybe"]
+        return {
+            "date_counts": Counter({value_to_date(d): c for d, c in self.date_counts.items()}),
+            "area": area,
+            "budget": budget,
+            "cuisine": [c for c, _ in self.cuisine_counts.most_common(3)],
+            "total": len(self._contrib),
+            "yes": yes_cnt,
+            "maybe": maybe_cnt,
+            "no": self.attendance_counts["no"],
+            "participants_count": yes_cnt + maybe_cnt,
+            "filled": self.filled,
+        }
@@ -0,0 +1,102 @@
+from __future__ import annotations
+from typing import Dict, List, Optional, Any
+
+from app.store.records import Participant
+
+
+class BaseStore:
+    """企画/参加者/投票ストアの共通インターフェース。
+
+    実装は `MemoryStore`（既定・テスト用）と `SQLiteStore`（永続化）。
+    `app.store` のモジュール関数はここに委譲する。
+    """
+
+    def create_plan(self, thread_ts: str, channel_id: str, title: Optional[str] = None) -> None:
+        raise NotImplementedError
+
+    def update_plan_status(self, thread_ts: str, status: str) -> None:
+        raise NotImplementedError
+
+    def upsert_participant(self, thread_ts: str, user_id: str, fields: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def list_participants(self, thread_ts: str) -> List[Participant]:
+        raise NotImplementedError
+
+    def record_vote(self, thread_ts: str, user_id: str, idx: int) -> None:
+        raise NotImplementedError
+
+    def get_latest_plan_thread(self, channel_id: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def eligible_voter_ids(self, thread_ts: str) -> List[str]:
+        raise NotImplementedError
+
+    def tally_votes(self, thread_ts: str) -> Dict[int, int]:
+        raise NotImplementedError
+
+    def voters_who_voted(self, thread_ts: str) -> List[str]:
+        raise NotImplementedError
+
+    def vote_snapshot(self, thread_ts: str) -> Dict[str, Any]:
+        """{"counter", "eligible_total", "voted_count", "complete"} を返す（O(1)）。"""
+        raise NotImplementedError
+
+    def participants_summary(self, thread_ts: str) -> Dict[str, Any]:
+        """差分更新済みの参加者集計（ParticipantAggregate.summary()）を返す。"""
+        raise NotImplementedError
+
+    def get_channel_id(self, thread_ts: str) -> Optional[str]:
+        raise NotImplementedError
+
+    # ---------- ライフサイクル ----------
+    def expired_plans(self, now: float, done_ttl: float, idle_ttl: float, limit: int) -> List[str]:
+        """
+        期限切れの thread_ts を最大 limit 件返す。
+        - status=done になってから done_ttl 秒経過
+        - 最終更新から idle_ttl 秒経過（status 問わず）
+        """
+        raise NotImplementedError
+
+    def evict_plan(self, thread_ts: str) -> Optional[Dict[str, Any]]:
+        """企画と参加者/投票を削除し、圧縮した最終結果（compact_plan_result）を返す。"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """保留中の書き込みを確定して資源を解放する（既定は何もしない）。"""
+        return None
+
+
+def compact_plan_result(
+    thread_ts: str,
+    plan: Dict[str, Any],
+    snapshot: Dict[str, Any],
+    summary: Dict[str, Any],
+) -> Dict[str, Any]:
+    """退避（アーカイブ）用に企画の最終結果を JSON 化できる小さな dict にまとめる。"""
+    counter = snapshot.get("counter") or {}
+    winner = None
+    if any(counter.values()):
+        winner, _ = max(counter.items(), key=lambda kv: (kv[1], -kv[0]))
+    return {
+        "thread_ts": thread_ts,
+        "channel_id": plan.get("channel_id"),
+        "title": plan.get("title"),
+        "status": plan.get("status"),
+        "created_at": plan.get("created_at"),
+        "updated_at": plan.get("updated_at"),
+        "finished_at": plan.get("finished_at"),
+        "winner": winner,
+        "votes": {str(k): v for k, v in counter.items()},
+        "eligible_total": snapshot.get("eligible_total", 0),
+        "voted_count": snapshot.get("voted_count", 0),
+        "summary": {
+            "date_counts": dict(summary.get("date_counts") or {}),
+            "area": summary.get("area"),
+            "budget": list(summary.get("budget") or ()),
+            "cuisine": list(summary.get("cuisine") or ()),
+            "yes": summary.get("yes", 0),
+            "maybe": summary.get("maybe", 0),
+            "no": summary.get("no", 0),
+        },
+    }
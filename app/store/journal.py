@@ -0,0 +1,288 @@
+"""追記専用ジャーナル + 定期スナップショットによる MemoryStore の永続化。
+
+DB を使わずに再起動をまたいで企画を残すためのバックエンド。
+- 書き込み系 API（create_plan / update_plan_status / upsert_participant /
+  record_vote / evict_plan）は1呼び出し=1行の JSONL としてセグメントへ追記する
+- fsync はバックグラウンドで `fsync_interval` 秒ごとにまとめて行う（buffered fsync）
+- `snapshot_interval` 秒ごと（かつ前回以降に書き込みがあれば）全状態を
+  snapshot-<seq>.json に書き出し、<seq> より古いセグメントを削除する
+- 起動時は最新スナップショットを読み、<seq> 以降のセグメントだけを再生する
+
+ジャーナルの各操作は「値の上書き」なので、スナップショットに一部含まれて
+いる操作を再生しても最終状態は変わらない（スナップショット取得と並行して
+書き込みがあっても整合する）。
+"""
+from __future__ import annotations
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.store.memory import MemoryStore
+from app.store.records import Plan
+
+logger = logging.getLogger(__name__)
+
+_SEGMENT_RE = re.compile(r"^journal-(\d{8})\.jsonl$")
+_SNAPSHOT_RE = re.compile(r"^snapshot-(\d{8})\.json$")
+
+# 操作コード（1行を短く保つ）
+OP_CREATE = "p"
+OP_STATUS = "s"
+OP_UPSERT = "u"
+OP_VOTE = "v"
+OP_EVICT = "e"
+
+
+def _segment_name(seq: int) -> str:
+    return f"journal-{seq:08d}.jsonl"
+
+
+def _snapshot_name(seq: int) -> str:
+    return f"snapshot-{seq:08d}.json"
+
+
+class Journal:
+    """セグメント分割された JSONL ジャーナル（スレッドセーフ）。"""
+
+    def __init__(self, directory: str, seq: int) -> None:
+        self.directory = directory
+        self.seq = seq
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._file = open(os.path.join(directory, _segment_name(seq)), "a", encoding="utf-8")
+
+    def append(self, entry: List[Any]) -> None:
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+            self._dirty = True
+
+    def sync(self) -> None:
+        """バッファを書き出して fsync する（書き込みが無ければ何もしない）。"""
+        with self._lock:
+            self._sync_locked()
+
+    def _sync_locked(self) -> None:
+        if self._dirty:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._dirty = False
+
+    def rotate(self) -> int:
+        """現在のセグメントを閉じて次のセグメントへ切り替え、新しい seq を返す。"""
+        with self._lock:
+            self._sync_locked()
+            self._file.close()
+            self.seq += 1
+            self._file = open(os.path.join(self.directory, _segment_name(self.seq)), "a", encoding="utf-8")
+            return self.seq
+
+    def close(self) -> None:
+        with self._lock:
+            self._sync_locked()
+            self._file.close()
+
+
+class JournaledStore(MemoryStore):
+    """MemoryStore にジャーナルとスナップショットによる永続化を足したもの。"""
+
+    def __init__(
+        self,
+        directory: str = "kanjiro-journal",
+        fsync_interval: float = 0.2,
+        snapshot_interval: float = 600.0,
+        lock_stripes: int = 64,
+    ) -> None:
+        super().__init__(lock_stripes=lock_stripes)
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.snapshot_interval = snapshot_interval
+        os.makedirs(directory, exist_ok=True)
+
+        self._replaying = True
+        self._ops_since_snapshot = 0
+        seq = self._recover()
+        self._replaying = False
+        self._clock = time.time
+
+        self._journal = Journal(directory, seq)
+        self._snapshot_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._background, name="store-journal", daemon=True)
+        self._thread.start()
+
+    # ---------- 書き込み（適用 → 追記。同じ企画の操作はストライプロックで順序が揃う） ----------
+    def _log(self, entry: List[Any]) -> None:
+        if not self._replaying:
+            self._journal.append(entry)
+            self._ops_since_snapshot += 1
+
+    def create_plan(self, thread_ts: str, channel_id: str, title: Optional[str] = None) -> None:
+        with self._lock(thread_ts):
+            super().create_plan(thread_ts, channel_id, title)
+            self._log([OP_CREATE, self._clock(), thread_ts, channel_id, title])
+
+    def update_plan_status(self, thread_ts: str, status: str) -> None:
+        with self._lock(thread_ts):
+            super().update_plan_status(thread_ts, status)
+            self._log([OP_STATUS, self._clock(), thread_ts, status])
+
+    def upsert_participant(self, thread_ts: str, user_id: str, fields: Dict[str, Any]) -> None:
+        with self._lock(thread_ts):
+            super().upsert_participant(thread_ts, user_id, fields)
+            self._log([OP_UPSERT, self._clock(), thread_ts, user_id, fields or {}])
+
+    def record_vote(self, thread_ts: str, user_id: str, idx: int) -> None:
+        with self._lock(thread_ts):
+            super().record_vote(thread_ts, user_id, idx)
+            self._log([OP_VOTE, self._clock(), thread_ts, user_id, idx])
+
+    def evict_plan(self, thread_ts: str) -> Optional[Dict[str, Any]]:
+        with self._lock(thread_ts):
+            result = super().evict_plan(thread_ts)
+            if result is not None:
+                self._log([OP_EVICT, self._clock(), thread_ts])
+        return result
+
+    # ---------- 再生 ----------
+    def _apply(self, entry: List[Any]) -> None:
+        op, at = entry[0], entry[1]
+        self._clock = lambda: at
+        if op == OP_CREATE:
+            super().create_plan(entry[2], entry[3], entry[4])
+        elif op == OP_STATUS:
+            super().update_plan_status(entry[2], entry[3])
+        elif op == OP_UPSERT:
+            super().upsert_participant(entry[2], entry[3], entry[4])
+        elif op == OP_VOTE:
+            super().record_vote(entry[2], entry[3], entry[4])
+        elif op == OP_EVICT:
+            super().evict_plan(entry[2])
+
+    def _recover(self) -> int:
+        """最新スナップショット + それ以降のジャーナルから状態を復元し、書き込み先の seq を返す。"""
+        names = os.listdir(self.directory)
+        snapshots = sorted(int(m.group(1)) for m in map(_SNAPSHOT_RE.match, names) if m)
+        segments = sorted(int(m.group(1)) for m in map(_SEGMENT_RE.match, names) if m)
+
+        base = 0
+        if snapshots:
+            base = snapshots[-1]
+            with open(os.path.join(self.directory, _snapshot_name(base)), encoding="utf-8") as f:
+                self._restore(json.load(f))
+
+        replayed = 0
+        for seq in segments:
+            if seq < base:
+                continue
+            with open(os.path.join(self.directory, _segment_name(seq)), encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # クラッシュ時の書きかけ行（末尾）は捨てる
+                        logger.warning("skipping torn journal line in segment %d", seq)
+                        continue
+                    self._apply(entry)
+                    replayed += 1
+        if replayed:
+            logger.info("store journal: replayed %d entries after snapshot %d", replayed, base)
+        self._ops_since_snapshot = replayed
+        # 既存セグメントには追記せず、新しいセグメントから書き始める
+        return max(segments[-1] + 1 if segments else 0, base)
+
+    # ---------- スナップショット ----------
+    def _dump(self) -> Dict[str, Any]:
+        plans: List[Dict[str, Any]] = []
+        participants: Dict[str, Dict[str, Any]] = {}
+        votes: Dict[str, Dict[str, int]] = {}
+        with self._meta_lock:
+            activity: List[Tuple[str, float]] = list(self._by_activity.items())
+            finished: List[Tuple[str, float]] = list(self._finished.items())
+        for ts, _ in activity:
+            with self._lock(ts):
+                plan = self.plans.get(ts)
+                if plan is not None:
+                    plans.append({"thread_ts": ts, **plan.to_dict()})
+                rows = self.participants.get(ts)
+                if rows:
+                    participants[ts] = {uid: r.to_dict() for uid, r in rows.items()}
+                tally = self._tallies.get(ts)
+                if tally is not None and tally.voters:
+                    votes[ts] = dict(tally.voters)
+        plans.sort(key=lambda p: p["created_at"])
+        return {
+            "plans": plans,
+            "participants": participants,
+            "votes": votes,
+            "activity": activity,
+            "finished": finished,
+        }
+
+    def _restore(self, snap: Dict[str, Any]) -> None:
+        for p in snap.get("plans", []):
+            ts = p["thread_ts"]
+            self.plans[ts] = Plan(
+                p["channel_id"], p.get("title"), p.get("status") or "attendance",
+                p.get("created_at") or 0.0, p.get("updated_at") or 0.0, p.get("finished_at"),
+            )
+            self._plans_by_channel.setdefault(p["channel_id"], {})[ts] = None
+        for ts, rows in snap.get("participants", {}).items():
+            for uid, row in rows.items():
+                super().upsert_participant(ts, uid, row)
+        for ts, voters in snap.get("votes", {}).items():
+            for uid, idx in voters.items():
+                super().record_vote(ts, uid, idx)
+        # 上の復元で触った最終更新はスナップショット時点の値に戻す
+        self._by_activity = OrderedDict((ts, at) for ts, at in snap.get("activity", []))
+        self._finished = OrderedDict((ts, at) for ts, at in snap.get("finished", []))
+        for ts, at in self._by_activity.items():
+            if ts in self.plans:
+                self.plans[ts].updated_at = at
+
+    def snapshot(self) -> int:
+        """スナップショットを書き出して古いセグメントを削除し、その seq を返す。"""
+        with self._snapshot_lock:
+            # 先に切り替えるので、以後の書き込みは新セグメント（= 再生対象）に入る
+            seq = self._journal.rotate()
+            self._ops_since_snapshot = 0
+            data = self._dump()
+            path = os.path.join(self.directory, _snapshot_name(seq))
+            tmp = path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+
+            for name in os.listdir(self.directory):
+                m = _SEGMENT_RE.match(name) or _SNAPSHOT_RE.match(name)
+                if m and int(m.group(1)) < seq:
+                    os.remove(os.path.join(self.directory, name))
+            return seq
+
+    def _background(self) -> None:
+        last_snapshot = time.monotonic()
+        while not self._stop.wait(self.fsync_interval):
+            try:
+                self._journal.sync()
+                if (
+                    self._ops_since_snapshot
+                    and time.monotonic() - last_snapshot >= self.snapshot_interval
+                ):
+                    self.snapshot()
+                    last_snapshot = time.monotonic()
+            except Exception:
+                logger.exception("store journal background task failed")
+
+    def close(self) -> None:
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._journal.close()
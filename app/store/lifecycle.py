@@ -0,0 +1,118 @@
+"""企画のライフサイクル管理（期限切れ企画の退避）。
+
+Socket Mode で長時間動かし続けてもストアが増え続けないよう、
+- status=done になってから `done_ttl` 秒
+- 最終更新から `idle_ttl` 秒
+経過した企画をバックグラウンドで少しずつ削除する。削除時には圧縮した
+最終結果（`compact_plan_result`）を任意の archive フックへ渡す。
+"""
+from __future__ import annotations
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from app.store.base import BaseStore
+
+logger = logging.getLogger(__name__)
+
+ArchiveHook = Callable[[Dict[str, Any]], None]
+
+
+class JsonlArchive:
+    """最終結果を JSONL ファイルへ追記する archive フック。"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, result: Dict[str, Any]) -> None:
+        line = json.dumps(result, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+class PlanSweeper:
+    """期限切れ企画を小さなバッチで退避するバックグラウンドスレッド。
+
+    1回の掃除で扱うのは最大 `batch_size` 件。1件ずつストアを触るので
+    リスナー側の書き込みを長く待たせない。バッチが満杯だった（まだ残って
+    いそうな）ときは `batch_pause` 秒だけ空けて続きを処理する。
+    """
+
+    def __init__(
+        self,
+        get_store: Optional[Callable[[], BaseStore]] = None,
+        done_ttl: float = 3 * 24 * 3600,
+        idle_ttl: float = 30 * 24 * 3600,
+        interval: float = 300.0,
+        batch_size: int = 50,
+        batch_pause: float = 0.5,
+        archive: Optional[ArchiveHook] = None,
+    ) -> None:
+        if get_store is None:
+            from app.store import get_store
+        self.get_store = get_store
+        self.done_ttl = done_ttl
+        self.idle_ttl = idle_ttl
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self.batch_pause = batch_pause
+        self.archive = archive
+        self.evicted_total = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls) -> "PlanSweeper":
+        """PLAN_DONE_TTL / PLAN_IDLE_TTL / PLAN_SWEEP_INTERVAL（秒）と PLAN_ARCHIVE_PATH から組み立てる。"""
+        archive_path = os.environ.get("PLAN_ARCHIVE_PATH")
+        return cls(
+            done_ttl=float(os.environ.get("PLAN_DONE_TTL", 3 * 24 * 3600)),
+            idle_ttl=float(os.environ.get("PLAN_IDLE_TTL", 30 * 24 * 3600)),
+            interval=float(os.environ.get("PLAN_SWEEP_INTERVAL", 300)),
+            archive=JsonlArchive(archive_path) if archive_path else None,
+        )
+
+    def run_once(self, now: Optional[float] = None) -> int:
+        """期限切れを最大 batch_size 件退避し、退避した件数を返す。"""
+        store = self.get_store()
+        now = time.time() if now is None else now
+        evicted = 0
+        for thread_ts in store.expired_plans(now, self.done_ttl, self.idle_ttl, self.batch_size):
+            result = store.evict_plan(thread_ts)
+            if result is None:
+                continue
+            evicted += 1
+            if self.archive is not None:
+                try:
+                    self.archive(result)
+                except Exception:
+                    logger.exception("archive hook failed for plan %s", thread_ts)
+        self.evicted_total += evicted
+        return evicted
+
+    def _loop(self) -> None:
+        delay = self.interval
+        while not self._stop.wait(delay):
+            try:
+                n = self.run_once()
+            except Exception:
+                logger.exception("plan sweep failed")
+                n = 0
+            delay = self.batch_pause if n >= self.batch_size else self.interval
+
+    def start(self) -> "PlanSweeper":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="plan-sweeper", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
@@ -0,0 +1,195 @@
+from __future__ import annotations
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any
+
+from app.store.aggregate import ParticipantAggregate
+from app.store.base import BaseStore, compact_plan_result
+from app.store.records import Participant, Plan, intern_id
+from app.store.tally import VoteTally
+
+
+class MemoryStore(BaseStore):
+    """インメモリ版（再起動で消えます）。テストと開発時の既定。
+
+    Bolt はリスナーをスレッドプールで動かすため、スレッド（企画）単位の
+    状態は thread_ts でストライプしたロックで守る。別チャンネル・別企画の
+    クリックは互いを待たない。チャンネル索引と期限管理の順序付き dict だけは
+    短い共有ロック（_meta_lock）で守る。ロック順は「ストライプ → meta」。
+    """
+
+    def __init__(self, lock_stripes: int = 64) -> None:
+        self._stripes = [threading.RLock() for _ in range(max(1, lock_stripes))]
+        self._meta_lock = threading.Lock()
+        self._clock = time.time
+
+        # 1スレッド＝1企画
+        # plans[thread_ts] = Plan(channel_id, title, status, created_at, updated_at, finished_at)
+        #   status: "attendance" | "dates" | "prefs" | "confirm" | "done"
+        self.plans: Dict[str, Plan] = {}
+
+        # participants[thread_ts][user_id] = Participant(attendance, dates, area, budget_min, budget_max, cuisine)
+        # スレッド単位で持つので、読み出しは問い合わせたスレッドの件数ぶんだけで済む
+        self.participants: Dict[str, Dict[str, Participant]] = {}
+
+        # 投票は _tallies[thread_ts].voters（user_id -> proposal_index 1..3）が正本
+        # _tallies[thread_ts] = 投票の差分集計（票数・投票対象・未投票者）
+        self._tallies: Dict[str, VoteTally] = {}
+        # _aggregates[thread_ts] = 参加者集計（日付/エリア/予算/ジャンル）
+        self._aggregates: Dict[str, ParticipantAggregate] = {}
+        # _plans_by_channel[channel_id] = {thread_ts: None, ...}（create_plan 順の順序付き集合）
+        self._plans_by_channel: Dict[str, Dict[str, None]] = {}
+
+        # ===== ライフサイクル（古い順） =====
+        # _by_activity: 最終更新が古い順。触るたびに末尾へ移す
+        self._by_activity: "OrderedDict[str, float]" = OrderedDict()
+        # _finished: status=done になった順
+        self._finished: "OrderedDict[str, float]" = OrderedDict()
+
+    def _lock(self, thread_ts: str) -> threading.RLock:
+        return self._stripes[hash(thread_ts) % len(self._stripes)]
+
+    def _touch(self, thread_ts: str) -> None:
+        """最終更新を記録する（ストライプロック保持中に呼ぶ）。"""
+        # 企画の無いスレッドへの書き込み（退避後の遅れたクリック等）も期限管理に載せる
+        now = self._clock()
+        plan = self.plans.get(thread_ts)
+        if plan is not None:
+            plan.updated_at = now
+        with self._meta_lock:
+            self._by_activity[thread_ts] = now
+            self._by_activity.move_to_end(thread_ts)
+
+    def create_plan(self, thread_ts: str, channel_id: str, title: Optional[str] = None) -> None:
+        thread_ts = intern_id(thread_ts)
+        with self._lock(thread_ts):
+            if thread_ts in self.plans:
+                return
+            now = self._clock()
+            plan = self.plans[thread_ts] = Plan(channel_id, title, created_at=now, updated_at=now)
+            with self._meta_lock:
+                self._plans_by_channel.setdefault(plan.channel_id, {})[thread_ts] = None
+                self._by_activity[thread_ts] = now
+                self._by_activity.move_to_end(thread_ts)
+
+    def update_plan_status(self, thread_ts: str, status: str) -> None:
+        with self._lock(thread_ts):
+            plan = self.plans.get(thread_ts)
+            if plan is None:
+                return
+            plan.status = intern_id(status)
+            self._touch(thread_ts)
+            with self._meta_lock:
+                if status == "done":
+                    if thread_ts not in self._finished:
+                        plan.finished_at = self._finished[thread_ts] = plan.updated_at
+                elif self._finished.pop(thread_ts, None) is not None:
+                    plan.finished_at = None
+
+    def upsert_participant(self, thread_ts: str, user_id: str, fields: Dict[str, Any]) -> None:
+        thread_ts, user_id = intern_id(thread_ts), intern_id(user_id)
+        with self._lock(thread_ts):
+            rows = self.participants.get(thread_ts)
+            if rows is None:
+                rows = self.participants[thread_ts] = {}
+            row = rows.get(user_id)
+            if row is None:
+                row = rows[user_id] = Participant()
+            row.update(fields)
+            self._tally(thread_ts).set_attendance(user_id, row.attendance)
+            agg = self._aggregates.get(thread_ts)
+            if agg is None:
+                agg = self._aggregates[thread_ts] = ParticipantAggregate()
+            agg.update(user_id, row)
+            self._touch(thread_ts)
+
+    def list_participants(self, thread_ts: str) -> List[Participant]:
+        # レコードは書き込み側が更新し続けるので、呼び出し時点の複製を返す
+        with self._lock(thread_ts):
+            return [r.copy() for r in self.participants.get(thread_ts, {}).values()]
+
+    def record_vote(self, thread_ts: str, user_id: str, idx: int) -> None:
+        thread_ts, user_id = intern_id(thread_ts), intern_id(user_id)
+        with self._lock(thread_ts):
+            self._tally(thread_ts).set_vote(user_id, idx)
+            self._touch(thread_ts)
+
+    def _tally(self, thread_ts: str) -> VoteTally:
+        tally = self._tallies.get(thread_ts)
+        if tally is None:
+            tally = self._tallies[thread_ts] = VoteTally()
+        return tally
+
+    def get_latest_plan_thread(self, channel_id: str) -> Optional[str]:
+        """
+        同一チャンネルで最後に create_plan された thread_ts を返す。
+        （インメモリなので “後勝ち” で最新扱い）
+        """
+        with self._meta_lock:
+            threads = self._plans_by_channel.get(channel_id)
+            return next(reversed(threads)) if threads else None
+
+    def eligible_voter_ids(self, thread_ts: str) -> List[str]:
+        """投票対象（参加/未定）のユーザーID一覧。"""
+        with self._lock(thread_ts):
+            tally = self._tallies.get(thread_ts)
+            return tally.eligible_ids() if tally else []
+
+    def tally_votes(self, thread_ts: str) -> Dict[int, int]:
+        """proposal_index -> 票数 の辞書（1..3 をキーに集計）。"""
+        with self._lock(thread_ts):
+            tally = self._tallies.get(thread_ts) or VoteTally()
+            return dict(tally.counts)
+
+    def voters_who_voted(self, thread_ts: str) -> List[str]:
+        """すでに投票済みのユーザーID一覧。"""
+        with self._lock(thread_ts):
+            tally = self._tallies.get(thread_ts)
+            return tally.voter_ids() if tally else []
+
+    def vote_snapshot(self, thread_ts: str) -> Dict[str, Any]:
+        with self._lock(thread_ts):
+            return (self._tallies.get(thread_ts) or VoteTally()).snapshot()
+
+    def participants_summary(self, thread_ts: str) -> Dict[str, Any]:
+        with self._lock(thread_ts):
+            return (self._aggregates.get(thread_ts) or ParticipantAggregate()).summary()
+
+    def get_channel_id(self, thread_ts: str) -> Optional[str]:
+        """企画スレッドのチャネルIDを返す。"""
+        p = self.plans.get(thread_ts)
+        return p.channel_id if p else None
+
+    # ---------- ライフサイクル ----------
+    def expired_plans(self, now: float, done_ttl: float, idle_ttl: float, limit: int) -> List[str]:
+        # どちらの列も古い順なので、先頭から期限内の要素に当たった時点で打ち切れる
+        out: List[str] = []
+        with self._meta_lock:
+            for ts, finished_at in self._finished.items():
+                if len(out) >= limit or finished_at + done_ttl > now:
+                    break
+                out.append(ts)
+            for ts, updated_at in self._by_activity.items():
+                if len(out) >= limit or updated_at + idle_ttl > now:
+                    break
+                if ts not in out:
+                    out.append(ts)
+        return out
+
+    def evict_plan(self, thread_ts: str) -> Optional[Dict[str, Any]]:
+        with self._lock(thread_ts):
+            with self._meta_lock:
+                if self._by_activity.pop(thread_ts, None) is None and thread_ts not in self.plans:
+                    return None
+                self._finished.pop(thread_ts, None)
+                plan = self.plans.pop(thread_ts, None) or {}
+                threads = self._plans_by_channel.get(plan.get("channel_id"))
+                if threads is not None:
+                    threads.pop(thread_ts, None)
+                    if not threads:
+                        del self._plans_by_channel[plan["channel_id"]]
+            tally = self._tallies.pop(thread_ts, None) or VoteTally()
+            agg = self._aggregates.pop(thread_ts, None) or ParticipantAggregate()
+            self.participants.pop(thread_ts, None)
+        return compact_plan_result(thread_ts, plan, tally.snapshot(), agg.summary())
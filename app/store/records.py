@@ -0,0 +1,163 @@
+"""ストアのレコード型（__slots__ で1件あたりのメモリを抑える）。
+
+- thread_ts / user_id は `sys.intern` して同じ文字列を共有する
+- 候補日は日付の序数（date.toordinal()）で持つ
+- ジャンルは upsert 時に一度だけトークン化してタプルで持つ
+
+既存の呼び出し側のため、`get()` / `[]` で従来の dict 形式
+（dates は ISO 文字列のリスト、cuisine はカンマ区切り文字列）として読める。
+"""
+from __future__ import annotations
+import sys
+from datetime import date
+from typing import Any, Dict, Iterator, Optional, Tuple, Union
+
+DateValue = Union[int, str]  # 通常は序数。ISO として解釈できない入力だけ文字列のまま
+
+
+def intern_id(s: Optional[str]) -> Optional[str]:
+    return sys.intern(s) if isinstance(s, str) else s
+
+
+def split_cuisine(raw: Any) -> Tuple[str, ...]:
+    """カンマ区切りのジャンル文字列をトークン列にする。"""
+    if not raw:
+        return ()
+    if isinstance(raw, (list, tuple)):
+        return tuple(str(x).strip() for x in raw if str(x).strip())
+    return tuple(x.strip() for x in str(raw).split(",") if x.strip())
+
+
+def date_to_value(d: Any) -> DateValue:
+    try:
+        return date.fromisoformat(str(d)).toordinal()
+    except ValueError:
+        return str(d)
+
+
+def value_to_date(v: DateValue) -> str:
+    return date.fromordinal(v).isoformat() if isinstance(v, int) else v
+
+
+def _parse_dates(raw: Any) -> Tuple[DateValue, ...]:
+    # dates を文字列→配列統一
+    if isinstance(raw, str):
+        raw = [d.strip() for d in raw.split(",") if d.strip()]
+    return tuple(date_to_value(d) for d in (raw or ()))
+
+
+class _DictView:
+    """__slots__ レコードを読み取り専用の dict 風に見せる共通部。"""
+
+    __slots__ = ()
+    _fields: Tuple[str, ...] = ()
+
+    def _view(self, key: str) -> Any:
+        return getattr(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in self._fields:
+            v = self._view(key)
+            return default if v is None else v
+        return default
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._fields:
+            raise KeyError(key)
+        return self._view(key)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._fields
+
+    def keys(self) -> Iterator[str]:
+        return iter(self._fields)
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        return ((k, self._view(k)) for k in self._fields)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.items())
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class Plan(_DictView):
+    __slots__ = ("channel_id", "title", "status", "created_at", "updated_at", "finished_at")
+    _fields = __slots__
+
+    def __init__(
+        self,
+        channel_id: str,
+        title: Optional[str] = None,
+        status: str = "attendance",
+        created_at: float = 0.0,
+        updated_at: float = 0.0,
+        finished_at: Optional[float] = None,
+    ) -> None:
+        self.channel_id = intern_id(channel_id)
+        self.title = title
+        self.status = intern_id(status)
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.finished_at = finished_at
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key not in self._fields:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+
+class Participant(_DictView):
+    """参加者1名ぶんの回答。"""
+
+    __slots__ = ("attendance", "dates", "area", "budget_min", "budget_max", "cuisine")
+    _fields = __slots__
+
+    def __init__(self) -> None:
+        self.attendance: Optional[str] = None
+        self.dates: Tuple[DateValue, ...] = ()
+        self.area: Optional[str] = None
+        self.budget_min: Optional[int] = None
+        self.budget_max: Optional[int] = None
+        self.cuisine: Tuple[str, ...] = ()
+
+    @classmethod
+    def from_dict(cls, row: Dict[str, Any]) -> "Participant":
+        p = cls()
+        p.update(row)
+        return p
+
+    def update(self, fields: Optional[Dict[str, Any]]) -> "Participant":
+        """upsert_participant の行マージ規則（未知のキーは無視）。"""
+        for k, v in (fields or {}).items():
+            if k == "dates":
+                self.dates = _parse_dates(v)
+            elif k == "cuisine":
+                self.cuisine = split_cuisine(v)
+            elif k == "attendance" or k == "area":
+                setattr(self, k, intern_id(v))
+            elif k in ("budget_min", "budget_max"):
+                setattr(self, k, int(v) if v is not None else None)
+        return self
+
+    def copy(self) -> "Participant":
+        p = Participant.__new__(Participant)
+        for k in self.__slots__:
+            setattr(p, k, getattr(self, k))
+        return p
+
+    def iso_dates(self) -> list:
+        return [value_to_date(v) for v in self.dates]
+
+    def _view(self, key: str) -> Any:
+        if key == "dates":
+            return self.iso_dates()
+        if key == "cuisine":
+            return ", ".join(self.cuisine) if self.cuisine else None
+        return getattr(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key == "dates":
+            return self.iso_dates()
+        return super().get(key, default)
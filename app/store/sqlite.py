@@ -0,0 +1,379 @@
+from __future__ import annotations
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Any
+
+from app.store.aggregate import ParticipantAggregate
+from app.store.base import BaseStore, compact_plan_result
+from app.store.records import Participant
+from app.store.tally import VoteTally
+
+# ===================== スキーマ =====================
+# participants.data は Participant の dict 表現（Participant.to_dict()）を JSON で持つ。
+# attendance だけは投票対象の絞り込みに使うので列として複製する。
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS plans (
+    thread_ts  TEXT PRIMARY KEY,
+    channel_id TEXT NOT NULL,
+    title      TEXT,
+    status     TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_plans_channel_created ON plans (channel_id, created_at);
+
+CREATE TABLE IF NOT EXISTS participants (
+    thread_ts  TEXT NOT NULL,
+    user_id    TEXT NOT NULL,
+    attendance TEXT,
+    data       TEXT NOT NULL,
+    PRIMARY KEY (thread_ts, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_participants_thread ON participants (thread_ts);
+
+CREATE TABLE IF NOT EXISTS votes (
+    thread_ts TEXT NOT NULL,
+    user_id   TEXT NOT NULL,
+    idx       INTEGER NOT NULL,
+    PRIMARY KEY (thread_ts, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_votes_thread ON votes (thread_ts);
+"""
+
+# 企画の無いスレッド（退避後に遅れて届いたクリックなど）の最終更新。
+# plans と同じく idle_ttl で期限切れにする（旧スキーマの DB には作ってから埋める）
+_SCHEMA_ORPHANS = """
+CREATE TABLE IF NOT EXISTS orphans (
+    thread_ts  TEXT PRIMARY KEY,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_orphans_updated ON orphans (updated_at);
+"""
+
+# 期限切れ検索用（旧スキーマの DB には列を足してから作る）
+_SCHEMA_LIFECYCLE = """
+CREATE INDEX IF NOT EXISTS idx_plans_updated ON plans (updated_at);
+CREATE INDEX IF NOT EXISTS idx_plans_finished ON plans (finished_at);
+"""
+
+# 文は定数にしておき、sqlite3 の statement cache（= prepared statement）に載せる
+_SQL_INSERT_PLAN = (
+    "INSERT OR IGNORE INTO plans (thread_ts, channel_id, title, status, created_at, updated_at) "
+    "VALUES (?, ?, ?, 'attendance', ?, ?)"
+)
+_SQL_UPDATE_STATUS = (
+    "UPDATE plans SET status = ?, updated_at = ?, "
+    "finished_at = CASE WHEN ? = 'done' THEN COALESCE(finished_at, ?) ELSE NULL END "
+    "WHERE thread_ts = ?"
+)
+_SQL_TOUCH_PLAN = "UPDATE plans SET updated_at = ? WHERE thread_ts = ?"
+_SQL_TOUCH_ORPHAN = (
+    "INSERT INTO orphans (thread_ts, updated_at) VALUES (?, ?) "
+    "ON CONFLICT (thread_ts) DO UPDATE SET updated_at = excluded.updated_at"
+)
+_SQL_SELECT_PARTICIPANT = "SELECT data FROM participants WHERE thread_ts = ? AND user_id = ?"
+_SQL_UPSERT_PARTICIPANT = (
+    "INSERT INTO participants (thread_ts, user_id, attendance, data) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT (thread_ts, user_id) DO UPDATE SET attendance = excluded.attendance, data = excluded.data"
+)
+_SQL_LIST_PARTICIPANTS = "SELECT data FROM participants WHERE thread_ts = ? ORDER BY rowid"
+_SQL_LIST_PARTICIPANTS_WITH_USER = "SELECT user_id, data FROM participants WHERE thread_ts = ? ORDER BY rowid"
+_SQL_UPSERT_VOTE = (
+    "INSERT INTO votes (thread_ts, user_id, idx) VALUES (?, ?, ?) "
+    "ON CONFLICT (thread_ts, user_id) DO UPDATE SET idx = excluded.idx"
+)
+_SQL_LATEST_PLAN = (
+    "SELECT thread_ts FROM plans WHERE channel_id = ? "
+    "ORDER BY created_at DESC, rowid DESC LIMIT 1"
+)
+_SQL_ELIGIBLE = (
+    "SELECT user_id FROM participants WHERE thread_ts = ? "
+    "AND attendance IN ('yes', 'maybe') ORDER BY rowid"
+)
+_SQL_VOTES = "SELECT user_id, idx FROM votes WHERE thread_ts = ? ORDER BY rowid"
+_SQL_CHANNEL = "SELECT channel_id FROM plans WHERE thread_ts = ?"
+_SQL_PLAN = (
+    "SELECT channel_id, title, status, created_at, updated_at, finished_at "
+    "FROM plans WHERE thread_ts = ?"
+)
+_SQL_EXPIRED_DONE = "SELECT thread_ts FROM plans WHERE finished_at <= ? ORDER BY finished_at LIMIT ?"
+_SQL_EXPIRED_IDLE = "SELECT thread_ts FROM plans WHERE updated_at <= ? ORDER BY updated_at LIMIT ?"
+_SQL_EXPIRED_ORPHANS = "SELECT thread_ts FROM orphans WHERE updated_at <= ? ORDER BY updated_at LIMIT ?"
+# 移行時に一度だけ: plans に行が無いのに参加者/投票だけ残っているスレッド
+_SQL_BACKFILL_ORPHANS = (
+    "INSERT OR IGNORE INTO orphans (thread_ts, updated_at) "
+    "SELECT thread_ts, ? FROM participants WHERE thread_ts NOT IN (SELECT thread_ts FROM plans) "
+    "UNION SELECT thread_ts, ? FROM votes WHERE thread_ts NOT IN (SELECT thread_ts FROM plans)"
+)
+_SQL_DELETE_ORPHAN = "DELETE FROM orphans WHERE thread_ts = ?"
+_SQL_DELETE_PLAN = "DELETE FROM plans WHERE thread_ts = ?"
+_SQL_DELETE_PARTICIPANTS = "DELETE FROM participants WHERE thread_ts = ?"
+_SQL_DELETE_VOTES = "DELETE FROM votes WHERE thread_ts = ?"
+
+
+class SQLiteStore(BaseStore):
+    """SQLite（WALモード）による永続ストア。
+
+    ボタン連打などの書き込みバーストはグループコミットでまとめる：
+    書き込みは開いたトランザクションに積み、`commit_batch` 件に達するか
+    `commit_interval` 秒経過した時点でまとめて COMMIT する。
+    読み出しは同じ接続で行うため未コミット分も見える。
+
+    投票集計（VoteTally）と参加者集計（ParticipantAggregate）はスレッドごとに
+    初回参照時に DB から組み立て、以後は書き込みに合わせて差分更新する。
+
+    ロックは2種類。企画（thread_ts）単位の状態＝集計キャッシュは MemoryStore と
+    同じくストライプしたロックで守り、投票数・参加者集計の読み出しは別企画の
+    書き込みを待たない。接続（と開いているトランザクション）は1本なので、
+    SQL を発行する間だけ短い共有ロック（_db_lock）を取る。ロック順は
+    「ストライプ → _db」。
+
+    SQL の読み出し（参加者一覧・最新企画など）は書き込みと同じ接続・同じロックで
+    直列に行う。読み出し専用の接続（WAL の読み手）に分けると、グループコミット
+    前の書き込みが見えなくなる（押したボタンが一覧に出ない）ため。
+    """
+
+    def __init__(
+        self,
+        path: str = "kanjiro.db",
+        commit_interval: float = 0.05,
+        commit_batch: int = 64,
+        lock_stripes: int = 64,
+    ) -> None:
+        self.path = path
+        self.commit_interval = commit_interval
+        self.commit_batch = max(1, commit_batch)
+
+        # isolation_level=None でトランザクションを自前管理する
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, cached_statements=64
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+
+        self._stripes = [threading.RLock() for _ in range(max(1, lock_stripes))]
+        self._db_lock = threading.RLock()
+        self._tallies: Dict[str, VoteTally] = {}
+        self._aggregates: Dict[str, ParticipantAggregate] = {}
+        self._pending = 0
+        self._closed = False
+        self._wake = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="sqlite-store-commit", daemon=True)
+        self._flusher.start()
+
+    def _migrate(self) -> None:
+        """旧スキーマ（updated_at/finished_at 無し）の DB に列を足す。"""
+        cols = {r[1] for r in self._conn.execute("PRAGMA table_info(plans)")}
+        if "updated_at" not in cols:
+            self._conn.execute("ALTER TABLE plans ADD COLUMN updated_at REAL")
+            self._conn.execute("UPDATE plans SET updated_at = created_at")
+        if "finished_at" not in cols:
+            self._conn.execute("ALTER TABLE plans ADD COLUMN finished_at REAL")
+        self._conn.executescript(_SCHEMA_LIFECYCLE)
+        has_orphans = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'orphans'"
+        ).fetchone()
+        self._conn.executescript(_SCHEMA_ORPHANS)
+        if not has_orphans:
+            # 既にある孤児は「今触られた」ものとして idle_ttl 後に退避する
+            now = time.time()
+            self._conn.execute(_SQL_BACKFILL_ORPHANS, (now, now))
+
+    def _lock(self, thread_ts: str) -> threading.RLock:
+        return self._stripes[hash(thread_ts) % len(self._stripes)]
+
+    # ---------- グループコミット ----------
+    def _write(self, sql: str, params: tuple) -> int:
+        """書き込みをトランザクションに積み、変更した行数を返す（_db_lock 保持中に呼ぶ）。"""
+        if self._pending == 0:
+            self._conn.execute("BEGIN")
+        changed = self._conn.execute(sql, params).rowcount
+        self._pending += 1
+        if self._pending >= self.commit_batch:
+            self._commit()
+        else:
+            self._wake.set()
+        return changed
+
+    def _touch(self, thread_ts: str) -> None:
+        """最終更新を記録する。企画の無いスレッドは orphans で期限を測る（_db_lock 保持中に呼ぶ）。"""
+        now = time.time()
+        if not self._write(_SQL_TOUCH_PLAN, (now, thread_ts)):
+            self._write(_SQL_TOUCH_ORPHAN, (thread_ts, now))
+
+    def _commit(self) -> None:
+        if self._pending:
+            self._conn.execute("COMMIT")
+            self._pending = 0
+
+    def _flush_loop(self) -> None:
+        while not self._closed:
+            self._wake.wait()
+            self._wake.clear()
+            # 最初の書き込みから commit_interval だけ待って後続をまとめる
+            time.sleep(self.commit_interval)
+            with self._db_lock:
+                if not self._closed:
+                    self._commit()
+
+    def flush(self) -> None:
+        """保留中の書き込みを即時コミットする。"""
+        with self._db_lock:
+            self._commit()
+
+    def close(self) -> None:
+        with self._db_lock:
+            if self._closed:
+                return
+            self._commit()
+            self._closed = True
+            self._wake.set()
+            self._conn.close()
+
+    # ---------- 書き込み ----------
+    def create_plan(self, thread_ts: str, channel_id: str, title: Optional[str] = None) -> None:
+        with self._db_lock:
+            now = time.time()
+            if self._write(_SQL_INSERT_PLAN, (thread_ts, channel_id, title, now, now)):
+                self._write(_SQL_DELETE_ORPHAN, (thread_ts,))
+
+    def update_plan_status(self, thread_ts: str, status: str) -> None:
+        with self._db_lock:
+            now = time.time()
+            self._write(_SQL_UPDATE_STATUS, (status, now, status, now, thread_ts))
+
+    def upsert_participant(self, thread_ts: str, user_id: str, fields: Dict[str, Any]) -> None:
+        # 同じ企画への書き込みと集計の組み立てはストライプで直列にする
+        with self._lock(thread_ts):
+            with self._db_lock:
+                cur = self._conn.execute(_SQL_SELECT_PARTICIPANT, (thread_ts, user_id)).fetchone()
+                row = Participant.from_dict(json.loads(cur[0])) if cur else Participant()
+                row.update(fields)
+                self._write(
+                    _SQL_UPSERT_PARTICIPANT,
+                    (thread_ts, user_id, row.attendance, json.dumps(row.to_dict(), ensure_ascii=False)),
+                )
+                self._touch(thread_ts)
+            tally = self._tallies.get(thread_ts)
+            if tally is not None:
+                tally.set_attendance(user_id, row.attendance)
+            agg = self._aggregates.get(thread_ts)
+            if agg is not None:
+                agg.update(user_id, row)
+
+    def record_vote(self, thread_ts: str, user_id: str, idx: int) -> None:
+        with self._lock(thread_ts):
+            with self._db_lock:
+                self._write(_SQL_UPSERT_VOTE, (thread_ts, user_id, idx))
+                self._touch(thread_ts)
+            tally = self._tallies.get(thread_ts)
+            if tally is not None:
+                tally.set_vote(user_id, idx)
+
+    def _tally(self, thread_ts: str) -> VoteTally:
+        """キャッシュ済みの集計を返す（無ければ DB から組み立てる。ストライプ保持中に呼ぶ）。"""
+        tally = self._tallies.get(thread_ts)
+        if tally is None:
+            tally = VoteTally()
+            with self._db_lock:
+                for (uid,) in self._conn.execute(_SQL_ELIGIBLE, (thread_ts,)):
+                    tally.set_attendance(uid, "yes")
+                for uid, idx in self._conn.execute(_SQL_VOTES, (thread_ts,)):
+                    tally.set_vote(uid, idx)
+            self._tallies[thread_ts] = tally
+        return tally
+
+    def _aggregate(self, thread_ts: str) -> ParticipantAggregate:
+        """参加者集計を返す（無ければ DB から組み立てる。ストライプ保持中に呼ぶ）。"""
+        agg = self._aggregates.get(thread_ts)
+        if agg is None:
+            agg = ParticipantAggregate()
+            with self._db_lock:
+                rows = self._conn.execute(_SQL_LIST_PARTICIPANTS_WITH_USER, (thread_ts,)).fetchall()
+            for uid, data in rows:
+                agg.update(uid, Participant.from_dict(json.loads(data)))
+            self._aggregates[thread_ts] = agg
+        return agg
+
+    # ---------- 読み出し ----------
+    def list_participants(self, thread_ts: str) -> List[Participant]:
+        with self._db_lock:
+            rows = self._conn.execute(_SQL_LIST_PARTICIPANTS, (thread_ts,)).fetchall()
+        return [Participant.from_dict(json.loads(r[0])) for r in rows]
+
+    def get_latest_plan_thread(self, channel_id: str) -> Optional[str]:
+        with self._db_lock:
+            row = self._conn.execute(_SQL_LATEST_PLAN, (channel_id,)).fetchone()
+        return row[0] if row else None
+
+    def eligible_voter_ids(self, thread_ts: str) -> List[str]:
+        with self._lock(thread_ts):
+            return self._tally(thread_ts).eligible_ids()
+
+    def tally_votes(self, thread_ts: str) -> Dict[int, int]:
+        with self._lock(thread_ts):
+            return dict(self._tally(thread_ts).counts)
+
+    def voters_who_voted(self, thread_ts: str) -> List[str]:
+        with self._lock(thread_ts):
+            return self._tally(thread_ts).voter_ids()
+
+    def vote_snapshot(self, thread_ts: str) -> Dict[str, Any]:
+        with self._lock(thread_ts):
+            return self._tally(thread_ts).snapshot()
+
+    def participants_summary(self, thread_ts: str) -> Dict[str, Any]:
+        with self._lock(thread_ts):
+            return self._aggregate(thread_ts).summary()
+
+    def get_channel_id(self, thread_ts: str) -> Optional[str]:
+        with self._db_lock:
+            row = self._conn.execute(_SQL_CHANNEL, (thread_ts,)).fetchone()
+        return row[0] if row else None
+
+    # ---------- ライフサイクル ----------
+    def expired_plans(self, now: float, done_ttl: float, idle_ttl: float, limit: int) -> List[str]:
+        with self._db_lock:
+            out = [r[0] for r in self._conn.execute(_SQL_EXPIRED_DONE, (now - done_ttl, limit))]
+            if len(out) < limit:
+                for (ts,) in self._conn.execute(_SQL_EXPIRED_IDLE, (now - idle_ttl, limit)):
+                    if len(out) >= limit:
+                        break
+                    if ts not in out:
+                        out.append(ts)
+            # 企画の無い参加者/投票も、最後に触られてから idle_ttl で退避する（MemoryStore と同じ）
+            if len(out) < limit:
+                for (ts,) in self._conn.execute(_SQL_EXPIRED_ORPHANS, (now - idle_ttl, limit)):
+                    if len(out) >= limit:
+                        break
+                    if ts not in out:
+                        out.append(ts)
+        return out
+
+    def evict_plan(self, thread_ts: str) -> Optional[Dict[str, Any]]:
+        with self._lock(thread_ts):
+            with self._db_lock:
+                row = self._conn.execute(_SQL_PLAN, (thread_ts,)).fetchone()
+                if row is None:
+                    # 孤児（企画の無い参加者/投票）は MemoryStore と同じく空の企画として退避する
+                    if not self._write(_SQL_DELETE_ORPHAN, (thread_ts,)):
+                        return None
+                    plan: Dict[str, Any] = {}
+                else:
+                    plan = dict(zip(
+                        ("channel_id", "title", "status", "created_at", "updated_at", "finished_at"), row
+                    ))
+                result = compact_plan_result(
+                    thread_ts, plan, self._tally(thread_ts).snapshot(), self._aggregate(thread_ts).summary()
+                )
+                self._write(_SQL_DELETE_VOTES, (thread_ts,))
+                self._write(_SQL_DELETE_PARTICIPANTS, (thread_ts,))
+                self._write(_SQL_DELETE_PLAN, (thread_ts,))
+            self._tallies.pop(thread_ts, None)
+            self._aggregates.pop(thread_ts, None)
+        return result
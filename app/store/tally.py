@@ -0,0 +1,61 @@
+from __future__ import annotations
+from typing import Any, Dict, List, Optional
+
+PROPOSAL_INDEXES = (1, 2, 3)
+ELIGIBLE_ATTENDANCE = ("yes", "maybe")
+
+
+class VoteTally:
+    """1企画ぶんの投票集計を書き込み時に差分更新する。
+
+    - counts: proposal_index -> 票数（再投票は旧案から新案へ1票移す）
+    - voters: user_id -> proposal_index（投票順）
+    - eligible: 投票対象（参加/未定）のユーザー（dict を順序付き集合として使う）
+    - remaining: 投票対象のうち未投票のユーザー
+    いずれの更新も O(1)。全員投票済みかどうかは `not remaining` で判定できる。
+    """
+
+    __slots__ = ("counts", "voters", "eligible", "remaining")
+
+    def __init__(self) -> None:
+        self.counts: Dict[int, int] = {i: 0 for i in PROPOSAL_INDEXES}
+        self.voters: Dict[str, int] = {}
+        self.eligible: Dict[str, None] = {}
+        self.remaining: Dict[str, None] = {}
+
+    def set_attendance(self, user_id: str, attendance: Optional[str]) -> None:
+        if attendance in ELIGIBLE_ATTENDANCE:
+            if user_id not in self.eligible:
+                self.eligible[user_id] = None
+                if user_id not in self.voters:
+                    self.remaining[user_id] = None
+        elif user_id in self.eligible:
+            del self.eligible[user_id]
+            self.remaining.pop(user_id, None)
+
+    def set_vote(self, user_id: str, idx: int) -> None:
+        prev = self.voters.get(user_id)
+        if prev == idx:
+            return
+        if prev in self.counts:
+            self.counts[prev] -= 1
+        if idx in self.counts:
+            self.counts[idx] += 1
+        self.voters[user_id] = idx
+        self.remaining.pop(user_id, None)
+
+    def eligible_ids(self) -> List[str]:
+        return list(self.eligible)
+
+    def voter_ids(self) -> List[str]:
+        return list(self.voters)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """/幹事集計 と自動確定がそのまま使える集計結果。"""
+        eligible_total = len(self.eligible)
+        return {
+            "counter": dict(self.counts),
+            "eligible_total": eligible_total,
+            "voted_count": len(self.voters),
+            "complete": eligible_total > 0 and not self.remaining,
+        }
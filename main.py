@@ -1,14 +1,31 @@
 """Slack最小構成 + 受動インジェスト + 幹事フロー登録（参加可否→日付→希望→提案）
-※ インメモリ版（再起動で消えます）
+※ 既定はインメモリ版（再起動で消えます）。STORE_BACKEND=sqlite / journal で永続化
 """
+import time
+
+_T0 = time.perf_counter()
+
+import atexit
+import importlib
+import logging
 import os
 import sys
+import threading
 from dotenv import load_dotenv
 from slack_bolt import App
-from slack_bolt.adapter.socket_mode import SocketModeHandler
 
 from app.agent.llm_agent import LLMAgent
+from app.executor import ChannelExecutor, TaskRejected
+from app.metrics import call_site, serve as serve_metrics
+from app.services.catalog import CatalogSync
 from app.flows.kanji_flow import register_kanji_flow
+from app.slack_stream import ThrottledMessage
+from app.startup import StartupTimer
+from app.store import JournaledStore, PlanSweeper, SQLiteStore, configure_store, get_store
+
+# 起動時間の計測（import / 初期化 / 接続 / 最初のイベント）
+startup = StartupTimer(_T0)
+startup.mark("imports")
 
 load_dotenv()
 
@@ -18,13 +35,44 @@ REQUIRED_ENV = [
     "GEMINI_API_KEY_MAIN",
     "GEMINI_API_KEY_SUMMARY",
 ]
-missing = [k for k in REQUIRED_ENV if not os.environ.get(k)]
+# Gemini キーは複数形（GEMINI_API_KEYS_*、カンマ区切り）でもよい
+missing = [
+    k for k in REQUIRED_ENV
+    if not os.environ.get(k) and not os.environ.get(k.replace("_KEY_", "_KEYS_"))
+]
 if missing:
     sys.stderr.write(f"[ERROR] Missing environment variables: {', '.join(missing)}\n")
     sys.exit(1)
 
+# ストアのバックエンド選択（memory | sqlite | journal）
+STORE_BACKEND = os.environ.get("STORE_BACKEND", "memory").lower()
+if STORE_BACKEND == "sqlite":
+    configure_store(SQLiteStore(
+        path=os.environ.get("STORE_SQLITE_PATH", "kanjiro.db"),
+        commit_interval=float(os.environ.get("STORE_COMMIT_INTERVAL", "0.05")),
+    ))
+elif STORE_BACKEND == "journal":
+    # 最新スナップショット + 以降のジャーナルだけを再生して復元
+    configure_store(JournaledStore(
+        directory=os.environ.get("STORE_JOURNAL_DIR", "kanjiro-journal"),
+        fsync_interval=float(os.environ.get("STORE_FSYNC_INTERVAL", "0.2")),
+        snapshot_interval=float(os.environ.get("STORE_SNAPSHOT_INTERVAL", "600")),
+    ))
+elif STORE_BACKEND != "memory":
+    sys.stderr.write(f"[ERROR] Unknown STORE_BACKEND: {STORE_BACKEND}\n")
+    sys.exit(1)
+# 終了時に保留中の書き込み（グループコミット/未 fsync 分）を確定
+atexit.register(lambda: get_store().close())
+
 app = App(token=os.environ["SLACK_BOT_TOKEN"])
+startup.install(app)
 llm = LLMAgent()
+# 終了時に応答キャッシュを保存（LLM_CACHE_PATH 指定時）
+atexit.register(llm.close)
+# LLM/検索の実行プール（LLM_MAX_CONCURRENCY / LLM_MAX_QUEUE / LLM_MAX_QUEUE_PER_CHANNEL）
+executor = ChannelExecutor.from_env()
+# メンションへの応答をトークン単位で逐次表示する（LLM_STREAM_REPLIES=0 で無効）
+STREAM_REPLIES = os.environ.get("LLM_STREAM_REPLIES", "1") != "0"
 BOT_USER_ID = None  # 起動時に auth.test で解決
 
 
@@ -38,11 +86,45 @@ def _strip_mention(text: str) -> str:
 
 
 @app.event("app_mention")
-def on_mention(event, say, logger):
+def on_mention(event, say, client, logger):
     user = event.get("user")
+    channel = event.get("channel")
     prompt = _strip_mention(event.get("text", ""))
-    reply = llm.respond(prompt)
-    say(text=f"<@{user}> {reply}", thread_ts=event.get("ts"))
+    key = llm.key_for(channel, event.get("thread_ts"))
+    busy = "ただいま混み合っています。少し時間をおいて話しかけてください。"
+    failed = "エラーが発生しました。少し時間をおいて再試行してください。"
+
+    # 応答生成（と Slack への投稿）はすべてプールで実行し、リスナーはすぐ返す
+    if not STREAM_REPLIES:
+        def _reply() -> None:
+            try:
+                with call_site("mention"):
+                    reply = llm.respond(prompt, key=key)
+            except Exception:
+                logger.exception("mention reply failed")
+                reply = failed
+            say(text=f"<@{user}> {reply}", thread_ts=event.get("ts"))
+
+    else:
+        def _reply() -> None:
+            # 先にプレースホルダを出し、生成に合わせて chat.update で書き換える
+            msg = ThrottledMessage(client, channel, thread_ts=event.get("ts"), prefix=f"<@{user}> ")
+            msg.start()
+            try:
+                with call_site("mention"):
+                    reply = llm.respond_stream(prompt, key=key, on_text=msg.update)
+                msg.finish(reply)
+            except Exception:
+                logger.exception("streamed mention reply failed")
+                try:
+                    msg.finish(failed)
+                except Exception:
+                    say(text=f"<@{user}> {failed}", thread_ts=event.get("ts"))
+
+    try:
+        executor.submit(channel, _reply)
+    except TaskRejected:
+        say(text=f"<@{user}> {busy}", thread_ts=event.get("ts"))
 
 
 # 受動インジェスト：通常メッセージもメモリへ蓄積（返信はしない）
@@ -56,7 +138,8 @@ def on_message(event, logger):
     text = _strip_mention(event.get("text", ""))
     if not text:
         return
-    llm.remember(f"<@{user}>: {text}")
+    key = llm.key_for(event.get("channel"), event.get("thread_ts"))
+    llm.remember(f"<@{user}>: {text}", key=key)
 
 
 if __name__ == "__main__":
@@ -67,7 +150,38 @@ if __name__ == "__main__":
         sys.stderr.write(f"[WARN] auth_test failed: {e}\n")
 
     # bot_user_id を渡す必要は無くなりました
-    register_kanji_flow(app, llm)
+    register_kanji_flow(app, llm, executor)
+
+    # 終了/放置された企画を期限で退避（PLAN_DONE_TTL / PLAN_IDLE_TTL / PLAN_ARCHIVE_PATH）
+    PlanSweeper.from_env().start()
+
+    # よく使うエリアの店舗をローカルのカタログへ定期取り込み（HOTPEPPER_CATALOG_PATH / _AREAS 指定時のみ）
+    catalog_sync = CatalogSync.from_env()
+    if catalog_sync is not None:
+        catalog_sync.start()
+
+    # LLM 呼び出しの計測を Prometheus 形式で公開（METRICS_PORT 指定時のみ）
+    if os.environ.get("METRICS_PORT"):
+        serve_metrics(int(os.environ["METRICS_PORT"]))
+
+    startup.mark("init")
+
+    from slack_bolt.adapter.socket_mode import SocketModeHandler
 
     handler = SocketModeHandler(app, os.environ["SLACK_APP_TOKEN"])
-    handler.start()
+    handler.connect()
+    startup.mark("connected")
+
+    # 接続後に langchain・Gemini クライアント・店検索モジュールを裏で読み込んでおく（LLM_WARMUP=0 で無効）
+    if os.environ.get("LLM_WARMUP", "1") != "0":
+        def _warm_up() -> None:
+            try:
+                llm.warm_up()
+                importlib.import_module("app.services.shops")
+                startup.mark("warm")
+            except Exception:
+                logging.getLogger(__name__).exception("warm-up failed")
+
+        threading.Thread(target=_warm_up, name="warm-up", daemon=True).start()
+
+    threading.Event().wait()
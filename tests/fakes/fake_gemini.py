@@ -0,0 +1,103 @@
+"""ローカルで動く偽の Gemini チャットモデル（LLM_CHAT_CLASS=tests.fakes.fake_gemini:FakeGeminiChat で使う）。
+
+API キーごとに1分あたりの呼び出し回数を数え、`FAKE_GEMINI_RPM` を超えたら
+本物と同じ名前の `ResourceExhausted`（429）を投げる。応答は入力の
+オウム返しで、`FAKE_GEMINI_LATENCY` 秒だけ待ってから返す。キーのローテーション
+やバックオフをネットワークなしで確かめるためのもの。
+"""
+from __future__ import annotations
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from app.agent.tokens import default_estimator
+
+_lock = threading.Lock()
+_calls: Dict[str, Deque[float]] = defaultdict(deque)
+
+
+class ResourceExhausted(Exception):
+    """google.api_core.exceptions.ResourceExhausted の代わり。"""
+
+    code = 429
+
+
+def reset_quota() -> None:
+    with _lock:
+        _calls.clear()
+
+
+class FakeGeminiChat(BaseChatModel):
+    model: str = "fake-gemini"
+    google_api_key: str = "fake"
+    rpm: int = int(os.environ.get("FAKE_GEMINI_RPM", "0"))  # 0 なら無制限
+    latency: float = float(os.environ.get("FAKE_GEMINI_LATENCY", "0"))
+    max_retries: int = 1  # ChatGoogleGenerativeAI と同じ引数を受け付けるだけ
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-gemini"
+
+    def _charge(self) -> None:
+        now = time.monotonic()
+        with _lock:
+            q = _calls[self.google_api_key]
+            while q and now - q[0] >= 60.0:
+                q.popleft()
+            if self.rpm and len(q) >= self.rpm:
+                raise ResourceExhausted(f"429 RESOURCE_EXHAUSTED: quota exceeded for key ...{self.google_api_key[-4:]}")
+            q.append(now)
+
+    def _reply(self, messages: List[BaseMessage]) -> str:
+        last = str(messages[-1].content) if messages else ""
+        return f"（fake）{last[:200]}"
+
+    def _usage(self, messages: List[BaseMessage], reply: str) -> Dict[str, int]:
+        prompt = default_estimator.count_messages(messages)
+        completion = default_estimator.count_text(reply)
+        return {"input_tokens": prompt, "output_tokens": completion, "total_tokens": prompt + completion}
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        self._charge()
+        if self.latency:
+            time.sleep(self.latency)
+        reply = self._reply(messages)
+        msg = AIMessage(content=reply, usage_metadata=self._usage(messages, reply))
+        return ChatResult(generations=[ChatGeneration(message=msg)])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        self._charge()
+        reply = self._reply(messages)
+        step = 8
+        for i in range(0, len(reply), step):
+            if self.latency:
+                time.sleep(self.latency / max(1, len(reply) // step))
+            piece = reply[i:i + step]
+            last = i + step >= len(reply)
+            usage = self._usage(messages, reply) if last else None
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece, usage_metadata=usage))
+            if run_manager is not None:
+                run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+    def get_num_tokens(self, text: str) -> int:
+        return default_estimator.count_text(text)
@@ -0,0 +1,142 @@
+# tests/fakes/fake_hotpepper.py
+"""ローカルで動く偽の Hot Pepper グルメサーチ API。
+
+`serve(port)` で `/hotpepper/gourmet/v1/` を返す HTTP サーバーをデーモンスレッドで
+起動する。`HOTPEPPER_ENDPOINTS=http://127.0.0.1:<port>/hotpepper/gourmet/v1/` を
+指定すると、本物の代わりにこちらを叩く（API キーは何でもよい）。
+
+店舗は keyword ごとに決まった乱数で `FAKE_HOTPEPPER_SHOPS` 件作る。genre / budget /
+制約フラグでの絞り込みと start / count のページ送りは本物と同じ形で返す。
+応答は `FAKE_HOTPEPPER_LATENCY` 秒だけ待ってから返す。カタログの取り込みや
+ファンアウト・緩和の挙動をネットワークなしで確かめるためのもの。
+
+    python -m tests.fakes.fake_hotpepper 8765
+"""
+from __future__ import annotations
+import json
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+from urllib.parse import parse_qs, urlparse
+
+PATH = "/hotpepper/gourmet/v1/"
+
+_GENRES = [
+    ("G001", "居酒屋"), ("G002", "ダイニングバー・バル"), ("G003", "創作料理"), ("G004", "和食"),
+    ("G005", "洋食"), ("G006", "イタリアン・フレンチ"), ("G007", "中華"), ("G008", "焼肉・ホルモン"),
+    ("G013", "カフェ・スイーツ"), ("G017", "韓国料理"),
+]
+_BUDGETS = [
+    ("B005", "2001～3000円"), ("B006", "3001～4000円"), ("B007", "4001～5000円"),
+    ("B008", "5001～7000円"), ("B009", "7001～10000円"), ("B010", "10001～15000円"),
+]
+_FLAG_VALUES = {
+    "private_room": ("あり", "なし"),
+    "non_smoking": ("全面禁煙", "禁煙席なし"),
+    "card": ("利用可", "利用不可"),
+    "child": ("お子様連れ歓迎", "お子様連れお断り"),
+    "free_drink": ("あり ：2時間飲み放題", "なし"),
+}
+
+_lock = threading.Lock()
+_shops: Dict[str, List[Dict[str, Any]]] = {}
+
+
+def shops_for(keyword: str, n: int = 0) -> List[Dict[str, Any]]:
+    """keyword の店舗一覧（同じ keyword なら毎回同じ内容）。"""
+    n = n or int(os.environ.get("FAKE_HOTPEPPER_SHOPS", "120"))
+    with _lock:
+        if keyword in _shops:
+            return _shops[keyword]
+    rng = random.Random(f"{keyword}:{n}")
+    out = []
+    for i in range(n):
+        genre, sub = rng.sample(_GENRES, 2)
+        budget = rng.choice(_BUDGETS)
+        sid = f"J{zlib.crc32(keyword.encode()) % 10**6:06d}{i:04d}"
+        out.append({
+            "id": sid,
+            "name": f"{keyword}の{genre[1]} {i + 1}号店",
+            "address": f"東京都{keyword} {i + 1}-{rng.randint(1, 30)}",
+            "access": f"{keyword}駅から徒歩{rng.randint(1, 15)}分",
+            "urls": {"pc": f"https://www.hotpepper.jp/str{sid}/"},
+            "photo": {"pc": {"m": f"https://imgfp.hotp.jp/fake/{sid}_m.jpg"}},
+            "genre": {"code": genre[0], "name": genre[1]},
+            "sub_genre": {"code": sub[0], "name": sub[1]},
+            "budget": {"code": budget[0], "name": budget[1]},
+            **{f: vals[0] if rng.random() < 0.5 else vals[1] for f, vals in _FLAG_VALUES.items()},
+        })
+    with _lock:
+        return _shops.setdefault(keyword, out)
+
+
+def search(params: Dict[str, str]) -> Dict[str, Any]:
+    """クエリパラメタ（値は文字列）から本物と同じ形の応答を作る。"""
+    keyword = params.get("keyword") or ("位置検索" if params.get("lat") else "")
+    if not keyword:
+        return {"results": {"api_version": "1.30", "error": [{"code": 3000, "message": "少なくとも1つの条件を入れてください。"}]}}
+    hits = shops_for(keyword)
+    if params.get("genre"):
+        hits = [s for s in hits if params["genre"] in (s["genre"]["code"], s["sub_genre"]["code"])]
+    if params.get("budget"):
+        hits = [s for s in hits if s["budget"]["code"] == params["budget"]]
+    for f, (yes, _) in _FLAG_VALUES.items():
+        if params.get(f) == "1":
+            hits = [s for s in hits if s[f] == yes]
+    start = max(1, int(params.get("start") or 1))
+    count = max(1, min(100, int(params.get("count") or 10)))
+    page = hits[start - 1:start - 1 + count]
+    return {"results": {
+        "api_version": "1.30",
+        "results_available": len(hits),
+        "results_returned": str(len(page)),
+        "results_start": start,
+        "shop": page,
+    }}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    requests_served = 0
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        if url.path.rstrip("/") != PATH.rstrip("/"):
+            self.send_error(404)
+            return
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        latency = float(os.environ.get("FAKE_HOTPEPPER_LATENCY", "0"))
+        if latency:
+            time.sleep(latency)
+        type(self).requests_served += 1
+        body = json.dumps(search(params), ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def serve(port: int = 0, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """偽 API をデーモンスレッドで起動する（port=0 なら空いているポート）。"""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name="fake-hotpepper", daemon=True).start()
+    return server
+
+
+def endpoint(server: ThreadingHTTPServer) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}{PATH}"
+
+
+if __name__ == "__main__":
+    srv = serve(int(sys.argv[1]) if len(sys.argv) > 1 else int(os.environ.get("FAKE_HOTPEPPER_PORT", "8765")))
+    print(f"HOTPEPPER_ENDPOINTS={endpoint(srv)}")
+    threading.Event().wait()
@@ -0,0 +1,125 @@
+"""店舗カタログ（app.services.catalog）のテスト。
+
+偽の Hot Pepper（tests.fakes.fake_hotpepper）の店舗を相手に、ローカルの
+絞り込みが API と同じ結果を返すか、期限切れ・取り込み途中のエリアで API に
+任せる（None を返す）かを確かめる。
+"""
+from __future__ import annotations
+import json
+import time
+import urllib.parse
+import urllib.request
+
+import pytest
+
+from tests.fakes import fake_hotpepper
+from app.services.catalog import FLAGS, CatalogSync, ShopCatalog
+
+AREA = "渋谷"
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    c = ShopCatalog(str(tmp_path / "catalog.db"), ttl=3600)
+    yield c
+    c.close()
+
+
+def _load(catalog: ShopCatalog, area: str = AREA, n: int = 0, complete: bool = True) -> list:
+    raw = fake_hotpepper.shops_for(area)
+    raw = raw[:n] if n else raw
+    catalog.replace_area(area, raw, raw, complete)
+    return raw
+
+
+def _api_ids(params) -> list:
+    query = {k: ("1" if v is True else str(v)) for k, v in params.items()}
+    return [s["id"] for s in fake_hotpepper.search(query)["results"]["shop"]]
+
+
+@pytest.mark.parametrize("params", [
+    {"genre": "G001"},
+    {"budget": "B006"},
+    {"genre": "G004", "budget": "B008"},
+    *({f: True} for f in FLAGS),
+    {"private_room": True, "non_smoking": True, "card": True},
+    {"genre": "G006", "free_drink": True, "child": True},
+])
+def test_local_filters_match_the_api(catalog, params):
+    _load(catalog)
+    params = {"keyword": AREA, "count": 100, **params}
+    local = catalog.search(params)
+    assert local is not None
+    assert [s["id"] for s in local] == _api_ids(params)
+
+
+def test_count_and_rank_order(catalog):
+    raw = _load(catalog)
+    # 全角/空白の揺れがあっても同じエリア
+    local = catalog.search({"keyword": " 渋谷 ", "count": 5})
+    assert [s["id"] for s in local] == [s["id"] for s in raw[:5]]
+    assert len(catalog.search({"keyword": AREA})) == 10
+
+
+def test_ttl_expiry_falls_back_to_api(catalog):
+    _load(catalog)
+    now = time.time()
+    assert catalog.search({"keyword": AREA}, now=now + 3500) is not None
+    assert catalog.search({"keyword": AREA}, now=now + 3700) is None
+    assert catalog.stats()["misses"] == 1
+
+
+def test_unknown_area_or_params_fall_back_to_api(catalog):
+    _load(catalog)
+    assert catalog.search({"keyword": "新宿"}) is None
+    assert catalog.search({"keyword": AREA, "lat": 35.66, "lng": 139.70}) is None
+    assert catalog.search({"genre": "G001"}) is None
+
+
+def test_incomplete_area_answers_hits_but_not_empty_results(catalog):
+    raw = _load(catalog, n=10, complete=False)
+    present = raw[0]["genre"]["code"]
+    absent = next(code for code, _ in fake_hotpepper._GENRES if all(
+        code not in (s["genre"]["code"], s["sub_genre"]["code"]) for s in raw
+    ))
+    assert catalog.search({"keyword": AREA, "genre": present})
+    # 取り込めていない残りにあるかもしれないので、0件とは答えない
+    assert catalog.search({"keyword": AREA, "genre": absent}) is None
+
+    # 全件取り込めたエリアなら0件もそのまま答える
+    _load(catalog, n=10, complete=True)
+    assert catalog.search({"keyword": AREA, "genre": absent}) == []
+
+
+# ---------- CatalogSync（偽 API を HTTP で叩く） ----------
+
+
+@pytest.fixture(scope="module")
+def fake_api():
+    server = fake_hotpepper.serve(0)
+    url = fake_hotpepper.endpoint(server)
+
+    def fetch(params):
+        with urllib.request.urlopen(url + "?" + urllib.parse.urlencode(params), timeout=5) as resp:
+            return json.loads(resp.read().decode("utf-8"))
+
+    yield fetch
+    server.shutdown()
+
+
+def test_sync_area_pages_through_every_shop(catalog, fake_api):
+    pytest.importorskip("requests")  # 整形に app.services.shops を使う
+    sync = CatalogSync(catalog, [AREA], page_size=50, max_pages=10, page_pause=0, fetch=fake_api)
+    assert sync.sync_area(AREA) == len(fake_hotpepper.shops_for(AREA))
+    assert catalog.stats()["areas"][AREA]["complete"] is True
+
+    params = {"keyword": AREA, "count": 100, "genre": "G008", "private_room": True}
+    assert [s["id"] for s in catalog.search(params)] == _api_ids(params)
+
+
+def test_sync_area_stopped_by_max_pages_is_incomplete(catalog, fake_api):
+    pytest.importorskip("requests")
+    sync = CatalogSync(catalog, ["池袋"], page_size=20, max_pages=2, page_pause=0, fetch=fake_api)
+    assert sync.sync_area("池袋") == 40
+    area = catalog.stats()["areas"]["池袋"]
+    assert (area["shops"], area["complete"]) == (40, False)
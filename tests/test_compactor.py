@@ -0,0 +1,93 @@
+"""会話メモリのコンパクタ（app.agent.compactor）のテスト。
+
+prune の最中に別スレッドから発話が積まれても、トークン数の帳簿が
+崩れない（KeyError で以後の prune が全部失敗しない）ことを確かめる。
+"""
+from __future__ import annotations
+import threading
+
+import pytest
+
+pytest.importorskip("langchain")
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel  # noqa: E402
+
+from app.agent.compactor import CompactingSummaryMemory  # noqa: E402
+
+
+class _Compactor:
+    def __init__(self) -> None:
+        self.notified = 0
+
+    def notify(self, mem) -> None:
+        self.notified += 1
+
+
+def _memory(limit: int = 20, counter=None) -> CompactingSummaryMemory:
+    return CompactingSummaryMemory(
+        llm=FakeListChatModel(responses=["要約"]),
+        max_token_limit=limit,
+        compactor=_Compactor(),
+        token_counter=counter or (lambda m: 2),
+    )
+
+
+def _check_books(mem: CompactingSummaryMemory) -> None:
+    buffer = mem.chat_memory.messages
+    assert mem._counted == len(buffer)
+    assert set(mem._token_counts) == {id(m) for m in buffer}
+    assert mem._buffer_tokens == sum(mem._token_counts.values())
+    assert mem._buffer_tokens <= mem.max_token_limit
+
+
+def test_append_during_counting_is_counted_on_the_next_prune():
+    mem = None
+    injected = []
+
+    def counter(message):
+        # 数えている最中に、ロックを取らない経路から発話が積まれる
+        if not injected:
+            injected.append(True)
+            mem.chat_memory.add_user_message("割り込み")
+        return 2
+
+    mem = _memory(limit=4, counter=counter)
+    mem.chat_memory.add_user_message("一つ目")
+    mem.prune()
+    assert mem._counted == 1  # 数えた1件だけ進む
+
+    for i in range(5):
+        mem.add_text(f"発話{i}")  # 以前はここで KeyError になった
+    _check_books(mem)
+    assert len(mem._pending) == 7 - len(mem.chat_memory.messages)
+
+
+def test_concurrent_appends_and_prunes_keep_the_books():
+    mem = _memory(limit=20)
+    errors = []
+
+    def writer(n: int) -> None:
+        try:
+            for i in range(200):
+                mem.add_text(f"{n}-{i}", as_user=bool(i % 2))
+                if i % 7 == 0:
+                    mem.prune()
+        except Exception as e:  # pragma: no cover - 失敗したときだけ
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    assert not errors
+    _check_books(mem)
+    assert len(mem._pending) + len(mem.chat_memory.messages) == 8 * 200
+
+
+def test_save_context_prunes_under_the_lock():
+    mem = _memory(limit=6)
+    for i in range(10):
+        mem.save_context({"input": f"質問{i}"}, {"response": f"回答{i}"})
+    _check_books(mem)
+    assert len(mem.chat_memory.messages) == 3
@@ -0,0 +1,38 @@
+"""ジャンル名の照合（app.services.genres）のテスト。"""
+from __future__ import annotations
+
+import pytest
+
+from app.services.genres import MIN_CONFIDENCE, genre_codes, match_genres
+
+
+@pytest.mark.parametrize("text, codes", [
+    ("居酒屋", ["G001"]),
+    ("焼き鳥", ["G001"]),
+    ("やきにく", ["G008"]),
+    ("ﾊﾟｽﾀ", ["G006"]),  # 半角カナの別名
+    ("居酒屋、イタリアン", ["G001", "G006"]),
+    ("焼肉店", ["G008"]),  # 漢字の接尾語は語の切れ目
+    ("渋谷のバー", ["G012"]),
+    ("イタリアンバル", ["G006", "G012"]),  # キー同士の境も語の切れ目
+    ("ワインバー", ["G012"]),
+    ("ダイニングバー", ["G002"]),  # 中の「バー」は数えない
+])
+def test_genre_codes(text, codes):
+    assert genre_codes([text], min_confidence=MIN_CONFIDENCE) == codes
+
+
+@pytest.mark.parametrize("text", ["メンバー", "グローバル", "カバー", "バルセロナ", "メンバー全員で"])
+def test_words_that_merely_contain_a_genre_are_rejected(text):
+    assert genre_codes([text], min_confidence=MIN_CONFIDENCE) == []
+    # 照合自体はするが、確からしさは下限を割る
+    assert all(m.confidence < MIN_CONFIDENCE for m in match_genres(text))
+
+
+def test_confidence_orders_exact_synonym_and_partial():
+    exact, = match_genres("焼肉")
+    synonym, = match_genres("焼き肉")
+    partial, = match_genres("美味しい焼肉")
+    assert exact.confidence == 1.0
+    assert synonym.confidence == 0.9
+    assert MIN_CONFIDENCE <= partial.confidence < synonym.confidence
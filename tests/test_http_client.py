@@ -0,0 +1,118 @@
+"""Hot Pepper 用 HTTP クライアント（app.services.http_client）のサーキットブレーカー。
+
+half-open のエンドポイントを試すのは1つの呼び出しだけであることを確かめる。
+"""
+from __future__ import annotations
+import threading
+import time
+
+import pytest
+
+requests = pytest.importorskip("requests")
+
+from app.services.http_client import PooledClient  # noqa: E402
+
+
+class _Response:
+    status_code = 200
+
+    def raise_for_status(self) -> None:
+        pass
+
+
+class _Session:
+    """URL ごとに「失敗させる / 止めておく」を切り替えられる偽の Session。"""
+
+    def __init__(self) -> None:
+        self.failing = set()
+        self.gate = threading.Event()
+        self.gate.set()
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def get(self, url, params=None, timeout=None):
+        with self._lock:
+            self.calls.append(url)
+        if url in self.failing:
+            raise requests.ConnectionError(f"{url} is down")
+        self.gate.wait(5)
+        return _Response()
+
+    def close(self) -> None:
+        pass
+
+
+def _client(endpoints, session):
+    client = PooledClient(endpoints, failure_threshold=1, open_seconds=0.05)
+    client.session = session
+    return client
+
+
+def _trip(client, session, url):
+    session.failing.add(url)
+    try:
+        client.get({})  # 他に健全なエンドポイントがあれば成功する
+    except requests.ConnectionError:
+        pass
+    session.failing.discard(url)
+    assert {s["url"]: s["state"] for s in client.stats()}[url] == "open"
+    time.sleep(0.06)
+    assert {s["url"]: s["state"] for s in client.stats()}[url] == "half-open"
+
+
+def test_half_open_lets_exactly_one_probe_through():
+    session = _Session()
+    client = _client(["http://a"], session)
+    _trip(client, session, "http://a")
+
+    session.calls.clear()
+    session.gate.clear()  # 試し役の呼び出しを応答待ちで止めておく
+    results = []
+
+    def call():
+        try:
+            client.get({})
+            results.append("ok")
+        except RuntimeError:
+            results.append("rejected")
+
+    threads = [threading.Thread(target=call) for _ in range(6)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    session.gate.set()
+    for t in threads:
+        t.join(5)
+
+    assert session.calls == ["http://a"]
+    assert sorted(results) == ["ok"] + ["rejected"] * 5
+    assert client.stats()[0]["state"] == "closed"
+
+
+def test_callers_skip_an_endpoint_being_probed():
+    session = _Session()
+    client = _client(["http://a", "http://b"], session)
+    _trip(client, session, "http://a")  # a が開き、b は健全
+
+    # 1人目が a の試し役を握っている間、他の呼び出しは b だけを試す
+    order = client._order()  # 1人目: b（閉じている）+ a の試し役
+    assert [h.url for h in order] == ["http://b", "http://a"]
+    assert [h.url for h in client._order()] == ["http://b"]  # 2人目は a を試さない
+    client._release([], order)
+
+    # b で成功した呼び出しは、試さなかった a の試し役を返す
+    session.calls.clear()
+    assert client.get({}).status_code == 200
+    assert session.calls == ["http://b"]
+    assert all(not h.probing for h in client._health)
+
+
+def test_failed_probe_reopens_the_circuit():
+    session = _Session()
+    client = _client(["http://a"], session)
+    _trip(client, session, "http://a")
+    session.failing.add("http://a")
+    with pytest.raises(requests.ConnectionError):
+        client.get({})
+    assert client.stats()[0]["state"] == "open"
+    assert not client._health[0].probing
@@ -0,0 +1,167 @@
+"""API キーのスケジューラと、それを使うプール型チャットモデルのテスト。
+
+PooledChatModel は偽の Gemini（tests.fakes.fake_gemini）を相手に、429 での
+別キーへの振り替えと、期限での打ち切りを確かめる。
+"""
+from __future__ import annotations
+import threading
+import time
+
+import pytest
+
+from app.agent.keypool import KeyPoolExhausted, KeyScheduler, is_rate_limited, retry_after_seconds
+
+
+class ResourceExhausted(Exception):
+    code = 429
+
+
+class _Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class _HTTPError(Exception):
+    def __init__(self, message, response):
+        super().__init__(message)
+        self.response = response
+
+
+@pytest.mark.parametrize("error, limited", [
+    (ResourceExhausted("quota exceeded"), True),
+    (RuntimeError("429 Resource has been exhausted (e.g. check quota)."), True),
+    (RuntimeError("RESOURCE_EXHAUSTED: per-minute quota"), True),
+    (_HTTPError("Too Many Requests", _Response(429)), True),
+    (RuntimeError("500 internal error while connecting to port 4290"), False),
+    (RuntimeError("request id 8f429c failed"), False),
+    (_HTTPError("Server Error (429 retries so far)", _Response(500)), False),
+])
+def test_rate_limit_detection_uses_type_and_status(error, limited):
+    assert is_rate_limited(error) is limited
+
+
+def test_rate_limit_detection_follows_the_cause():
+    try:
+        try:
+            raise ResourceExhausted("quota")
+        except ResourceExhausted as inner:
+            raise RuntimeError("LLM call failed") from inner
+    except RuntimeError as outer:
+        assert is_rate_limited(outer)
+
+
+@pytest.mark.parametrize("error, seconds", [
+    (_HTTPError("Too Many Requests", _Response(429, {"Retry-After": "7"})), 7.0),
+    (ResourceExhausted("429 You exceeded your current quota. Please retry in 12.5s."), 12.5),
+    (ResourceExhausted('429 {"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "31s"}'), 31.0),
+    (ResourceExhausted("429 quota\nretry_delay {\n  seconds: 44\n}"), 44.0),
+    (ResourceExhausted("429 quota exceeded"), None),
+])
+def test_retry_after_is_read_from_the_error(error, seconds):
+    assert retry_after_seconds(error) == seconds
+
+
+def test_retry_after_overrides_backoff():
+    scheduler = KeyScheduler(rpm=600, burst=5, backoff_base=0.01)
+    assert scheduler.report_rate_limited("A", retry_after_seconds(ResourceExhausted("Please retry in 20s"))) == 20.0
+    assert scheduler.stats()["...A"]["cooldown_sec"] > 19
+
+
+def test_cooled_down_key_is_skipped_until_it_recovers():
+    scheduler = KeyScheduler(rpm=600, burst=5)
+    scheduler.report_rate_limited("A", retry_after=0.3)
+    # 休んでいる A は飛ばして B を使う
+    assert scheduler.acquire(["A", "B"], timeout=0.1) == "B"
+
+    # A しかなければ、明けるまで待ってから返す
+    started = time.monotonic()
+    assert scheduler.acquire(["A"], timeout=2.0) == "A"
+    assert time.monotonic() - started >= 0.25
+
+
+def test_acquire_gives_up_at_timeout():
+    scheduler = KeyScheduler(rpm=600, burst=5)
+    scheduler.report_rate_limited("A", retry_after=5.0)
+    started = time.monotonic()
+    with pytest.raises(KeyPoolExhausted):
+        scheduler.acquire(["A"], timeout=0.1)
+    assert time.monotonic() - started < 1.0
+
+
+def test_interactive_callers_take_keys_before_background():
+    # 1キー・バースト1・5回/秒: 使い切ったあとは 0.2 秒ごとに1つ空く
+    scheduler = KeyScheduler(rpm=300, burst=1)
+    scheduler.acquire(["A"], timeout=0.1)
+    order = []
+
+    def take(name, interactive):
+        scheduler.acquire(["A"], interactive=interactive, timeout=3.0)
+        order.append(name)
+
+    background = threading.Thread(target=take, args=("background", False))
+    background.start()
+    time.sleep(0.05)  # 要約が先に待ち始めていても
+    interactive = threading.Thread(target=take, args=("interactive", True))
+    interactive.start()
+    background.join(5)
+    interactive.join(5)
+    assert order == ["interactive", "background"]
+
+
+# ---------- PooledChatModel（langchain_core が要る） ----------
+
+
+@pytest.fixture
+def fake():
+    pytest.importorskip("langchain_core")
+    from tests.fakes import fake_gemini
+
+    fake_gemini.reset_quota()
+    yield fake_gemini
+    fake_gemini.reset_quota()
+
+
+def _pooled(fake, scheduler, keys, rpm, deadline_sec=5.0):
+    from app.agent.pooled_model import PooledChatModel
+
+    clients = {k: fake.FakeGeminiChat(google_api_key=k, rpm=rpm) for k in keys}
+    return PooledChatModel(clients=clients, scheduler=scheduler, model="fake-gemini", deadline_sec=deadline_sec), clients
+
+
+def test_rate_limited_key_fails_over_to_another(fake):
+    scheduler = KeyScheduler(rpm=600, burst=5)
+    model, clients = _pooled(fake, scheduler, ["key-A", "key-B"], rpm=1)
+    clients["key-A"].invoke("先に使い切る")  # key-A の今分のクォータを使い切る
+
+    reply = model.invoke("こんにちは")
+    assert "こんにちは" in reply.content
+    stats = scheduler.stats()
+    assert stats["...ey-A"]["rate_limited"] == 1
+    assert stats["...ey-A"]["cooldown_sec"] > 0
+    assert stats["...ey-B"]["rate_limited"] == 0
+
+
+def test_retries_stop_at_the_deadline(fake):
+    scheduler = KeyScheduler(rpm=600, burst=5, backoff_base=0.05, backoff_max=0.2)
+    model, clients = _pooled(fake, scheduler, ["key-A", "key-B"], rpm=1, deadline_sec=0.8)
+    for c in clients.values():
+        c.invoke("先に使い切る")
+
+    started = time.monotonic()
+    with pytest.raises(fake.ResourceExhausted):
+        model.invoke("こんにちは")
+    elapsed = time.monotonic() - started
+    assert 0.5 <= elapsed < 2.0
+    # 回数の上限ではなく期限まで、明けたキーで何度もやり直している
+    assert sum(s["rate_limited"] for s in scheduler.stats().values()) > 4
+
+
+def test_token_counts_are_estimated_locally(fake):
+    from app.agent.tokens import default_estimator
+
+    scheduler = KeyScheduler(rpm=600, burst=5)
+    model, _ = _pooled(fake, scheduler, ["key-A"], rpm=1)
+    assert model.get_num_tokens("来週の金曜に飲み会") == default_estimator.count_text("来週の金曜に飲み会")
+    # キーを借りていない（countTokens の往復をしていない）
+    assert scheduler.stats() == {}
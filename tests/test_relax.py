@@ -0,0 +1,79 @@
+"""緩和ラダー（app.services.relax）のテスト。
+
+検索関数は偽物を渡し、どの段が何本同時に走ったかを数える。
+"""
+from __future__ import annotations
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("requests")  # app.services.shops の予算コード表を使う
+
+from app.services import relax  # noqa: E402
+
+KWARGS = {
+    "area": "渋谷",
+    "budget_min": 3000,
+    "budget_max": 4000,
+    "genre_names": ["焼き鳥"],
+    "constraints": {"free_drink": True, "child": True},
+}
+
+
+class _Search:
+    """genre_names が外れた段（最後の段）でだけ見つかる検索。"""
+
+    def __init__(self, latency: float = 0.05) -> None:
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+        self.calls = 0
+
+    def __call__(self, **kw):
+        with self.lock:
+            self.calls += 1
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        try:
+            time.sleep(self.latency)
+            return [] if kw.get("genre_names") else [{"id": "J0001"}]
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+def test_returns_first_nonempty_rung_with_labels():
+    shops, relaxed = relax.search_with_relaxation(_Search(), KWARGS, speculation=2)
+    assert shops == [{"id": "J0001"}]
+    assert relaxed == ["飲み放題", "子連れ", "予算を1段上げた", "ジャンル指定なし"]
+
+
+def test_speculation_is_skipped_when_no_slot_is_free(monkeypatch):
+    monkeypatch.setattr(relax, "_speculation_slots", threading.BoundedSemaphore(1))
+    relax._speculation_slots.acquire()  # 他の呼び出しが枠を使い切っている
+    search = _Search()
+    shops, _ = relax.search_with_relaxation(search, KWARGS, speculation=3)
+    assert shops
+    # 先回りなしで、今見ている段だけを順に検索した
+    assert search.peak == 1
+    assert search.calls == len(relax.rungs(KWARGS))
+
+
+def test_speculation_is_bounded_across_callers(monkeypatch):
+    monkeypatch.setattr(relax, "_speculation_slots", threading.BoundedSemaphore(2))
+    search = _Search()
+    callers = [
+        threading.Thread(target=relax.search_with_relaxation, args=(search, KWARGS), kwargs={"speculation": 3})
+        for _ in range(4)
+    ]
+    for t in callers:
+        t.start()
+    for t in callers:
+        t.join(10)
+    # 呼び出しごとの今見ている段（4本）+ 全体で2本の先回り
+    assert search.peak <= 4 + 2
+    # 使い終わった枠は返っている
+    assert relax._speculation_slots.acquire(blocking=False)
+    assert relax._speculation_slots.acquire(blocking=False)
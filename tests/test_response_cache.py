@@ -0,0 +1,30 @@
+"""応答キャッシュのキーにモデルの設定（API キー）が入らないことを確かめる。"""
+from __future__ import annotations
+
+from app.agent.response_cache import CachedChatModel, model_namespace
+from app.cache import TTLCache
+from app.singleflight import canonical_key
+
+
+class _Pooled:
+    """PooledChatModel と同じく、str() すると API キー入りのクライアントが出るモデル。"""
+
+    def __init__(self) -> None:
+        self.model = "gemini-2.5-flash-lite"
+        self.clients = {"AIzaSECRET": object()}
+
+    def __repr__(self) -> str:
+        return f"_Pooled(model={self.model!r}, clients={self.clients!r})"
+
+
+def test_namespace_is_model_name_only():
+    cached = CachedChatModel(_Pooled(), TTLCache(ttl=60, max_entries=8))
+    assert cached.cache_namespace == "gemini-2.5-flash-lite"
+    assert model_namespace(cached) == "gemini-2.5-flash-lite"
+    key = canonical_key("interpret", model_namespace(cached), "会話", {})
+    assert "SECRET" not in key[1]
+
+
+def test_explicit_namespace_and_fallback():
+    assert CachedChatModel(_Pooled(), TTLCache(ttl=60, max_entries=8), cache_namespace="interpret-v2").cache_namespace == "interpret-v2"
+    assert model_namespace(object()) == "object"
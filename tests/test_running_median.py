@@ -0,0 +1,84 @@
+"""RunningMedian（app.store.aggregate）を statistics.median と突き合わせる。"""
+from __future__ import annotations
+import random
+import statistics
+
+import pytest
+
+from app.store.aggregate import RunningMedian
+
+
+def _check(rm: RunningMedian, values) -> None:
+    assert len(rm) == len(values)
+    assert rm.median() == (float(statistics.median(values)) if values else None)
+
+
+def test_empty():
+    rm = RunningMedian()
+    assert rm.median() is None
+    assert len(rm) == 0
+
+
+def test_odd_and_even_counts():
+    rm = RunningMedian()
+    values = []
+    for v in (5000, 3000, 4000, 8000):
+        rm.add(v)
+        values.append(v)
+        _check(rm, values)
+    assert rm.median() == 4500.0  # 偶数個は中央2値の平均
+
+
+def test_duplicates():
+    rm = RunningMedian()
+    values = [3000] * 5 + [4000] * 3 + [2000] * 2
+    for v in values:
+        rm.add(v)
+    _check(rm, values)
+    for v in (3000, 3000, 4000, 3000):
+        rm.remove(v)
+        values.remove(v)
+        _check(rm, values)
+
+
+def test_removing_a_missing_value_is_ignored():
+    rm = RunningMedian()
+    for v in (1000, 2000, 3000):
+        rm.add(v)
+    rm.remove(2500)
+    rm.remove(4000)
+    _check(rm, [1000, 2000, 3000])
+    rm.remove(2000)
+    rm.remove(2000)  # 2回目はもう無い
+    _check(rm, [1000, 3000])
+
+
+def test_remove_everything():
+    rm = RunningMedian()
+    for v in (1, 2, 2, 3):
+        rm.add(v)
+    for v in (2, 3, 1, 2):
+        rm.remove(v)
+    _check(rm, [])
+    rm.add(7)
+    _check(rm, [7])
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_inserts_and_removes(seed):
+    rng = random.Random(seed)
+    rm = RunningMedian()
+    values = []
+    for _ in range(600):
+        op = rng.random()
+        if op < 0.55 or not values:
+            v = rng.choice((2000, 3000, 4000, 5000, 6000)) if rng.random() < 0.5 else rng.randint(0, 20000)
+            rm.add(v)
+            values.append(v)
+        elif op < 0.95:
+            v = rng.choice(values)
+            rm.remove(v)
+            values.remove(v)
+        else:
+            rm.remove(-1)  # 入っていない値
+        _check(rm, values)
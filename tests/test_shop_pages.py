@@ -0,0 +1,100 @@
+"""iter_hotpepper_shops（ページ送りのジェネレータ）のテスト。
+
+偽の Hot Pepper（tests.fakes.fake_hotpepper）を HTTP で立て、何ページ
+取りに行ったか（サーバーが受けたリクエスト数）も確かめる。
+"""
+from __future__ import annotations
+import itertools
+import time
+
+import pytest
+
+pytest.importorskip("requests")
+
+from app.services import shops  # noqa: E402
+from tests.fakes import fake_hotpepper  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def server():
+    srv = fake_hotpepper.serve(0)
+    yield srv
+    srv.shutdown()
+
+
+@pytest.fixture
+def api(server, monkeypatch):
+    monkeypatch.setenv("HOTPEPPER_ENDPOINTS", fake_hotpepper.endpoint(server))
+    monkeypatch.setenv("HOTPEPPER_API_KEY", "test")
+    monkeypatch.delenv("HOTPEPPER_CATALOG_PATH", raising=False)
+    monkeypatch.setattr(shops, "_client", None)
+
+    def use(keyword: str, n: int) -> list:
+        """keyword の店を n 件にする（結果キャッシュと混ざらないよう keyword はテストごとに変える）。"""
+        monkeypatch.setenv("FAKE_HOTPEPPER_SHOPS", str(n))
+        return [s["id"] for s in fake_hotpepper.shops_for(keyword)]
+
+    return use
+
+
+def _served() -> int:
+    return fake_hotpepper._Handler.requests_served
+
+
+def _walk(keyword: str, **kw) -> list:
+    return [s["id"] for s in shops.iter_hotpepper_shops(keyword, None, None, page_size=20, **kw)]
+
+
+def test_pages_are_joined_across_the_boundary(api):
+    expected = api("ページ境界", 45)
+    before = _served()
+    assert _walk("ページ境界") == expected  # 20 + 20 + 5 件、重複も欠けもない
+    assert _served() - before == 3
+
+
+def test_stops_at_results_available(api):
+    expected = api("ちょうど2ページ", 40)
+    before = _served()
+    assert _walk("ちょうど2ページ") == expected
+    # 40件 = 20件 × 2 ページ。3ページ目（空）は取りに行かない
+    assert _served() - before == 2
+
+
+def test_empty_last_page_ends_the_walk(api, monkeypatch):
+    expected = api("空の最終ページ", 40)
+    real_search = fake_hotpepper.search
+
+    def overcounting(params):
+        # results_available が実際より多い（検索中に店が減った）ときは空ページで止まる
+        data = real_search(params)
+        data["results"]["results_available"] += 100
+        return data
+
+    monkeypatch.setattr(fake_hotpepper, "search", overcounting)
+    before = _served()
+    assert _walk("空の最終ページ") == expected
+    assert _served() - before == 3
+
+
+def test_closing_early_stops_fetching(api):
+    expected = api("途中で閉じる", 200)
+    before = _served()
+    gen = shops.iter_hotpepper_shops("途中で閉じる", None, None, page_size=20, prefetch=True)
+    assert [s["id"] for s in itertools.islice(gen, 3)] == expected[:3]
+    gen.close()
+    time.sleep(0.2)  # 先読みがあればここで終わっている
+    # 1ページ目と、せいぜい先読みの2ページ目まで
+    assert _served() - before <= 2
+    with pytest.raises(StopIteration):
+        next(gen)
+
+
+def test_top_k_and_page_budget(api):
+    expected = api("上限", 200)
+    before = _served()
+    assert _walk("上限", top_k=25) == expected[:25]
+    assert _served() - before == 2
+    before = _served()
+    assert _walk("上限", max_requests=3, prefetch=False) == expected[:60]
+    # 1・2ページ目は結果キャッシュに載っているので、サーバーへは3ページ目だけ
+    assert _served() - before == 1
@@ -0,0 +1,239 @@
+"""ストアの同時書き込みストレステスト。
+
+参加可否・モーダル送信・投票のイベントを数千件、スレッドプールから並行に
+投げ、最終的な投票集計・参加者集計が逐次に計算した期待値と一致するかを
+MemoryStore / SQLiteStore / JournaledStore で確かめる。JournaledStore は
+閉じて開き直し、ジャーナル（とスナップショット）の再生結果も比べる。
+
+1ユーザーのイベントは1タスクの中で順に投げる（Slack でも同じユーザーの
+操作は順に届く）ので、最終状態はユーザーごとの最後の値で決まる。
+"""
+from __future__ import annotations
+import random
+import statistics
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+import pytest
+
+from app.store import JournaledStore, MemoryStore, SQLiteStore
+from app.store.aggregate import DEFAULT_BUDGET
+
+PLANS = ("1700000000.000100", "1700000000.000200", "1700000000.000300")
+USERS_PER_PLAN = 120
+EVENTS_PER_USER = 12  # 3企画 × 120人 × 12件 = 4320 イベント
+AREAS = ("渋谷", "新宿", "池袋", "品川")
+CUISINES = ("居酒屋", "焼肉", "イタリアン", "中華", "和食", "寿司")
+DATES = tuple(f"2026-11-{d:02d}" for d in range(1, 15))
+
+Event = Tuple[str, Any]
+
+
+def _events(plan: str, user: str) -> List[Event]:
+    rng = random.Random(f"{plan}:{user}")
+    out: List[Event] = []
+    for _ in range(EVENTS_PER_USER):
+        kind = rng.choice(("attendance", "modal", "vote"))
+        if kind == "attendance":
+            out.append(("upsert", {"attendance": rng.choice(("yes", "maybe", "no"))}))
+        elif kind == "modal":
+            bmin = rng.choice((2000, 3000, 4000, 5000))
+            out.append(("upsert", {
+                "attendance": rng.choice(("yes", "maybe")),
+                "dates": sorted(rng.sample(DATES, rng.randint(1, 3))),
+                "area": rng.choice(AREAS),
+                "budget_min": bmin,
+                "budget_max": bmin + rng.choice((1000, 2000, 3000)),
+                "cuisine": ", ".join(rng.sample(CUISINES, rng.randint(1, 2))),
+            }))
+        else:
+            out.append(("vote", rng.randint(1, 3)))
+    return out
+
+
+def _workload() -> Dict[str, Dict[str, List[Event]]]:
+    return {plan: {f"U{i:04d}": _events(plan, f"U{i:04d}") for i in range(USERS_PER_PLAN)} for plan in PLANS}
+
+
+def _expected(users: Dict[str, List[Event]]) -> Dict[str, Any]:
+    """イベントを逐次に当てた最終状態から、集計の期待値を作る。"""
+    rows: Dict[str, Dict[str, Any]] = {}
+    votes: Dict[str, int] = {}
+    for user, events in users.items():
+        for kind, payload in events:
+            if kind == "upsert":
+                rows.setdefault(user, {}).update(payload)
+            else:
+                votes[user] = payload
+
+    attendance = Counter(r.get("attendance") for r in rows.values())
+    eligible = {u for u, r in rows.items() if r.get("attendance") in ("yes", "maybe")}
+    dates: Counter = Counter()
+    areas: Counter = Counter()
+    cuisines: Counter = Counter()
+    bmins: List[int] = []
+    bmaxs: List[int] = []
+    filled = 0
+    for u, r in rows.items():
+        if u not in eligible:
+            filled += r.get("attendance") == "no"
+            continue
+        filled += bool(r.get("dates"))
+        dates.update(r.get("dates") or ())
+        if r.get("area"):
+            areas[r["area"]] += 1
+        cuisines.update(c.strip() for c in (r.get("cuisine") or "").split(",") if c.strip())
+        if r.get("budget_min") is not None:
+            bmins.append(r["budget_min"])
+        if r.get("budget_max") is not None:
+            bmaxs.append(r["budget_max"])
+
+    counter = {i: 0 for i in (1, 2, 3)}
+    for idx in votes.values():
+        counter[idx] += 1
+    budget = (int(statistics.median(bmins)), int(statistics.median(bmaxs))) if bmins and bmaxs else DEFAULT_BUDGET
+    return {
+        "snapshot": {
+            "counter": counter,
+            "eligible_total": len(eligible),
+            "voted_count": len(votes),
+            "complete": bool(eligible) and eligible <= set(votes),
+        },
+        "eligible": eligible,
+        "voters": set(votes),
+        "attendance": attendance,
+        "filled": filled,
+        "dates": dates,
+        "areas": areas,
+        "cuisines": cuisines,
+        "budget": budget,
+        "total": len(rows),
+    }
+
+
+def _run(store, workload: Dict[str, Dict[str, List[Event]]], on_progress=None) -> None:
+    for i, plan in enumerate(PLANS):
+        store.create_plan(plan, f"C{i}", f"企画{i}")
+
+    def play(plan: str, user: str, events: List[Event]) -> None:
+        for kind, payload in events:
+            if kind == "upsert":
+                store.upsert_participant(plan, user, payload)
+            else:
+                store.record_vote(plan, user, payload)
+
+    tasks = [(plan, user, events) for plan, users in workload.items() for user, events in users.items()]
+    random.Random(0).shuffle(tasks)
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        futures = [pool.submit(play, *t) for t in tasks]
+        if on_progress is not None:
+            on_progress()
+        for f in futures:
+            f.result()
+
+
+def _check(store, workload: Dict[str, Dict[str, List[Event]]]) -> None:
+    for plan in PLANS:
+        exp = _expected(workload[plan])
+
+        assert store.vote_snapshot(plan) == exp["snapshot"]
+        assert store.tally_votes(plan) == exp["snapshot"]["counter"]
+        assert set(store.eligible_voter_ids(plan)) == exp["eligible"]
+        assert set(store.voters_who_voted(plan)) == exp["voters"]
+
+        summary = store.participants_summary(plan)
+        assert summary["total"] == exp["total"]
+        assert summary["yes"] == exp["attendance"]["yes"]
+        assert summary["maybe"] == exp["attendance"]["maybe"]
+        assert summary["no"] == exp["attendance"]["no"]
+        assert summary["participants_count"] == len(exp["eligible"])
+        assert summary["filled"] == exp["filled"]
+        assert dict(summary["date_counts"]) == dict(exp["dates"])
+        assert summary["budget"] == exp["budget"]
+        # 同数の候補があると順位は決まらないので、件数で比べる
+        assert exp["areas"][summary["area"]] == max(exp["areas"].values())
+        top = sorted((n for _, n in exp["cuisines"].most_common()), reverse=True)[:3]
+        assert sorted((exp["cuisines"][c] for c in summary["cuisine"]), reverse=True) == top
+
+        # 差分更新した集計と、残っている参加者レコードが食い違っていない
+        assert len(store.list_participants(plan)) == exp["total"]
+
+
+@pytest.fixture(scope="module")
+def workload() -> Dict[str, Dict[str, List[Event]]]:
+    return _workload()
+
+
+def test_memory_store_concurrent_events(workload):
+    store = MemoryStore()
+    _run(store, workload)
+    _check(store, workload)
+
+
+def test_sqlite_store_concurrent_events(workload, tmp_path):
+    path = str(tmp_path / "kanjiro.db")
+    store = SQLiteStore(path)
+    _run(store, workload)
+    _check(store, workload)
+    store.close()
+
+    # コミット済みの行から集計を組み立て直しても同じ
+    reopened = SQLiteStore(path)
+    try:
+        _check(reopened, workload)
+    finally:
+        reopened.close()
+
+
+def test_journaled_store_concurrent_events_and_replay(workload, tmp_path):
+    directory = str(tmp_path / "journal")
+    store = JournaledStore(directory, fsync_interval=0.01, snapshot_interval=3600)
+    # 書き込みの途中でスナップショットを取り、スナップショット + 残りのジャーナルの再生を通す
+    _run(store, workload, on_progress=store.snapshot)
+    _check(store, workload)
+    store.close()
+
+    replayed = JournaledStore(directory, fsync_interval=0.01, snapshot_interval=3600)
+    try:
+        _check(replayed, workload)
+    finally:
+        replayed.close()
+
+
+def test_sqlite_cached_reads_do_not_wait_for_the_connection(tmp_path):
+    import threading
+
+    store = SQLiteStore(str(tmp_path / "kanjiro.db"))
+    try:
+        store.create_plan(PLANS[0], "C0", "企画")
+        store.upsert_participant(PLANS[0], "U1", {"attendance": "yes"})
+        store.record_vote(PLANS[0], "U1", 2)
+        store.vote_snapshot(PLANS[0])  # 集計をキャッシュに載せる
+        store.participants_summary(PLANS[0])
+
+        held, release = threading.Event(), threading.Event()
+
+        def hold_connection():
+            with store._db_lock:
+                held.set()
+                release.wait(5)
+
+        holder = threading.Thread(target=hold_connection)
+        holder.start()
+        held.wait(5)
+        try:
+            # 接続を他のスレッドが握っていても、集計済みの読み出しは返る
+            result = {}
+            reader = threading.Thread(target=lambda: result.update(
+                votes=store.tally_votes(PLANS[0]), summary=store.participants_summary(PLANS[0])
+            ))
+            reader.start()
+            reader.join(1)
+            assert result.get("votes") == {1: 0, 2: 1, 3: 0}
+            assert result["summary"]["yes"] == 1
+        finally:
+            release.set()
+            holder.join(5)
+    finally:
+        store.close()
@@ -0,0 +1,83 @@
+"""企画の期限切れ・退避（expired_plans / evict_plan）のテスト。
+
+MemoryStore と SQLiteStore で同じ期限の決まり方になることを確かめる。
+特に、企画の無いスレッド（退避後に遅れて届いたクリックなど）も
+最後に触られてから idle_ttl 経ってから退避される。
+"""
+from __future__ import annotations
+import sqlite3
+import time
+
+import pytest
+
+from app.store import MemoryStore, SQLiteStore
+
+DONE_TTL = 100.0
+IDLE_TTL = 1000.0
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    s = MemoryStore() if request.param == "memory" else SQLiteStore(str(tmp_path / "kanjiro.db"))
+    yield s
+    s.close()
+
+
+def _expired(store, now):
+    return store.expired_plans(now, DONE_TTL, IDLE_TTL, limit=10)
+
+
+def test_done_and_idle_plans_expire(store):
+    store.create_plan("1.0", "C1", "done")
+    store.create_plan("2.0", "C1", "idle")
+    store.update_plan_status("1.0", "done")
+    now = time.time()
+    assert _expired(store, now) == []
+    assert _expired(store, now + DONE_TTL + 1) == ["1.0"]
+    assert _expired(store, now + IDLE_TTL + 1) == ["1.0", "2.0"]
+
+
+def test_orphans_wait_for_the_idle_ttl(store):
+    # 企画が無いまま投票・参加可否だけ届いた
+    store.record_vote("9.0", "U1", 2)
+    store.upsert_participant("9.0", "U1", {"attendance": "yes"})
+    now = time.time()
+    assert _expired(store, now + DONE_TTL + 1) == []
+    assert _expired(store, now + IDLE_TTL + 1) == ["9.0"]
+
+    result = store.evict_plan("9.0")
+    assert result["thread_ts"] == "9.0"
+    assert result["channel_id"] is None
+    assert result["votes"] == {"1": 0, "2": 1, "3": 0}
+    assert store.tally_votes("9.0") == {1: 0, 2: 0, 3: 0}
+    assert store.list_participants("9.0") == []
+    assert _expired(store, now + IDLE_TTL + 1) == []
+    assert store.evict_plan("9.0") is None
+
+
+def test_plan_created_later_is_no_longer_an_orphan(store):
+    store.record_vote("9.0", "U1", 1)
+    store.create_plan("9.0", "C1", "後から作られた企画")
+    now = time.time()
+    assert _expired(store, now + IDLE_TTL + 1) == ["9.0"]
+    assert store.evict_plan("9.0")["channel_id"] == "C1"
+    assert _expired(store, now + IDLE_TTL + 1) == []
+
+
+def test_existing_orphans_are_backfilled_on_migration(tmp_path):
+    path = str(tmp_path / "old.db")
+    SQLiteStore(path).close()
+    # orphans 表の無い旧スキーマで、企画の無い投票が残っている
+    conn = sqlite3.connect(path)
+    conn.execute("DROP TABLE orphans")
+    conn.execute("INSERT INTO votes (thread_ts, user_id, idx) VALUES ('8.0', 'U1', 1)")
+    conn.commit()
+    conn.close()
+
+    store = SQLiteStore(path)
+    try:
+        now = time.time()
+        assert _expired(store, now) == []
+        assert _expired(store, now + IDLE_TTL + 1) == ["8.0"]
+    finally:
+        store.close()
@@ -0,0 +1,32 @@
+"""トークン数見積もり（app.agent.tokens）の係数の引き直しのテスト。"""
+from __future__ import annotations
+
+import pytest
+
+from app.agent.tokens import _SAMPLES, DEFAULT_RATES, TokenEstimator, calibrate, char_class_counts
+
+TRUE_RATES = (1.1, 0.5, 0.6, 0.3, 0.1, 0.7, 2.0)
+
+
+def _tokens(text: str) -> int:
+    return round(sum(c * r for c, r in zip(char_class_counts(text), TRUE_RATES)))
+
+
+def test_calibrate_recovers_rates_from_counts():
+    samples = [(s, _tokens(s)) for s in _SAMPLES]
+    est = calibrate(samples)
+    for s, actual in samples:
+        assert est.count_text(s) == pytest.approx(actual, abs=1)
+    # ベンチマークのサンプルは全文字種を含む（引き直しで既定値のまま残る係数がない）
+    assert all(c for c in map(sum, zip(*(char_class_counts(s) for s in _SAMPLES))))
+
+
+def test_classes_missing_from_samples_keep_default_rates():
+    est = calibrate([("あいうえお", 3), ("かきくけこさしすせそ", 6)])
+    assert est.rates[0] == DEFAULT_RATES[0]  # 漢字は出てこない
+    assert est.rates[1] == pytest.approx(0.6, abs=0.01)
+
+
+def test_message_overhead_is_added_per_message():
+    est = TokenEstimator(rates=(1,) * 7, message_overhead=3)
+    assert est.count_messages(["abc", "de"]) == 3 + 3 + 3 + 2